@@ -7,6 +7,7 @@ except ImportError:
     raise ImportError("AstroData requires the 'future' package for Python 2/3 compatibility")
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+from contextlib import contextmanager
 from functools import wraps
 import inspect
 from collections import namedtuple
@@ -59,14 +60,24 @@ class TagSet(namedtuple('TagSet', 'add remove blocked_by blocks if_present')):
                                                if_present or set())
 
 
+def _copy_value(value):
+    # Memoised values are handed out as copies, in case the caller modifies them
+    if isinstance(value, (list, dict)):
+        return value.copy() if isinstance(value, dict) else list(value)
+    return value
+
+
 def astro_data_descriptor(fn):
     """
     Decorator that will mark a class method as an AstroData descriptor.
     Useful to produce list of descriptors, for example.
 
     If used in combination with other decorators, this one *must* be the
-    one on the top (ie. the last one applying). It doesn't modify the
-    method in any other way.
+    one on the top (ie. the last one applying).
+
+    The values returned by the method are memoised while the instance is
+    within an `AstroData.memoized_descriptors` block. Otherwise, the method
+    is just called.
 
     Args
     -----
@@ -75,10 +86,32 @@ def astro_data_descriptor(fn):
 
     Returns
     --------
-    The tagged method (not a wrapper)
+    A wrapper function
     """
-    fn.descriptor_method = True
-    return fn
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        cache = self._descriptor_cache
+        if cache is None:
+            return fn(self, *args, **kwargs)
+
+        generation = self._dataprov.generation
+        if generation is None:
+            return fn(self, *args, **kwargs)
+
+        key = (fn, self.is_single, generation, args, tuple(sorted(kwargs.items())))
+        try:
+            return _copy_value(cache[key])
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable arguments
+            return fn(self, *args, **kwargs)
+
+        ret = cache[key] = fn(self, *args, **kwargs)
+        return _copy_value(ret)
+
+    wrapper.descriptor_method = True
+    return wrapper
 
 
 def returns_list(fn):
@@ -193,6 +226,21 @@ class DataProvider(with_metaclass(ABCMeta, object)):
         """
         return False
 
+    @property
+    def generation(self):
+        """
+        A value that changes every time that the metadata of this provider
+        is modified (headers edited, extensions appended or deleted...). It
+        is used to decide if information derived from the metadata (like
+        the tags) needs to be computed again.
+
+        Returns
+        --------
+        A hashable object, or None if the provider can't keep track of the
+        changes, in which case nothing is cached
+        """
+        return None
+
     @abstractmethod
     def is_settable(self, attribute):
         """
@@ -464,11 +512,18 @@ class AstroData(object):
     # Simply a value that nobody is going to try to set an NDData attribute to
     _IGNORE = -23
 
+    # Tag methods and descriptor names for each of the classes, found the first
+    # time they're needed
+    _tag_methods_cache = {}
+    _descriptor_names_cache = {}
+
     def __init__(self, provider):
         if not isinstance(provider, DataProvider):
             raise ValueError("AstroData is initialized with a DataProvider object. You may want to use ad.open('...') instead")
         self._dataprov = provider
         self._processing_tags = False
+        self._tags_cache = (None, None)
+        self._descriptor_cache = None
 
     def __deepcopy__(self, memo):
         """
@@ -489,6 +544,28 @@ class AstroData(object):
         ad = self.__class__(dp)
         return ad
 
+    @classmethod
+    def _tag_methods(cls):
+        """
+        Returns the methods of this class that have been decorated with
+        `astro_data_tag`. They're looked up only once per class.
+
+        Returns
+        --------
+        A tuple of unbound methods
+        """
+        try:
+            return AstroData._tag_methods_cache[cls]
+        except KeyError:
+            # Calling inspect.getmembers on an instance would trigger all the properties
+            # (tags, phu, hdr, etc.), and that's undesirable. To prevent that, we inspect
+            # the *class*. But that returns us unbound methods. We use `method.__get__(self)`
+            # to get a bound version when we need it.
+            methods = tuple(method for (mname, method)
+                            in inspect.getmembers(cls, lambda x: hasattr(x, 'tag_method')))
+            AstroData._tag_methods_cache[cls] = methods
+            return methods
+
     def __process_tags(self):
         """
         Determines the tag set for the current instance
@@ -503,14 +580,7 @@ class AstroData(object):
         self._processing_tags = True
         try:
             results = []
-            # Calling inspect.getmembers on `self` would trigger all the properties (tags,
-            # phu, hdr, etc.), and that's undesirable. To prevent that, we'll inspect the
-            # *class*. But that returns us unbound methods. We use `method.__get__(self)` to
-            # get a bound version.
-            #
-            # It's a bit of a roundabout way to get to what we want, but it's better than
-            # the option...
-            for mname, method in inspect.getmembers(self.__class__, lambda x: hasattr(x, 'tag_method')):
+            for method in self._tag_methods():
                 ts = method.__get__(self)()
                 plus, minus, blocked_by, blocks, if_present = ts
                 if plus or minus or blocks:
@@ -547,8 +617,22 @@ class AstroData(object):
     def tags(self):
         """
         A set of strings that represent the tags defining this instance
+
+        The set is cached, and computed again only if the metadata has been
+        modified since the last time (see `DataProvider.generation`).
         """
-        return self.__process_tags()
+        generation = self._dataprov.generation
+        if generation is None:
+            return self.__process_tags()
+
+        cached_generation, tags = self._tags_cache
+        if tags is None or cached_generation != generation:
+            tags = self.__process_tags()
+            # A nested call (from a tag method) returns an incomplete set
+            if not self._processing_tags:
+                self._tags_cache = (generation, tags)
+
+        return set(tags)
 
     @property
     def descriptors(self):
@@ -560,13 +644,47 @@ class AstroData(object):
         --------
         A tuple of str
         """
-        members = inspect.getmembers(self.__class__,
-                                     lambda x: hasattr(x, 'descriptor_method'))
-        return tuple(mname for (mname, method) in members)
+        cls = self.__class__
+        try:
+            return AstroData._descriptor_names_cache[cls]
+        except KeyError:
+            members = inspect.getmembers(cls, lambda x: hasattr(x, 'descriptor_method'))
+            names = AstroData._descriptor_names_cache[cls] = tuple(mname for (mname, method) in members)
+            return names
+
+    @contextmanager
+    def memoized_descriptors(self):
+        """
+        Context manager that memoises the values returned by the descriptors
+        of this instance (and of any slice taken from it) for the duration of
+        the block. Values are stored per descriptor and arguments, and they
+        are computed again if the headers are modified.
+
+        This is useful when the same descriptors are evaluated many times, as
+        they also call each other.
+
+        Examples
+        ---------
+        >>> with ad.memoized_descriptors():
+        ...     values = [getattr(ad, name)() for name in ad.descriptors]
+        """
+        previous = self._descriptor_cache
+        if previous is None:
+            self._descriptor_cache = {}
+        try:
+            yield self
+        finally:
+            self._descriptor_cache = previous
+
+    def _new_slice(self, provider):
+        # Slices share the memoised descriptor values with their parent
+        ad = self.__class__(provider)
+        ad._descriptor_cache = self._descriptor_cache
+        return ad
 
     def __iter__(self):
         for single in self._dataprov:
-            yield self.__class__(single)
+            yield self._new_slice(single)
 
     def __getitem__(self, slicing):
         """
@@ -595,7 +713,7 @@ class AstroData(object):
         >>> single = ad[0]
         >>> multiple = ad[:5]
         """
-        return self.__class__(self._dataprov[slicing])
+        return self._new_slice(self._dataprov[slicing])
 
     def __delitem__(self, idx):
         """
@@ -876,11 +994,14 @@ class AstroData(object):
 
     # This method needs to be implemented as classmethod
     @abstractmethod
-    def load(cls, source):
+    def load(cls, source, path=None):
         """
         Class method that returns an instance of this same class, properly initialized
         with a DataProvider that can deal with the object passed as `source`
 
+        If `source` is an already-opened file object, `path` is the name of the
+        file it was opened from.
+
         This method is abstract and has to be implemented by derived classes.
         """
         pass
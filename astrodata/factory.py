@@ -7,11 +7,15 @@ from astropy.io import fits
 from astropy.io.fits import HDUList, PrimaryHDU, ImageHDU, Header, DELAYED
 
 from .core import AstroDataError
+from .fits import read_fits_headers
 
 def fits_opener(source):
     if isinstance(source, HDUList):
         return source
-    return fits.open(source, memmap=True)
+    # Use the same options as FitsLoader.load(), so that the HDUList used to
+    # find the matching AstroData class can also be used to load the data
+    return fits.open(source, memmap=True, do_not_scale_image_data=True,
+                     mode='readonly')
 
 class AstroDataFactory(object):
     _file_openers = (
@@ -53,7 +57,24 @@ class AstroDataFactory(object):
             raise AttributeError("Class '{}' has no '_matches_data' method".format(cls.__name__))
         self._registry.add(cls)
 
-    def getAstroData(self, source):
+    @staticmethod
+    def _openHeaders(source):
+        """
+        Internal static method that, for a `source` that is a string, reads
+        only the headers of the file, without mapping any of the data.
+
+        It falls back to `_openFile` for anything that can't be read this way.
+        """
+        if isinstance(source, (str if PY3 else basestring)):
+            try:
+                opened = read_fits_headers(source)
+            except Exception:
+                opened = None
+            if opened is not None:
+                return opened
+        return AstroDataFactory._openFile(source)
+
+    def getAstroData(self, source, headers_only=False):
         """
         Takes either a string (with the path to a file) or an HDUList as input, and
         tries to return an AstroData instance.
@@ -61,11 +82,20 @@ class AstroDataFactory(object):
         It will raise exceptions if the file is not found, or if there is no match
         for the HDUList, among the registered AstroData classes.
 
+        If `headers_only` is True, only the headers of the file are read. The
+        resulting object can be used to compute tags and descriptors, but
+        trying to access the pixel data will raise an AstroDataError, and the
+        table extensions are not loaded. This is much faster when scanning a
+        large number of files. Compressed files are still opened in full.
+
         Returns an instantiated object, or raises AstroDataError if it was
         not possible to find a match
         """
 
-        opened = self._openFile(source)
+        if headers_only:
+            opened = self._openHeaders(source)
+        else:
+            opened = self._openFile(source)
         candidates = []
         for adclass in self._registry:
             try:
@@ -82,11 +112,17 @@ class AstroDataFactory(object):
                 continue
             final_candidates.append(cnd)
 
-        if len(final_candidates) > 1:
-            raise AstroDataError("More than one class is candidate for this dataset")
-        elif not final_candidates:
+        if len(final_candidates) != 1:
+            if opened is not source:
+                opened.close()
+            if final_candidates:
+                raise AstroDataError("More than one class is candidate for this dataset")
             raise AstroDataError("No class matches this dataset")
 
+        if opened is not source:
+            # We opened the file, so pass on the HDUList (with its file
+            # handle and memmap) rather than have it opened and parsed again
+            return final_candidates[0].load(opened, path=source)
         return final_candidates[0].load(source)
 
     def createFromScratch(self, phu, extensions=None):
@@ -13,6 +13,8 @@ import warnings
 import gc
 import inspect
 import traceback
+from itertools import count
+from multiprocessing.pool import ThreadPool
 
 try:
     # Python 3
@@ -20,13 +22,13 @@ try:
 except ImportError:
     from itertools import izip_longest as zip_longest, product as cart_product
 
-from .core import AstroData, DataProvider, astro_data_descriptor
+from .core import AstroData, AstroDataError, DataProvider, astro_data_descriptor
 from .nddata import NDAstroData as NDDataObject, new_variance_uncertainty_instance
 
 import astropy
 from astropy.io import fits
 from astropy.io.fits import HDUList, Header, DELAYED
-from astropy.io.fits import PrimaryHDU, ImageHDU, BinTableHDU
+from astropy.io.fits import PrimaryHDU, ImageHDU, BinTableHDU, TableHDU
 from astropy.io.fits import Column, FITS_rec
 from astropy.io.fits.hdu.table import _TableBaseHDU
 # NDDataRef is still not in the stable astropy, but this should be the one
@@ -181,6 +183,66 @@ class FitsHeaderCollection(object):
     def __contains__(self, key):
         return any(tuple(key in h for h in self.__headers))
 
+_header_generations = count(1)
+
+class _TrackedHeader(Header):
+    """
+    Header that takes a new generation number every time it is modified.
+
+    The headers handled by a `FitsProvider` are turned into instances of this
+    class the first time that the provider is asked for its generation, so
+    that modifications made through the `Header` interface are detected even
+    when they bypass AstroData. Changes made directly to `Card` objects go
+    unnoticed.
+    """
+    def _modified_now(self):
+        self._ad_generation = next(_header_generations)
+
+    def __setitem__(self, key, value):
+        super(_TrackedHeader, self).__setitem__(key, value)
+        self._modified_now()
+
+    def __delitem__(self, key):
+        super(_TrackedHeader, self).__delitem__(key)
+        self._modified_now()
+
+    def append(self, *args, **kw):
+        super(_TrackedHeader, self).append(*args, **kw)
+        self._modified_now()
+
+    def insert(self, *args, **kw):
+        super(_TrackedHeader, self).insert(*args, **kw)
+        self._modified_now()
+
+    def _update(self, card):
+        super(_TrackedHeader, self)._update(card)
+        self._modified_now()
+
+    def clear(self):
+        super(_TrackedHeader, self).clear()
+        self._modified_now()
+
+def header_generation(header):
+    """
+    Returns a number that changes each time that `header` is modified, or
+    None if there's no way to keep track of the changes.
+    """
+    if not isinstance(header, _TrackedHeader):
+        if type(header) is not Header:
+            return None
+        # Same layout, so we can just swap the class instead of copying it
+        header.__class__ = _TrackedHeader
+        header._modified_now()
+    return header._ad_generation
+
+def _headers_generation(headers):
+    try:
+        # Fast path, for headers that are already being tracked
+        return tuple([h._ad_generation for h in headers])
+    except AttributeError:
+        generation = tuple(header_generation(h) for h in headers)
+        return None if None in generation else generation
+
 def new_imagehdu(data, header, name=None):
 # Assigning data in a delayed way, won't reset BZERO/BSCALE in the header,
 # for some reason. Need to investigated. Maybe astropy.io.fits bug. Figure
@@ -469,6 +531,10 @@ class FitsProviderProxy(DataProvider):
     def header(self):
         return self._provider._get_raw_headers(with_phu=True, indices=self._mapping)
 
+    @property
+    def generation(self):
+        return _headers_generation(self._provider._get_raw_headers(with_phu=True, indices=self._mapping))
+
     @property
     def data(self):
         if self.is_single:
@@ -996,6 +1062,10 @@ class FitsProvider(DataProvider):
     def header(self):
         return self._get_raw_headers(with_phu=True)
 
+    @property
+    def generation(self):
+        return _headers_generation([self._phu] + [nd.meta['header'] for nd in self._nddata])
+
     @property
     def nddata(self):
         return self._nddata
@@ -1369,6 +1439,82 @@ class FitsLazyLoadable(object):
             dtype = np.uint16
         return dtype
 
+class FitsHeaderOnlyLoadable(FitsLazyLoadable):
+    """Lazy loadable for an HDU read with `read_fits_headers`. It knows
+       its shape and type, but there is no pixel data behind it."""
+    def _no_data(self):
+        raise AstroDataError("The pixel data is not available: the file was "
+                             "opened with headers_only=True")
+
+    def __getitem__(self, sl):
+        self._no_data()
+
+    @property
+    def data(self):
+        self._no_data()
+
+class HeaderOnlyHDUList(HDUList):
+    """HDUList made of header-only HDUs, as returned by `read_fits_headers`"""
+    pass
+
+_HEADER_ONLY_HDUS = {
+    'IMAGE': ImageHDU,
+    'BINTABLE': BinTableHDU,
+    'TABLE': TableHDU,
+}
+
+def _data_size(header):
+    naxis = header.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    first = 2 if header.get('GROUPS') and header.get('NAXIS1') == 0 else 1
+    npix = 1
+    for n in range(first, naxis + 1):
+        npix *= header['NAXIS{}'.format(n)]
+    size = (abs(header['BITPIX']) // 8 * header.get('GCOUNT', 1) *
+            (header.get('PCOUNT', 0) + npix))
+    # Data units are padded to a multiple of the FITS block size
+    return -(-size // 2880) * 2880
+
+def read_fits_headers(filename):
+    """
+    Reads only the headers of a FITS file, seeking past the data units.
+
+    Parameters
+    ----------
+    filename : str
+        Path to an uncompressed FITS file
+
+    Returns
+    -------
+    HeaderOnlyHDUList or None
+        The HDUs in the list have their data marked as `DELAYED` and are not
+        associated to any file, meaning that their pixels can't be read.
+        Returns None if this is not a plain FITS file (eg. it is gzipped, or
+        it contains tile-compressed images) and needs to be opened in full.
+    """
+    hdus = []
+    with open(filename, 'rb') as fileobj:
+        if fileobj.read(6) != b'SIMPLE':
+            return None
+        fileobj.seek(0)
+        while True:
+            try:
+                header = Header.fromfile(fileobj)
+            except EOFError:
+                break
+            if not hdus:
+                hdus.append(PrimaryHDU(data=DELAYED, header=header))
+            else:
+                if header.get('ZIMAGE'):
+                    return None
+                hdu_class = _HEADER_ONLY_HDUS.get(header.get('XTENSION', '').strip())
+                if hdu_class is not None:
+                    hdus.append(hdu_class(data=DELAYED, header=header))
+            fileobj.seek(_data_size(header), os.SEEK_CUR)
+
+    return HeaderOnlyHDUList(hdus)
+
 class FitsLoader(object):
     def __init__(self, cls = FitsProvider):
         self._cls = cls
@@ -1378,8 +1524,15 @@ class FitsLoader(object):
         new_list = []
         highest_ver = 0
         recognized = set()
+        headers_only = isinstance(hdulist, HeaderOnlyHDUList)
 
-        if len(hdulist) > 1 or (len(hdulist) == 1 and hdulist[0].data is None):
+        if headers_only:
+            # Don't touch the data, even to find out if there's any
+            no_primary_data = hdulist[0].header.get('NAXIS', 0) == 0
+        else:
+            no_primary_data = hdulist[0].data is None
+
+        if len(hdulist) > 1 or (len(hdulist) == 1 and no_primary_data):
             # MEF file
             for n, unit in enumerate(hdulist):
                 if extname_parser:
@@ -1409,7 +1562,8 @@ class FitsLoader(object):
         else:
             # Uh-oh, a single image FITS file
             new_list.append(PrimaryHDU(header=hdulist[0].header))
-            image = ImageHDU(header=hdulist[0].header, data=hdulist[0].data)
+            image = ImageHDU(header=hdulist[0].header,
+                             data=DELAYED if headers_only else hdulist[0].data)
             # Fudge due to apparent issues with assigning ImageHDU from data
             image._orig_bscale = hdulist[0]._orig_bscale
             image._orig_bzero = hdulist[0]._orig_bzero
@@ -1422,13 +1576,21 @@ class FitsLoader(object):
             image.header['EXTVER'] = (1, 'Added by AstroData')
             new_list.append(image)
 
-        return HDUList(sorted(new_list, key=fits_ext_comp_key))
+        return (HeaderOnlyHDUList if headers_only else HDUList)(sorted(new_list, key=fits_ext_comp_key))
 
-    def load(self, source, extname_parser=None):
+    def load(self, source, extname_parser=None, path=None):
         """
         Takes either a string (with the path to a file) or an HDUList as input, and
         tries to return a populated FitsProvider (or descendant) instance.
 
+        If an HDUList is provided, `path` can be used to indicate the file it
+        was opened from. It should have been opened with the same options
+        used here (memmap=True, do_not_scale_image_data=True).
+
+        If the HDUList comes from `read_fits_headers`, the provider will only
+        hold the headers: the pixel planes can't be accessed, and the tables
+        and any other extensions are left out.
+
         It will raise exceptions if the file is not found, or if there is no match
         for the HDUList, among the registered AstroData classes.
         """
@@ -1440,9 +1602,10 @@ class FitsLoader(object):
             provider.path = source
         else:
             hdulist = source
-            provider.path = None
+            provider.path = path
 
         def_ext = self._cls.default_extension
+        headers_only = isinstance(hdulist, HeaderOnlyHDUList)
         _file = hdulist._file
         hdulist = self._prepare_hdulist(hdulist, default_extension=def_ext,
                                         extname_parser=extname_parser)
@@ -1479,7 +1642,15 @@ class FitsLoader(object):
                 else:
                     parts['other'].append(extra_unit)
 
-            if hdulist._file is not None and hdulist._file.memmap:
+            if headers_only:
+                nd = NDDataObject(
+                        data = FitsHeaderOnlyLoadable(parts['data']),
+                        uncertainty = None if parts['uncertainty'] is None else FitsHeaderOnlyLoadable(parts['uncertainty']),
+                        mask = None if parts['mask'] is None else FitsHeaderOnlyLoadable(parts['mask'])
+                        )
+                provider.append(nd, name=def_ext, reset_ver=False)
+                continue
+            elif hdulist._file is not None and hdulist._file.memmap:
                 nd = NDDataObject(
                         data = FitsLazyLoadable(parts['data']),
                         uncertainty = None if parts['uncertainty'] is None else FitsLazyLoadable(parts['uncertainty']),
@@ -1497,7 +1668,7 @@ class FitsLoader(object):
                 provider.append(other, name=other.header['EXTNAME'], add_to=nd)
 
         for other in hdulist:
-            if other in seen:
+            if other in seen or headers_only:
                 continue
             name = other.header.get('EXTNAME')
             try:
@@ -1507,7 +1678,44 @@ class FitsLoader(object):
 
         return provider
 
-def windowedOp(fn, sequence, kernel, shape=None, dtype=None, with_uncertainty=False, with_mask=False):
+def windowedOp(fn, sequence, kernel, shape=None, dtype=None,
+               with_uncertainty=False, with_mask=False, num_workers=None):
+    """
+    Apply a function to a sequence of NDData-like objects, one "box" (a
+    section with the shape of ``kernel``) at a time, and assemble the
+    results into a single output ``NDAstroData`` object.
+
+    If ``num_workers`` is larger than 1, the boxes are independent of each
+    other and are dispatched to a pool of threads, with at most
+    ``num_workers`` of them being processed at any time. The caller is
+    responsible for choosing a ``kernel`` such that ``num_workers`` boxes
+    fit into the available memory.
+
+    Parameters
+    ----------
+    fn : callable
+        Function that takes a generator of windowed NDData objects and
+        returns an NDData-like object with the shape of the window
+    sequence : list of NDAstroData
+        The inputs
+    kernel : tuple
+        Shape of the box processed by each call to ``fn``
+    shape : tuple, optional
+        Shape of the output (defaults to the shape of the inputs)
+    dtype : dtype, optional
+        Datatype of the output (defaults to that of the first input)
+    with_uncertainty : bool
+        Create an uncertainty plane in the output?
+    with_mask : bool
+        Create a mask plane in the output?
+    num_workers : int, optional
+        Number of boxes to process concurrently (None means serially)
+
+    Returns
+    -------
+    NDAstroData
+        The assembled output
+    """
     def generate_boxes(shape, kernel):
         if len(shape) != len(kernel):
             raise AssertionError("Incompatible shape ({}) and kernel ({})".format(shape, kernel))
@@ -1515,6 +1723,15 @@ def windowedOp(fn, sequence, kernel, shape=None, dtype=None, with_uncertainty=Fa
                  for axis, step in zip(shape, kernel)]
         return cart_product(*ticks)
 
+    def process_box(coords):
+        # The coordinates come as ((x1, x2, ..., xn), (y1, y2, ..., yn), ...)
+        # Zipping them will get us a more desirable ((x1, y1, ...), (x2, y2, ...), ..., (xn, yn, ...))
+        # box = list(zip(*coords))
+        section = tuple([slice(start, end) for (start, end) in coords])
+        # Each box writes to a disjoint section of the output arrays, so
+        # this is safe to do concurrently
+        result.set_section(section, fn((element.window[section] for element in sequence)))
+
     if shape is None:
         if len(set(x.shape for x in sequence)) > 1:
             raise ValueError("Can't calculate final shape: sequence elements disagree on shape, and none was provided")
@@ -1535,14 +1752,27 @@ def windowedOp(fn, sequence, kernel, shape=None, dtype=None, with_uncertainty=Fa
     # The Astropy logger's "INFO" messages aren't warnings, so have to fudge
     log_level = astropy.logger.conf.log_level
     astropy.log.setLevel(astropy.logger.WARNING)
-    for coords in generate_boxes(shape, kernel):
-        # The coordinates come as ((x1, x2, ..., xn), (y1, y2, ..., yn), ...)
-        # Zipping them will get us a more desirable ((x1, y1, ...), (x2, y2, ...), ..., (xn, yn, ...))
-        # box = list(zip(*coords))
-        section = tuple([slice(start, end) for (start, end) in coords])
-        result.set_section(section, fn((element.window[section] for element in sequence)))
-        gc.collect()
-    astropy.log.setLevel(log_level)  # and reset
+    boxes = list(generate_boxes(shape, kernel))
+    try:
+        if num_workers is None or num_workers < 2 or len(boxes) < 2:
+            for coords in boxes:
+                process_box(coords)
+                gc.collect()
+        else:
+            # Threads are used because the inputs are usually memmapped
+            # lazy-loaded objects that can't be shared with other processes,
+            # and the heavy lifting (numpy and the Cython clipping routine)
+            # releases the GIL. The pool only has num_workers threads, so
+            # no more than that many boxes can be in memory at once.
+            pool = ThreadPool(min(num_workers, len(boxes)))
+            try:
+                for _ in pool.imap_unordered(process_box, boxes):
+                    gc.collect()
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        astropy.log.setLevel(log_level)  # and reset
 
     return result
 
@@ -1557,15 +1787,19 @@ class AstroDataFits(AstroData):
         'ut_date': 'DATE-OBS'
     }
 
+    # The keyword dictionaries along the MRO of each class, flattened
+    _keyword_maps = {}
+
     @classmethod
-    def load(cls, source):
+    def load(cls, source, path=None):
         """
         Implementation of the abstract method `load`.
 
-        It takes an `HDUList` and returns a fully instantiated `AstroData` instance.
+        It takes an `HDUList` (and optionally the path of the file it was opened
+        from), or a path, and returns a fully instantiated `AstroData` instance.
         """
 
-        return cls(FitsLoader(FitsProvider).load(source))
+        return cls(FitsLoader(FitsProvider).load(source, path=path))
 
     def _keyword_for(self, name):
         """
@@ -1588,15 +1822,28 @@ class AstroDataFits(AstroData):
             If there is no keyword for the specified ``name``
         """
 
-        for cls in self.__class__.mro():
-            mangled_dict_name = '_{}__keyword_dict'.format(cls.__name__)
-            try:
-                return getattr(self, mangled_dict_name)[name]
-            except (AttributeError, KeyError) as e:
-                pass
-        else:
+        try:
+            return self._keyword_map()[name]
+        except KeyError:
             raise AttributeError("No match for '{}'".format(name))
 
+    @classmethod
+    def _keyword_map(cls):
+        """
+        Returns a dictionary merging the ``__keyword_dict`` of every class in
+        the MRO, with the most specific ones taking precedence. It is built
+        the first time that it's needed for each class.
+        """
+        try:
+            return AstroDataFits._keyword_maps[cls]
+        except KeyError:
+            keyword_map = {}
+            for klass in reversed(cls.mro()):
+                mangled_dict_name = '_{}__keyword_dict'.format(klass.__name__)
+                keyword_map.update(getattr(klass, mangled_dict_name, {}))
+            AstroDataFits._keyword_maps[cls] = keyword_map
+            return keyword_map
+
     @staticmethod
     def _matches_data(dataprov):
         # This one is trivial. As long as we get a FITS file...
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Benchmark for a full descriptor sweep, like the one made by get_cal_requests,
+with and without memoisation. This is not run by pytest; run this file
+directly:
+
+    $ python bench_descriptors.py [--repeat 5] [file.fits ...]
+
+If no files are given, a GMOS-N imaging file with 12 extensions is made up.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+import astrodata
+import gemini_instruments
+
+
+def make_gmos_file(filename, nextns=12):
+    phu = fits.PrimaryHDU()
+    phu.header.update([
+        ('INSTRUME', 'GMOS-N'), ('TELESCOP', 'Gemini-North'),
+        ('OBSTYPE', 'OBJECT'), ('OBSCLASS', 'science'), ('OBSMODE', 'IMAGE'),
+        ('OBJECT', 'M42'), ('OBSID', 'GN-2018A-Q-1-2'),
+        ('DATALAB', 'GN-2018A-Q-1-2-003'), ('DATE-OBS', '2018-03-04'),
+        ('TIME-OBS', '06:12:13.5'), ('UT', '06:12:13.5'),
+        ('EXPTIME', 120.), ('AIRMASS', 1.2), ('RA', 83.82), ('DEC', -5.39),
+        ('GRATING', 'MIRROR'), ('MASKTYP', 0), ('MASKNAME', 'None'),
+        ('FILTER1', 'g_G0301'), ('FILTER2', 'open2-8'), ('DETTYPE', 'S10892'),
+        ('DETECTOR', 'GMOS + Hamamatsu'), ('NAMPS', 1), ('AMPINTEG', 5000),
+        ('GAINMULT', 1.), ('PIXSCALE', 0.0807), ('CENTWAVE', 0.),
+    ])
+    hdus = [phu]
+    for n in range(nextns):
+        hdu = fits.ImageHDU(np.zeros((4, 4), dtype=np.uint16), name='SCI')
+        hdu.header.update([
+            ('CCDSUM', '2 2'), ('DATASEC', '[33:544,1:2112]'),
+            ('DETSEC', '[{}:{},1:4224]'.format(n * 512 + 1, n * 512 + 512)),
+            ('CCDSEC', '[1:1024,1:4224]'), ('BIASSEC', '[1:32,1:2112]'),
+            ('AMPNAME', 'BI{}-{}'.format(n // 4 + 1, n % 4 + 1)),
+            ('CCDNAME', 'BI{}'.format(n // 4 + 1)), ('GAIN', 1.6),
+            ('RDNOISE', 4.0), ('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'),
+            ('CRVAL1', 83.82), ('CRVAL2', -5.39), ('CRPIX1', 100.),
+            ('CRPIX2', 100.), ('CD1_1', -2.2e-5), ('CD1_2', 0.),
+            ('CD2_1', 0.), ('CD2_2', 2.2e-5),
+        ])
+        hdus.append(hdu)
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+
+
+def sweep(ad):
+    # Same calls as get_cal_requests
+    for name in ad.descriptors:
+        kwargs = {'asMicrometers': True} if name == 'central_wavelength' else {}
+        try:
+            getattr(ad, name)(**kwargs)
+        except Exception:
+            pass
+
+
+def memoized_sweep(ad):
+    with ad.memoized_descriptors():
+        sweep(ad)
+
+
+def best_time(func, ad, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func(ad)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_sweep(filenames, repeat):
+    print("{:>30s}{:>8s}{:>14s}{:>14s}{:>10s}".format(
+        "file", "ndesc", "plain (ms)", "memoised (ms)", "speedup"))
+    for filename in filenames:
+        ad = astrodata.open(filename)
+        t_plain = best_time(sweep, ad, repeat)
+        t_memo = best_time(memoized_sweep, ad, repeat)
+        print("{:>30s}{:8d}{:14.1f}{:14.1f}{:10.1f}".format(
+            os.path.basename(filename)[-30:], len(ad.descriptors),
+            t_plain * 1000, t_memo * 1000, t_plain / t_memo))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark a full descriptor sweep")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of sweeps per file (the best one is kept)")
+    parser.add_argument("files", nargs="*", help="FITS files to use")
+    args = parser.parse_args()
+    if args.files:
+        bench_sweep(args.files, args.repeat)
+    else:
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'N20180304S0123.fits')
+        make_gmos_file(filename)
+        try:
+            bench_sweep([filename], args.repeat)
+        finally:
+            os.remove(filename)
+            os.rmdir(tmpdir)
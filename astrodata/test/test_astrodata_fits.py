@@ -345,3 +345,18 @@ class TestAstrodataFits:
                 'EEV 9273-16-03', 'EEV 9273-20-04', 'EEV 9273-20-03'
             ]
 
+
+
+def test_keyword_for_follows_the_mro():
+    class AstroDataBase(astrodata.AstroDataFits):
+        __keyword_dict = dict(object='OBJNAME', exposure_time='EXPTIME')
+
+    class AstroDataDerived(AstroDataBase):
+        __keyword_dict = dict(exposure_time='ITIME')
+
+    ad = AstroDataDerived(astrodata.create(fits.PrimaryHDU())._dataprov)
+    assert ad._keyword_for('exposure_time') == 'ITIME'
+    assert ad._keyword_for('object') == 'OBJNAME'
+    assert ad._keyword_for('telescope') == 'TELESCOP'
+    with pytest.raises(AttributeError):
+        ad._keyword_for('no_such_descriptor')
@@ -58,3 +58,35 @@ def test_for_length(test_path):
 #     assert ad.phu['RAWIQ'] == 'Any'
 #     assert 'RAWCC' not in ad.phu
 #     assert 'DATATYPE' not in ad[0].hdr
+
+
+def test_headers_only(tmpdir, monkeypatch):
+    from astropy.io import fits
+
+    filename = str(tmpdir.join('test_headers_only.fits'))
+    phu = fits.PrimaryHDU()
+    phu.header['OBJECT'] = 'M42'
+    mdf = fits.BinTableHDU.from_columns(
+        [fits.Column(name='x', format='E', array=np.arange(3.))], name='MDF')
+    fits.HDUList([phu,
+                  fits.ImageHDU(np.ones((4, 5), dtype=np.int16), name='SCI'),
+                  fits.ImageHDU(np.zeros((4, 5), dtype=np.uint16), name='DQ'),
+                  fits.ImageHDU(np.ones((6, 7), dtype=np.float32), name='SCI'),
+                  mdf]).writeto(filename)
+
+    full = astrodata.open(filename)
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("fits.open shouldn't be called")
+
+    monkeypatch.setattr(fits, 'open', no_open)
+    ad = astrodata.open(filename, headers_only=True)
+    assert ad.path == filename
+    assert ad.tags == full.tags
+    assert ad.phu['OBJECT'] == 'M42'
+    assert len(ad) == 2
+    assert ad.hdr['EXTVER'] == [1, 2]
+    assert ad.shape == [(4, 5), (6, 7)]
+    assert ad.tables == set()
+    with pytest.raises(astrodata.AstroDataError):
+        ad[0].data
@@ -295,3 +295,26 @@ def test_delete_arbitrary_attribute_from_ad(test_path):
 
     with pytest.raises(AttributeError):
         ad.arbitrary
+
+
+def test_file_is_opened_only_once(tmpdir, monkeypatch):
+    from astropy.io import fits
+
+    filename = str(tmpdir.join('test_open_once.fits'))
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.ImageHDU(np.ones((4, 5), dtype=np.float32), name='SCI')]
+                 ).writeto(filename)
+
+    calls = []
+    fits_open = fits.open
+
+    def counting_open(*args, **kwargs):
+        calls.append(args)
+        return fits_open(*args, **kwargs)
+
+    monkeypatch.setattr(fits, 'open', counting_open)
+    ad = astrodata.open(filename)
+    assert len(calls) == 1
+    assert ad.path == filename
+    assert ad.orig_filename == 'test_open_once.fits'
+    assert np.array_equal(ad[0].data, np.ones((4, 5)))
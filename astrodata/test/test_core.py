@@ -162,3 +162,81 @@ def test_can_find_mean_average_and_median(sample_astrodata_with_ones):
     assert data.mean() == 1
     assert np.average(data) == 1
     assert np.median(data) == 1
+
+
+def test_tags_are_cached_until_headers_change(sample_astrodata_with_ones):
+    calls = []
+
+    class AstroDataCounting(astrodata.AstroDataFits):
+        @astrodata.astro_data_tag
+        def _tag_obstype(self):
+            calls.append(1)
+            return astrodata.TagSet([self.phu.get('OBSTYPE', 'NONE')])
+
+    ad = AstroDataCounting(sample_astrodata_with_ones._dataprov)
+    assert ad.tags == {'NONE'}
+    assert ad.tags == {'NONE'}
+    assert len(calls) == 1
+
+    # Modifying the returned set doesn't affect the cache
+    ad.tags.add('OTHER')
+    assert ad.tags == {'NONE'}
+
+    ad.phu['OBSTYPE'] = 'FLAT'
+    assert ad.tags == {'FLAT'}
+    ad.phu.set('OBSTYPE', 'DARK')
+    assert ad.tags == {'DARK'}
+    assert len(calls) == 3
+
+    ad.hdr['EXPTIME'] = 10.
+    ad.tags
+    ad.append(np.zeros((10, 10)))
+    ad.tags
+    del ad[1]
+    ad.tags
+    assert len(calls) == 6
+
+
+def test_memoized_descriptors(sample_astrodata_with_ones):
+    calls = []
+
+    class AstroDataCounting(astrodata.AstroDataFits):
+        @astrodata.astro_data_descriptor
+        def exposure_time(self):
+            calls.append(1)
+            return self.phu.get('EXPTIME')
+
+        @astrodata.astro_data_descriptor
+        def extnames(self, upper=True):
+            calls.append(1)
+            return [name.upper() if upper else name.lower()
+                    for name in self.hdr.get('EXTNAME')]
+
+    ad = AstroDataCounting(sample_astrodata_with_ones._dataprov)
+    ad.phu['EXPTIME'] = 10.
+    ad.exposure_time()
+    ad.exposure_time()
+    assert len(calls) == 2
+
+    with ad.memoized_descriptors():
+        assert ad.exposure_time() == 10.
+        assert ad.exposure_time() == 10.
+        assert len(calls) == 3
+        ad.phu['EXPTIME'] = 20.
+        assert ad.exposure_time() == 20.
+        assert len(calls) == 4
+
+        # Different arguments are memoised separately, and the values
+        # handed out can be modified safely
+        ad.extnames().append('OTHER')
+        assert ad.extnames() == ['SCI']
+        assert ad.extnames(upper=False) == ['sci']
+        assert len(calls) == 6
+
+        # Slices share the values
+        ad[0].exposure_time()
+        ad[0].exposure_time()
+        assert len(calls) == 7
+
+    ad.exposure_time()
+    assert len(calls) == 8
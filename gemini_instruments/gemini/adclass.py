@@ -240,12 +240,13 @@ class AstroDataGemini(AstroDataFits):
             value_filter = (str if pretty else section_to_tuple)
             process_fn = lambda x: (None if x is None else value_filter(x))
             # Dummy keyword FULLFRAME returns shape of full data array
+            # (uses the shape, so it works without the pixel data)
             if keyword == 'FULLFRAME':
-                try:
-                    sections = '[1:{1},1:{0}]'.format(*self.data.shape)
-                except AttributeError:
-                    sections = ['[1:{1},1:{0}]'.format(*ext.shape)
-                                for ext in self.data]
+                if self.is_single:
+                    sections = '[1:{1},1:{0}]'.format(*self.shape)
+                else:
+                    sections = ['[1:{1},1:{0}]'.format(*shape)
+                                for shape in self.shape]
             else:
                 sections = self.hdr.get(keyword)
             if self.is_single:
@@ -105,3 +105,20 @@ class TestF2:
         #     assert ad.phu.DETECTOR == 'FooBar'
         #     assert ad.phu.ARBTRARY == 'BarBaz'
         #     assert ad.phu['DETECTOR'] == 'FooBar'
+
+
+def test_sections_headers_only(tmpdir):
+    # The full-frame sections only need the shape, not the pixel data
+    import numpy as np
+    from astropy.io import fits
+
+    filename = str(tmpdir.join('gnirs_headers_only.fits'))
+    phu = fits.PrimaryHDU()
+    phu.header['INSTRUME'] = 'GNIRS'
+    fits.HDUList([phu, fits.ImageHDU(np.zeros((20, 30), dtype=np.float32),
+                                     name='SCI')]).writeto(filename)
+    ad = astrodata.open(filename, headers_only=True)
+    assert isinstance(ad, gemini_instruments.gnirs.adclass.AstroDataGnirs)
+    assert ad.array_section() == [(0, 30, 0, 20)]
+    assert ad.data_section() == [(0, 30, 0, 20)]
+    assert ad[0].data_section(pretty=True) == '[1:30,1:20]'
@@ -15,13 +15,14 @@ class AstroDataGpi(AstroDataGemini):
                           pupil_mask = 'APODIZER')
 
     @classmethod
-    def load(cls, source):
+    def load(cls, source, path=None):
         def gpi_parser(hdu):
             if hdu.header.get('EXTNAME') == 'DQ' and hdu.header.get('EXTVER') == 3:
                 hdu.header['EXTNAME'] = ('SCI', 'BPM renamed by AstroData')
                 hdu.header['EXTVER'] = (int(2), 'BPM renamed by AstroData')
 
-        return cls(FitsLoader(FitsProvider).load(source, extname_parser=gpi_parser))
+        return cls(FitsLoader(FitsProvider).load(source, extname_parser=gpi_parser,
+                                                 path=path))
 
 
     @staticmethod
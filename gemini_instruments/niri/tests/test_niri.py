@@ -91,4 +91,22 @@ class Test_GRACES:
             assert ad.hdr['CCDNAME'] == 'NIRI'
         except KeyError:
             # KeyError only accepted if it's because headers out of range
-            assert len(ad) == 1
\ No newline at end of file
+            assert len(ad) == 1
+
+def test_data_section_headers_only(tmpdir):
+    # The full-frame sections only need the shape, not the pixel data
+    import numpy as np
+    from astropy.io import fits
+
+    filename = str(tmpdir.join('niri_headers_only.fits'))
+    phu = fits.PrimaryHDU()
+    phu.header['INSTRUME'] = 'NIRI'
+    fits.HDUList([phu, fits.ImageHDU(np.zeros((20, 30), dtype=np.float32),
+                                     name='SCI')]).writeto(filename)
+    ad = astrodata.open(filename, headers_only=True)
+    assert isinstance(ad, gemini_instruments.niri.adclass.AstroDataNiri)
+    assert ad.data_section() == [(0, 30, 0, 20)]
+    assert ad.data_section(pretty=True) == ['[1:30,1:20]']
+    assert ad[0].data_section() == (0, 30, 0, 20)
+    with pytest.raises(astrodata.AstroDataError):
+        ad[0].data
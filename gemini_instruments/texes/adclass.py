@@ -31,7 +31,7 @@ class AstroDataTexes(AstroDataGemini):
         )
 
     @classmethod
-    def load(cls, source):
+    def load(cls, source, path=None):
         def texes_parser(hdu):
             xnam, xver = hdu.header.get('EXTNAME'), hdu.header.get('EXTVER')
             if 'RAWFRAME' in [xnam] and xver:
@@ -46,7 +46,8 @@ class AstroDataTexes(AstroDataGemini):
                 hdu.header.set('EXTVER', 1, 'Versioned by AstroData',
                                after='EXTNAME')
 
-        return cls(FitsLoader(FitsProvider).load(source, extname_parser=texes_parser))
+        return cls(FitsLoader(FitsProvider).load(source, extname_parser=texes_parser,
+                                                 path=path))
 
     @staticmethod
     def _matches_data(source):
@@ -17,9 +17,13 @@ E.g.,
 # ------------------------------------------------------------------------------
 import os
 import gc
+import json
 import pickle
+import sqlite3
 import warnings
+import weakref
 
+from contextlib import closing
 from copy import deepcopy
 from inspect import stack, isclass
 
@@ -36,6 +40,7 @@ from .gemini.lookups import timestamp_keywords
 from .gemini.lookups.source_detection import sextractor_dict
 
 from recipe_system.cal_service import calurl_dict
+from recipe_system.config import get_cache_journal_mode, get_cache_root
 from recipe_system.utils.decorators import parameter_override
 
 import atexit
@@ -51,7 +56,9 @@ caches = {
     'calibrations' : CALS
     }
 
-calindfile = os.path.join('.', caches['reducecache'], "calindex.pkl")
+CALINDEX = "calindex.db"
+# Calibrations are also stored by request signature, with this prefix
+GROUP_KEY_PREFIX = "signature:"
 stkindfile = os.path.join('.', caches['reducecache'], "stkindex.pkl")
 
 def set_caches():
@@ -62,6 +69,24 @@ def set_caches():
         cachedict.update({cachename:cachedir})
     return cachedict
 
+def cache_file(filename):
+    """
+    Returns the path of a cache file that can be shared by reduce processes:
+    in the cache root directory if one is set (see
+    recipe_system.config.get_cache_root), otherwise in the reduce cache
+    of the current directory.
+    """
+    root = get_cache_root()
+    if root is None:
+        return os.path.join(set_caches()['reducecache'], filename)
+    try:
+        os.makedirs(root)
+    except OSError:
+        # Another process may have made it first
+        if not os.path.isdir(root):
+            raise
+    return os.path.join(root, filename)
+
 def load_cache(cachefile):
     if os.path.exists(cachefile):
         return pickle.load(open(cachefile, 'rb'))
@@ -74,11 +99,34 @@ def save_cache(object, cachefile):
 
 # ------------------------- END caches------------------------------------------
 class Calibrations(object):
+    """
+    The calibrations associated with each frame (via its calibration_key),
+    and with each calibration request signature.
+
+    They are kept in an SQLite database, which can be shared by any number
+    of reduce processes, in any directories. Its journal mode is set by
+    recipe_system.config.get_cache_journal_mode: write-ahead logging (which
+    lets processes read the database while another writes, but requires
+    them all to run on the same host) for a database in the working
+    directory, and a rollback journal for one in a cache root, which may be
+    on a network filesystem. New associations are kept in memory and
+    written together: when cache_to_disk() is called, when BATCH_SIZE of
+    them have accumulated, and at exit. Calibration filenames are stored
+    as absolute paths.
+    """
+    BATCH_SIZE = 100
+
     def __init__(self, calindfile, user_cals={}, *args, **kwargs):
         self._calindfile = calindfile
-        self._dict = {}
-        self._dict.update(load_cache(self._calindfile))
+        self._pending = {}
         self._usercals = user_cals or {}                 # Handle user_cals=None
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode={}".format(
+                get_cache_journal_mode()))
+            conn.execute("CREATE TABLE IF NOT EXISTS calibrations "
+                         "(key TEXT, caltype TEXT, calfile TEXT, "
+                         "PRIMARY KEY (key, caltype))")
+        _live_calibrations.add(self)
 
     def __getitem__(self, key):
         return self._get_cal(*key)
@@ -90,27 +138,96 @@ class Calibrations(object):
     def __delitem__(self, key):
         # Cope with malformed keys
         try:
-            self._dict.pop((key[0].calibration_key(), key[1]), None)
+            self._update((key[0].calibration_key(), key[1]), None)
         except (TypeError, IndexError):
             pass
 
+    def _connect(self):
+        return sqlite3.connect(self._calindfile, timeout=60)
+
+    def _lookup(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT calfile FROM calibrations WHERE "
+                               "key=? AND caltype=?",
+                               (str(key[0]), key[1])).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _update(self, key, val):
+        # A value of None deletes the association
+        if val is not None:
+            val = ([os.path.abspath(calfile) for calfile in val]
+                   if isinstance(val, list) else os.path.abspath(val))
+        self._pending[key] = val
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.cache_to_disk()
+
     def _add_cal(self, key, val):
         # Munge the key from (ad, caltype) to (ad.calibration_key, caltype)
         key = (key[0].calibration_key(), key[1])
-        self._dict.update({key: val})
-        self.cache_to_disk()
+        self._update(key, val)
         return
 
     def _get_cal(self, ad, caltype):
         key = (ad.calibration_key(), caltype)
         if key in self._usercals:
             return self._usercals[key]
-        calfile = self._dict.get(key)
+        calfile = self._lookup(key)
         return calfile
 
+    def get_group_cal(self, signature, caltype):
+        """
+        Returns the calibration previously found for calibration requests
+        with this signature (see CalibrationRequest.signature), if any.
+        """
+        return self._lookup((GROUP_KEY_PREFIX + signature, caltype))
+
+    def add_group_cals(self, caltype, group_cals):
+        """
+        Records the calibrations found for requests with these signatures,
+        so that other frames with the same signatures can be given them
+        without asking the calibration service again.
+
+        Parameters
+        ----------
+        caltype: str
+            type of calibration
+        group_cals: dict
+            {signature: calibration filename (or list of filenames)}
+        """
+        for signature, calfile in group_cals.items():
+            self._update((GROUP_KEY_PREFIX + signature, caltype), calfile)
+        self.cache_to_disk()
+
     def cache_to_disk(self):
-        save_cache(self._dict, self._calindfile)
+        """
+        Writes the new associations to the database, in one transaction
+        """
+        if not self._pending:
+            return
+        pending = [(str(key[0]), key[1], val)
+                   for key, val in self._pending.items()]
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.executemany("DELETE FROM calibrations WHERE key=? AND "
+                                 "caltype=?", [row[:2] for row in pending
+                                               if row[2] is None])
+                conn.executemany("INSERT OR REPLACE INTO calibrations "
+                                 "VALUES (?,?,?)",
+                                 [row[:2] + (json.dumps(row[2]),)
+                                  for row in pending if row[2] is not None])
+        self._pending = {}
         return
+
+
+# Calibrations that may have associations still to be written at exit
+_live_calibrations = weakref.WeakSet()
+
+@atexit.register
+def _cache_all_to_disk():
+    for calibs in list(_live_calibrations):
+        calibs.cache_to_disk()
 # ------------------------------------------------------------------------------
 def cleanup(process):
     # Function for the atexit registry to kill the ETISubprocess
@@ -155,7 +272,8 @@ class PrimitivesBASE(object):
                 for k,v in self.sx_dict.items()})
 
         self.cachedict        = set_caches()
-        self.calibrations     = Calibrations(calindfile, user_cals=ucals)
+        self.calibrations     = Calibrations(cache_file(CALINDEX),
+                                             user_cals=ucals)
         self.stacks           = load_cache(stkindfile)
 
         # This lambda will return the name of the current caller.
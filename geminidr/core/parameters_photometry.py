@@ -24,3 +24,8 @@ class detectSourcesConfig(config.Config):
     phot_min_radius = config.RangeField("Minimum radius for photometry (pixels)", float, 3.5, min=1.0)
     back_size = config.RangeField("Background mesh size (pixels)", int, 32, min=1)
     back_filtersize = config.RangeField("Filtering scale for background", int, 8, min=1)
+    num_workers = config.RangeField("Number of SExtractor processes to run in parallel", int, None, min=1, optional=True)
+    method = config.ChoiceField("Source detection method", str,
+                                allowed={"sextractor": "run SExtractor",
+                                         "python": "detect in-process with numpy/scipy"},
+                                default="sextractor")
@@ -18,6 +18,8 @@ class adjustWCSToReferenceConfig(config.Config):
     cull_sources = config.Field("Use only point sources for alignment?", bool, False)
     rotate = config.Field("Allow rotation for alignment?", bool, False)
     scale = config.Field("Allow magnification for alignment?", bool, False)
+    num_workers = config.RangeField("Number of images to register in parallel", int, None, min=1, optional=True)
+    global_fit = config.Field("Solve for all offsets simultaneously after alignment?", bool, False)
 
 class determineAstrometricSolutionConfig(config.Config):
     suffix = config.Field("Filename suffix", str, "_astrometryCorrected", optional=True)
@@ -45,6 +45,8 @@ class core_stacking_config(config.Config):
     nlow = config.RangeField("Number of low pixels to reject", int, 0, min=0)
     nhigh = config.RangeField("Number of high pixels to reject", int, 0, min=0)
     memory = config.RangeField("Memory available for stacking (GB)", float, None, min=0.1, optional=True)
+    num_workers = config.RangeField("Number of image sections to stack in parallel", int, None, min=1, optional=True)
+    streaming = config.Field("Combine images one at a time to save memory?", bool, False)
 
 class stackFramesConfig(core_stacking_config):
     separate_ext = config.Field("Handle extensions separately?", bool, True)
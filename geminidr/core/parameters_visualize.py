@@ -22,6 +22,7 @@ class mosaicDetectorsConfig(config.Config):
     suffix = config.Field("Filename suffix", str, "_mosaic")
     sci_only = config.Field("Mosaic only SCI extensions?", bool, False)
     order = config.RangeField("Order of interpolation", int, 1, min=0, max=5)
+    memory = config.RangeField("Memory available for mosaicking (GB)", float, None, min=0.1, optional=True)
 
 class tileArraysConfig(config.Config):
     suffix = config.Field("Filename suffix", str, "_tiled", optional=True)
@@ -72,6 +72,7 @@ class CalibDB(PrimitivesBASE):
         calfile = params["calfile"]
         for ad in adinputs:
             self.calibrations[ad, caltype] = calfile
+        self.calibrations.cache_to_disk()
         return adinputs
 
     def getCalibration(self, adinputs=None, caltype=None, refresh=True,
@@ -87,8 +88,11 @@ class CalibDB(PrimitivesBASE):
         caltype: str
             type of calibration required (e.g., "processed_bias")
         refresh: bool
-            if False, only seek calibrations for ADs without them; otherwise
-            request calibrations for all ADs
+            if False, only seek calibrations for ADs without them, and give
+            ADs the calibration already found for another AD with the same
+            request signature (an earlier frame of the same observation, so
+            the calibration is the one closest in time to that frame);
+            otherwise request calibrations for all ADs
         howmany: None/int
             maximum number of calibrations to return per AD (None means return
             the filename of one, rather than a list of filenames)
@@ -97,11 +101,35 @@ class CalibDB(PrimitivesBASE):
         ad_rq = adinputs if refresh else [ad for ad in adinputs
                                           if not self._get_cal(ad, caltype)]
         cal_requests = get_cal_requests(ad_rq, caltype)
+        if not refresh:
+            cal_requests = [rq for rq in cal_requests
+                            if not self._get_group_cal(rq, howmany)]
         calibration_records = process_cal_requests(cal_requests, howmany=howmany)
         for ad, calfile in calibration_records.items():
             self.calibrations[ad, caltype] = calfile
+        # Remember the results for each distinct request, for later frames
+        self.calibrations.add_group_cals(caltype, {
+            rq.signature(): calibration_records[rq.ad] for rq in cal_requests
+            if rq.ad in calibration_records})
         return adinputs
 
+    def _get_group_cal(self, rq, howmany):
+        """
+        Associates the calibration already found for requests with the same
+        signature with this request's AD, if it's still on disk and of the
+        right form, and returns it (or None)
+        """
+        calib = self.calibrations.get_group_cal(rq.signature(), rq.caltype)
+        if not calib or isinstance(calib, list) != bool(howmany):
+            return None
+        if not all(os.path.isfile(calfile) for calfile in
+                   (calib if isinstance(calib, list) else [calib])):
+            return None
+        self.log.stdinfo("Using {} found for an identical request for {}".
+                         format(calib, rq.filename))
+        self.calibrations[rq.ad, rq.caltype] = calib
+        return calib
+
     def getProcessedArc(self, adinputs=None, **params):
         caltype = "processed_arc"
         self.getCalibration(adinputs, caltype=caltype, refresh=params["refresh"])
@@ -170,6 +198,7 @@ class CalibDB(PrimitivesBASE):
                 for ad, calfile in mdf_records.items():
                     self.calibrations[ad, caltype] = calfile
 
+        self.calibrations.cache_to_disk()
         return adinputs
 
     # =========================== STORE PRIMITIVES =================================
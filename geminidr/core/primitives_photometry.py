@@ -10,6 +10,7 @@ from astropy.table import Column
 from gempy.gemini import gemini_tools as gt
 from gempy.gemini.gemini_catalog_client import get_fits_table
 from gempy.gemini.eti.sextractoreti import SExtractorETI
+from gempy.library.detection import SourceDetector
 from geminidr.gemini.lookups import color_corrections
 
 from geminidr import PrimitivesBASE
@@ -149,6 +150,15 @@ class Photometry(PrimitivesBASE):
             background mesh size (pixels)
         back_filter_size: int
             background filtering scale
+        num_workers: int/None
+            maximum number of extensions to run SExtractor on at the same
+            time (None => one per CPU)
+        method: str
+            "sextractor" to run SExtractor, or "python" to find and measure
+            the sources in-process (no deblending, and CLASS_STAR is only
+            an estimate from the FWHM). Both give isophotal barycentres as
+            X_IMAGE and Y_IMAGE; "python" also gives the windowed
+            XWIN_IMAGE and YWIN_IMAGE
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -158,13 +168,25 @@ class Photometry(PrimitivesBASE):
         set_saturation = params["set_saturation"]
         # Setting mask_bits=0 is the same as not replacing bad pixels
         mask_bits = params["replace_flags"] if params["mask"] else 0
+        num_workers = params["num_workers"]
+        method = params["method"]
+
+        def detector(inputs, params, **kwargs):
+            if method == "python":
+                return SourceDetector(inputs=inputs, params=params,
+                                      mask_dq_bits=mask_bits, getmask=True)
+            return SExtractorETI(primitives_class=self, inputs=inputs,
+                                 params=params, mask_dq_bits=mask_bits,
+                                 getmask=True, **kwargs)
 
         # Will raise an Exception if SExtractor is too old or missing
-        SExtractorETI(primitives_class=self).check_version()
+        if method == "sextractor":
+            SExtractorETI(primitives_class=self).check_version()
 
         # Delete primitive-specific keywords from params so we only have
         # the ones for SExtractor
-        for key in ("suffix", "set_saturation", "replace_flags", "mask"):
+        for key in ("suffix", "set_saturation", "replace_flags", "mask",
+                    "num_workers", "method"):
             del params[key]
 
         adoutputs = []
@@ -193,39 +215,43 @@ class Photometry(PrimitivesBASE):
                 else:
                     sexpars.update({key.upper(): value})
 
-            for ext in ad:
-                # saturation_level() descriptor always returns level in ADU,
-                # so need to multiply by gain if image is not in ADU
-                if set_saturation:
-                    sat_level = ext.saturation_level()
-                    if not ext.is_in_adu():
-                        sat_level *= ext.gain()
-                    sexpars.update({'SATUR_LEVEL': sat_level})
-
-                # If we don't have a seeing estimate, try to get one
-                if seeing_estimate is None:
+            # saturation_level() descriptor always returns level in ADU,
+            # so need to multiply by gain if image is not in ADU
+            if set_saturation:
+                sexpars.update({'SATUR_LEVEL': [
+                    ext.saturation_level() * (1 if ext.is_in_adu() else ext.gain())
+                    for ext in ad]})
+
+            # If we don't have a seeing estimate, try to get one from the
+            # extensions in turn
+            if seeing_estimate is None:
+                for index, ext in enumerate(ad):
                     log.debug("Running SExtractor to obtain seeing estimate")
-                    sex_task = SExtractorETI(primitives_class=self, inputs=[ext],
-                            params=sexpars, mask_dq_bits=mask_bits, getmask=True)
+                    sex_task = detector([ext], _select_params(sexpars, index))
                     sex_task.run()
                     # An OBJCAT is *always* attached, even if no sources found
                     seeing_estimate = _estimate_seeing(ext.OBJCAT)
-
-                # Re-run with seeing estimate (no point re-running if we
-                # didn't get an estimate), and get a new estimate
-                if seeing_estimate is not None:
-                    log.debug("Running SExtractor with seeing estimate "
-                              "{:.3f}".format(seeing_estimate))
-                    sexpars.update({'SEEING_FWHM': '{:.3f}'.
-                                   format(seeing_estimate)})
-                    sex_task = SExtractorETI(primitives_class=self, inputs=[ext],
-                            params=sexpars, mask_dq_bits=mask_bits, getmask=True)
-                    sex_task.run()
-                    # We don't want to replace an actual value with "None"
+                    if seeing_estimate is not None:
+                        break
+
+            # Re-run with seeing estimate (no point re-running if we
+            # didn't get an estimate), on all the extensions at once, and
+            # get a new estimate
+            if seeing_estimate is not None:
+                log.debug("Running SExtractor with seeing estimate "
+                          "{:.3f}".format(seeing_estimate))
+                sexpars.update({'SEEING_FWHM': '{:.3f}'.
+                               format(seeing_estimate)})
+                sex_task = detector(list(ad), sexpars,
+                                    max_processes=num_workers)
+                sex_task.run()
+                # We don't want to replace an actual value with "None"
+                for ext in ad:
                     temp_seeing_estimate = _estimate_seeing(ext.OBJCAT)
                     if temp_seeing_estimate is not None:
                         seeing_estimate = temp_seeing_estimate
 
+            for ext in ad:
                 # Although the OBJCAT has been added to the extension, it
                 # needs to be massaged into the necessary format
                 # We're deleting the OBJCAT first simply to suppress the
@@ -264,6 +290,16 @@ class Photometry(PrimitivesBASE):
 ##############################################################################
 
 
+def _select_params(params, index):
+    """
+    Returns a copy of the SExtractor parameters for a single extension,
+    replacing any per-extension lists of values with the value for the
+    extension with the given index
+    """
+    return {key: value[index] if isinstance(value, list) else value
+            for key, value in params.items()}
+
+
 def _calculate_magnitudes(refcat, formulae):
     # Create new columns for the magnitude (and error) in the image's filter
     # We need to ensure the table's meta is updated.
@@ -4,6 +4,9 @@
 #                                                          primitives_register.py
 # ------------------------------------------------------------------------------
 import math
+import multiprocessing
+from functools import partial
+
 import numpy as np
 from astropy.wcs import WCS
 from astropy.modeling import models
@@ -12,7 +15,9 @@ from gempy.gemini import gemini_tools as gt
 from gempy.gemini import qap_tools as qap
 from gempy.utils import logutils
 
-from gempy.library.matching import match_catalogs, align_images_from_wcs, Pix2Sky
+from gempy.library.matching import (match_catalogs, align_sources_from_wcs,
+                                    get_sources, solve_global_offsets,
+                                    Pix2Sky)
 
 from geminidr import PrimitivesBASE
 from . import parameters_register
@@ -98,6 +103,12 @@ class Register(PrimitivesBASE):
             allow image rotation to align to reference image?
         scale: bool
             allow image scaling to align to reference image?
+        num_workers: int/None
+            number of images to register concurrently, in separate processes
+        global_fit: bool
+            after registering each image to the reference, solve for the
+            offsets of all the images simultaneously, using the sources
+            they have in common with every other image?
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -119,6 +130,7 @@ class Register(PrimitivesBASE):
         cull_sources = params["cull_sources"]
         rotate = params["rotate"]
         scale = params["scale"]
+        num_workers = params["num_workers"] or 1
 
         # Use first image in list as reference
         ref_image = adinputs[0]
@@ -148,6 +160,15 @@ class Register(PrimitivesBASE):
         # otherwise try to do direct alignment for each image by correlating
         # sources in the reference and input images
         else:
+            # The reference sources are found once, and the images are then
+            # registered independently, so the fits can be done in parallel
+            ref_sources = get_sources(ref_image, cull_sources)
+            register = partial(_register_image, ref_sources=ref_sources,
+                               ref_header=ref_image[0].hdr,
+                               min_sources=min_sources,
+                               cull_sources=cull_sources, rotate=rotate,
+                               scale=scale)
+            registered, jobs = [], []
             for ad in adinputs[1:]:
                 try:
                     nobj = len(ad[0].OBJCAT)
@@ -175,60 +196,56 @@ class Register(PrimitivesBASE):
                         log.stdinfo("Recomputing WCS for GNIRS from offsets")
                         ad = _create_wcs_from_offsets(ad, ref_image)
                     firstpasspix = first_pass / ad.pixel_scale()
+                    registered.append(ad)
+                    jobs.append((get_sources(ad, cull_sources), ad[0].hdr,
+                                 ad[0].data.shape, firstpasspix))
+                adoutputs.append(ad)
 
-                    # Calculate the offsets quickly using only a translation
-                    obj_list, transform = align_images_from_wcs(ad, ref_image,
-                            first_pass=firstpasspix, min_sources=min_sources,
-                            cull_sources=cull_sources, full_wcs=False,
-                            rotate=False, scale=False, tolerance=0.001,
-                            return_matches=True)
-
-                    n_corr = len(obj_list[0])
-                    if n_corr==0:
-                        log.warning("No correlated sources found.")
-                        if fallback=='header':
-                            log.warning("Only attempting indirect WCS "
-                                "alignment, via {} mapping".format(fallback))
-                            _create_wcs_from_offsets(ad, ref_image)
-                            #adoutput = _header_align(ref_image, ad,
-                            #                         self.keyword_comments)
-                        else:
-                            log.warning("WCS can only be corrected indirectly "
-                                "and fallback=None. Not attempting WCS "
-                                "correction for ".format(ad.filename))
+            if num_workers > 1 and len(jobs) > 1:
+                pool = multiprocessing.Pool(min(num_workers, len(jobs)))
+                try:
+                    results = pool.map(register, jobs)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [register(job) for job in jobs]
+
+            for ad, (obj_list, wcs) in zip(registered, results):
+                n_corr = len(obj_list[0])
+                if n_corr==0:
+                    log.warning("No correlated sources found in {}.".
+                                format(ad.filename))
+                    if fallback=='header':
+                        log.warning("Only attempting indirect WCS "
+                            "alignment, via {} mapping".format(fallback))
+                        _create_wcs_from_offsets(ad, ref_image)
                     else:
-                        log.fullinfo("Number of correlated sources: {}".
-                                     format(n_corr))
-                        log.stdinfo("{}: Using source correlation for "
-                                    "alignment".format(ad.filename))
-                        x_offset = transform.x_offset.value
-                        y_offset = transform.y_offset.value
-
-                        # Check the fit geometry depending on the
-                        # number of objects
-                        if n_corr < 5:
-                            log.warning("Too few objects. Setting "
-                                        "rotate=False, scale=False")
-                            rotate=False
-                            scale=False
-
-                        log.fullinfo("\nSources used to align frames:")
-                        log.fullinfo("   Ref. x Ref. y  Img. x  Img. y\n  {}".
-                                     format("-"*31))
-                        for ref, img in zip(*obj_list):
-                            log.fullinfo("  {:7.2f} {:7.2f} {:7.2f} {:7.2f}".
-                                        format(ref[0], ref[1], *img))
-                        log.fullinfo("")
-
-                        # Determine a more accurate fit, and get the WCS
-                        wcs = align_images_from_wcs(ad, ref_image,
-                                    initial_shift=(x_offset, y_offset),
-                                    first_pass=0.2*firstpasspix, refine=True,
-                                    cull_sources=cull_sources, full_wcs=True,
-                                    rotate=rotate, scale=scale, tolerance=1e-8,
-                                    return_matches=False).wcs
-                        _write_wcs_keywords(ad, wcs, self.keyword_comments)
-                adoutputs.append(ad)
+                        log.warning("WCS can only be corrected indirectly "
+                            "and fallback=None. Not attempting WCS "
+                            "correction for {}".format(ad.filename))
+                else:
+                    log.fullinfo("Number of correlated sources: {}".
+                                 format(n_corr))
+                    log.stdinfo("{}: Using source correlation for "
+                                "alignment".format(ad.filename))
+                    if n_corr < 5 and (rotate or scale):
+                        log.warning("Too few objects. Setting "
+                                    "rotate=False, scale=False")
+
+                    log.fullinfo("\nSources used to align frames:")
+                    log.fullinfo("   Ref. x Ref. y  Img. x  Img. y\n  {}".
+                                 format("-"*31))
+                    for ref, img in zip(*obj_list):
+                        log.fullinfo("  {:7.2f} {:7.2f} {:7.2f} {:7.2f}".
+                                    format(ref[0], ref[1], *img))
+                    log.fullinfo("")
+                    _write_wcs_keywords(ad, wcs, self.keyword_comments)
+
+            if params["global_fit"]:
+                log.stdinfo("Solving for all offsets simultaneously")
+                _apply_global_offsets(adoutputs, 0.2 * first_pass,
+                                      min_sources, self.keyword_comments)
 
         # Timestamp and update filenames
         for ad in adoutputs:
@@ -485,6 +502,112 @@ class Register(PrimitivesBASE):
 # Below are the helper functions for the user level functions in this module #
 ##############################################################################
 
+def _register_image(job, ref_sources, ref_header, min_sources=1,
+                    cull_sources=False, rotate=False, scale=False):
+    """
+    Aligns the sources in an image to those in the reference image, first
+    quickly with only a translation, and then by refining the WCS. This
+    only takes and returns picklable objects, so it can be run in a
+    worker process.
+
+    Parameters
+    ----------
+    job: 4-tuple
+        sources (from get_sources()), header, and shape of the image, and
+        the search radius for the first pass (in pixels)
+    ref_sources: 2-tuple
+        sources in the reference image (from get_sources())
+    ref_header: Header
+        header of the reference image
+    min_sources, cull_sources, rotate, scale:
+        see adjustWCSToReference()
+
+    Returns
+    -------
+    obj_list: 2 lists
+        sources in the input and reference images that are matched
+    wcs: WCS/None
+        refined WCS of the image (None if no sources were matched)
+    """
+    # WCS objects lose their CD matrix when pickled, so make them here
+    sources, header, shape, firstpasspix = job
+    wcs, ref_wcs = WCS(header), WCS(ref_header)
+
+    # Calculate the offsets quickly using only a translation
+    obj_list, transform = align_sources_from_wcs(sources, wcs, ref_sources,
+                    ref_wcs, shape, first_pass=firstpasspix,
+                    min_sources=min_sources, cull_sources=cull_sources,
+                    full_wcs=False, rotate=False, scale=False, tolerance=0.001,
+                    return_matches=True)
+    n_corr = len(obj_list[0])
+    if n_corr == 0:
+        return obj_list, None
+
+    # Check the fit geometry depending on the number of objects
+    if n_corr < 5:
+        rotate = scale = False
+
+    # Determine a more accurate fit, and get the WCS
+    initial_shift = (transform.x_offset.value, transform.y_offset.value)
+    wcs = align_sources_from_wcs(sources, wcs, ref_sources, ref_wcs, shape,
+                    initial_shift=initial_shift, first_pass=0.2*firstpasspix,
+                    refine=True, cull_sources=cull_sources, full_wcs=True,
+                    rotate=rotate, scale=scale, tolerance=1e-8,
+                    return_matches=False).wcs
+    return obj_list, wcs
+
+def _apply_global_offsets(adinputs, radius, min_sources, keyword_comments):
+    """
+    Shifts the WCSs of already-registered images (all but the first, which
+    is the reference) so that their sources best match those in all the
+    other images, not just the reference, by solving for all the offsets
+    simultaneously.
+
+    Parameters
+    ----------
+    adinputs: list of AstroData
+        images, with the reference image first
+    radius: float
+        matching radius (arcsec)
+    min_sources: int
+        minimum number of matched sources for a pair of images to be used
+    keyword_comments: dict
+        the comment for each FITS keyword
+    """
+    log = logutils.get_logger(__name__)
+    ref_wcs = WCS(adinputs[0][0].hdr)
+    wcs_list, coords = [], []
+    for ad in adinputs:
+        wcs = WCS(ad[0].hdr)
+        wcs_list.append(wcs)
+        try:
+            x, y = ad[0].OBJCAT['X_IMAGE'], ad[0].OBJCAT['Y_IMAGE']
+        except AttributeError:
+            x = y = []
+        if len(x) == 0:
+            coords.append(np.empty((2, 0)))
+        else:
+            # Put all the sources on the pixel frame of the reference
+            ra, dec = wcs.all_pix2world(x, y, 1)
+            coords.append(ref_wcs.all_world2pix(ra, dec, 1))
+
+    offsets = solve_global_offsets(coords, min_matches=min_sources,
+                                   radius=radius / adinputs[0].pixel_scale())
+    for ad, wcs, (dx, dy) in zip(adinputs[1:], wcs_list[1:], offsets[1:]):
+        if dx == 0 and dy == 0:
+            continue
+        # Find the shift in this image's pixels that moves its sources by
+        # (dx, dy) in the reference frame, and apply it to CRPIX
+        crpix = wcs.wcs.crpix
+        points = np.array([crpix, crpix + [1, 0], crpix + [0, 1]])
+        refpix = ref_wcs.all_world2pix(wcs.all_pix2world(points, 1), 1)
+        shift = np.linalg.solve((refpix[1:] - refpix[0]).T, [dx, dy])
+        for ax in 1, 2:
+            ad.hdr.set('CRPIX{}'.format(ax), crpix[ax-1] - shift[ax-1],
+                       comment=keyword_comments["CRPIX{}".format(ax)])
+        log.stdinfo("{}: Global solution moves sources by ({:.3f}, {:.3f}) "
+                    "pixels".format(ad.filename, dx, dy))
+
 def _create_wcs_from_offsets(adinput, adref, center_of_rotation=None):
     """
     This function uses the POFFSET, QOFFSET, and PA header keywords to create
@@ -609,6 +732,7 @@ def _write_wcs_keywords(ad, wcs, keyword_comments):
         ad.hdr.set('CRVAL{}'.format(ax), wcs.wcs.crval[ax-1],
                    comment=keyword_comments["CRVAL{}".format(ax)])
         for ax2 in 1, 2:
-            ad.hdr.set('CD{}_{}'.format(ax, ax2), wcs.wcs.cd[ax-1, ax2-1],
+            ad.hdr.set('CD{}_{}'.format(ax, ax2),
+                       wcs.pixel_scale_matrix[ax-1, ax2-1],
                        comment=keyword_comments["CD{}_{}".format(ax, ax2)])
     return
@@ -8,6 +8,7 @@ from astropy.wcs import WCS
 from scipy.ndimage import affine_transform
 
 from gempy.library import astrotools as at
+from gempy.library import cytransform
 from gempy.library.transform import Transform, AstroDataGroup
 from gempy.library.matching import Pix2Sky
 from gempy.gemini import gemini_tools as gt
@@ -355,6 +356,20 @@ def _pad_image(ad, padding):
                              constant_values=0)
 
 def _transform_mask(mask, **kwargs):
+    """
+    Transform the DQ plane. Linear and nearest-neighbour interpolation can
+    do all the bits in a single pass; higher orders go bit by bit.
+    """
+    matrix = kwargs['matrix']
+    if (kwargs.get('order', 3) <= 1 and mask.ndim == 2 and
+            np.shape(matrix) == (2, 2)):
+        return cytransform.bitmask_affine_transform(
+            np.ascontiguousarray(mask, dtype=np.uint16), matrix,
+            kwargs.get('offset', (0., 0.)), kwargs['output_shape'],
+            order=kwargs['order'], threshold=0.01, cval=DQ.no_data)
+    return _transform_mask_by_bit(mask, **kwargs)
+
+def _transform_mask_by_bit(mask, **kwargs):
     """
     Transform the DQ plane, bit by bit. Since np.unpackbits() only works
     on uint8 data, we have to do this by hand
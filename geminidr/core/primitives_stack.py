@@ -12,7 +12,7 @@ from functools import partial
 from copy import deepcopy
 
 from gempy.gemini import gemini_tools as gt
-from gempy.library.nddops import NDStacker
+from gempy.library.nddops import NDStacker, NDStreamStacker
 
 from geminidr import PrimitivesBASE
 from . import parameters_stack
@@ -59,6 +59,15 @@ class Stack(PrimitivesBASE):
             type of pixel rejection (passed to gemcombine)
         zero: bool
             apply zero-level offset to match background levels?
+        memory: float/None
+            available memory (in GB) for stacking calculations
+        num_workers: int/None
+            number of image sections to stack concurrently (the memory
+            limit applies to all of them together)
+        streaming: bool
+            combine the images one at a time rather than all together?
+            (only for mean, wtmean, and median with none, sigclip, or
+            varclip rejection; the median is approximate)
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -67,6 +76,8 @@ class Stack(PrimitivesBASE):
         memory = params["memory"]
         if memory is not None:
             memory = int(memory * 1000000000)
+        num_workers = params["num_workers"] or 1
+        streaming = params["streaming"]
 
         zero = params["zero"]
         scale = params["scale"]
@@ -194,9 +205,24 @@ class Stack(PrimitivesBASE):
                         "instead.")
             reject_method = "sigclip"
 
-        stack_function = NDStacker(combine=params["operation"],
-                                   reject=reject_method,
-                                   log=self.log, **params)
+        if streaming and (params["operation"] not in NDStreamStacker.combiners
+                          or reject_method not in NDStreamStacker.rejectors):
+            log.warning("Cannot stack with operation={} and reject_method={}"
+                        " one image at a time. Stacking all images together."
+                        .format(params["operation"], reject_method))
+            streaming = False
+
+        if streaming:
+            stack_function = NDStreamStacker(combine=params["operation"],
+                                             reject=reject_method,
+                                             log=self.log, **params)
+        else:
+            # The workers already keep every CPU busy
+            stack_function = NDStacker(combine=params["operation"],
+                                       reject=reject_method,
+                                       log=self.log,
+                                       num_threads=1 if num_workers > 1 else 0,
+                                       **params)
 
         # NDStacker uses DQ if it exists; if we don't want that, delete the DQs!
         if not apply_dq:
@@ -219,21 +245,32 @@ class Stack(PrimitivesBASE):
                     log.stdinfo("{:40s}{:10.3f}".format(ad.filename, value))
 
             shape = adinputs[0][index].nddata.shape
+            # Chop the image horizontally into equal-sized chunks to process
+            # This uses the minimum number of steps and uses minimum memory
+            # per step. With several workers, that many chunks are in memory
+            # at once, and we need at least one chunk per worker.
             if memory is None:
-                kernel = shape
+                oversubscription = 1
             else:
-                # Chop the image horizontally into equal-sized chunks to process
-                # This uses the minimum number of steps and uses minimum memory
-                # per step.
-                oversubscription = (bytes_per_ext[index] * num_img) // memory + 1
-                kernel = ((shape[0] + oversubscription - 1) // oversubscription,) + shape[1:]
+                if streaming:
+                    # Only one input image (and a scaled copy) is in memory
+                    # at a time, plus the per-pixel state of the stacker
+                    bytes_in_memory = (2 * bytes_per_ext[index] +
+                                       stack_function.bytes_per_pixel() *
+                                       int(np.multiply.reduce(shape)))
+                else:
+                    bytes_in_memory = bytes_per_ext[index] * num_img
+                oversubscription = (bytes_in_memory * num_workers) // memory + 1
+            nchunks = max(oversubscription, min(num_workers, shape[0]))
+            kernel = ((shape[0] + nchunks - 1) // nchunks,) + shape[1:]
             with_uncertainty = True  # Since all stacking methods return variance
             with_mask = apply_dq and not any(ad[index].nddata.window[:].mask is None
                                              for ad in adinputs)
             result = windowedOp(partial(stack_function, scale=sfactors, zero=zfactors),
                                 [ad[index].nddata for ad in adinputs],
                                 kernel=kernel, dtype=np.float32,
-                                with_uncertainty=with_uncertainty, with_mask=with_mask)
+                                with_uncertainty=with_uncertainty, with_mask=with_mask,
+                                num_workers=num_workers)
             ad_out.append(result)
             log.stdinfo("")
 
@@ -242,6 +242,9 @@ class Visualize(PrimitivesBASE):
             mosaic only SCI image data. Default is False
         order: int (1-5)
             order of spline interpolation
+        memory: float/None
+            available memory (in GB) for the transformation; if set, the
+            output is made in bands of rows and written to temporary files
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -249,6 +252,9 @@ class Visualize(PrimitivesBASE):
 
         suffix = params['suffix']
         order = params['order']
+        memory = params['memory']
+        if memory is not None:
+            memory = int(memory * 1000000000)
         attributes = ['data'] if params['sci_only'] else None
         geotable = import_module('.geometry_conf', self.inst_lookups)
 
@@ -331,7 +337,8 @@ class Visualize(PrimitivesBASE):
 
             adg.set_reference()
             ad_out = adg.transform(attributes=attributes, order=order,
-                                   process_objcat=False)
+                                   process_objcat=False, memory=memory,
+                                   memmap=memory is not None)
 
             ad_out.orig_filename = ad.filename
             gt.mark_history(ad_out, primname=self.myself(), keyword=timestamp_key)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Tests for adjustWCSToReference, on synthetic frames with OBJCATs
+"""
+import numpy as np
+import pytest
+
+from astropy.io import fits
+from astropy.table import Table
+
+import astrodata
+import gemini_instruments
+
+from geminidr.core.primitives_register import Register
+
+# Offsets (in x) of the frames from the reference, in pixels, and the
+# errors in the CRPIXs of their headers
+OFFSETS = (0, 100, 200)
+ERRORS = ((0, 0), (3, -2), (-4, 3))
+
+
+def make_frames():
+    """
+    Frames of a star field, each offset in x from the previous one. The
+    stars are placed so that the first and last frames have none in common
+    (so the last can't be registered to the reference), but the middle
+    one has stars in common with each of them.
+    """
+    rng = np.random.RandomState(0)
+    # Stars on the pixel frame of the reference, no two close together
+    stars = []
+    while len(stars) < 120:
+        x, y = rng.uniform((0, 0), (460, 256))
+        if (x < 150 or x > 260) and all((x - xs) ** 2 + (y - ys) ** 2 > 144
+                                        for xs, ys in stars):
+            stars.append((x, y))
+    stars = np.array(stars).T
+
+    adinputs = []
+    for i, (offset, error) in enumerate(zip(OFFSETS, ERRORS)):
+        ad = astrodata.create(fits.PrimaryHDU(header=fits.Header(
+            {'OBSERVAT': 'Gemini-North'})))
+        ad.append(fits.ImageHDU(data=np.zeros((256, 256), dtype=np.float32),
+                                name='SCI'))
+        ad.filename = 'frame{}.fits'.format(i)
+        ad[0].hdr.update({'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+                          'CRVAL1': 150., 'CRVAL2': 30.,
+                          'CRPIX1': 128. - offset + error[0],
+                          'CRPIX2': 128. + error[1], 'CD1_1': -4e-5,
+                          'CD1_2': 0., 'CD2_1': 0., 'CD2_2': 4e-5})
+        x, y = stars[0] - offset, stars[1]
+        inside = (x > 5) & (x < 250)
+        ad[0].OBJCAT = Table([x[inside], y[inside]],
+                             names=('X_IMAGE', 'Y_IMAGE'))
+        adinputs.append(ad)
+    return adinputs
+
+
+def crpix(ad):
+    return np.array([ad[0].hdr['CRPIX1'], ad[0].hdr['CRPIX2']])
+
+
+@pytest.fixture
+def register(tmpdir, monkeypatch):
+    # The primitives keep their caches in the working directory
+    monkeypatch.chdir(tmpdir)
+    return lambda adinputs, **params: Register(adinputs).adjustWCSToReference(
+        fallback=None, **params)
+
+
+def test_adjust_wcs_num_workers(register):
+    # Registering the images in worker processes writes the same WCSs
+    serial = register(make_frames(), num_workers=1)
+    pooled = register(make_frames(), num_workers=2)
+    for ad_serial, ad_pooled in zip(serial, pooled):
+        for kw in ('CRPIX1', 'CRPIX2', 'CRVAL1', 'CRVAL2',
+                   'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2'):
+            assert ad_serial[0].hdr[kw] == pytest.approx(ad_pooled[0].hdr[kw],
+                                                         abs=1e-10)
+    # The middle frame is registered to the reference, but the last one
+    # has no sources in common with it
+    np.testing.assert_allclose(crpix(serial[1]), [28, 128], atol=0.05)
+    np.testing.assert_allclose([serial[1][0].hdr[kw] for kw in
+                                ('CD1_1', 'CD1_2', 'CD2_1', 'CD2_2')],
+                               [-4e-5, 0, 0, 4e-5], atol=1e-9)
+    np.testing.assert_allclose(crpix(serial[2]), [-76, 131], atol=0.05)
+
+
+def test_adjust_wcs_global_fit(register):
+    # The global fit moves the last frame into line with the middle one,
+    # which is registered to the reference
+    adoutputs = register(make_frames(), num_workers=2, global_fit=True)
+    np.testing.assert_allclose(crpix(adoutputs[0]), [128, 128])
+    np.testing.assert_allclose(crpix(adoutputs[1]), [28, 128], atol=0.05)
+    np.testing.assert_allclose(crpix(adoutputs[2]), [-72, 128], atol=0.05)
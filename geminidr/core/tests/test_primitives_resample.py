@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""
+Tests for the helper functions of primitives_resample
+"""
+import numpy as np
+import pytest
+
+from geminidr.core.primitives_resample import (_transform_mask,
+                                               _transform_mask_by_bit)
+
+
+@pytest.mark.parametrize('order', [0, 1])
+@pytest.mark.parametrize('angle', [0.1, 0.7])
+def test_transform_mask(order, angle):
+    # Transforming all the bits at once gives the same result as going
+    # bit by bit (avoiding pixel fractions right at the 1% threshold)
+    rng = np.random.RandomState(0)
+    mask = np.zeros((100, 120), dtype=np.uint16)
+    for bit in (1, 2, 8, 64, 512):
+        mask |= (rng.random_sample(mask.shape) < 0.05) * np.uint16(bit)
+    matrix = 1.03 * np.array([[np.cos(angle), -np.sin(angle)],
+                              [np.sin(angle), np.cos(angle)]])
+    kwargs = {'matrix': matrix, 'offset': (-3.3, 5.7), 'order': order,
+              'output_shape': (110, 130)}
+    trans_mask = _transform_mask(mask, **kwargs)
+    assert trans_mask.dtype == np.uint16
+    np.testing.assert_array_equal(trans_mask,
+                                  _transform_mask_by_bit(mask, **kwargs))
+    # Pixels from outside the input are flagged as having no data
+    assert trans_mask[-1, -1] == 16
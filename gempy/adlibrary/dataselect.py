@@ -67,7 +67,7 @@ def select_data(inputs, tags=[], xtags=[], expression='True'):
 
     selected_data = []
     for input in inputs:
-        ad = astrodata.open(input)
+        ad = astrodata.open(input, headers_only=True)
         adtags = ad.tags
         if set(tags).issubset(adtags) and \
                not len(set(xtags).intersection(adtags)) and \
@@ -1,13 +1,56 @@
 
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, cpu_count
+from multiprocessing.pool import ThreadPool
 from subprocess import check_output, STDOUT, CalledProcessError
 
 from ..utils import logutils
+from .etiexchange import ETIExchange
 
 
 log = logutils.get_logger(__name__)
 
 
+def execute_command(cmd):
+    """
+    Runs a shell command, returning its output or, if it fails, the
+    exception (so it can be sent back from loop_process)
+
+    Parameters
+    ----------
+    cmd : list of str
+        command and its arguments
+    """
+    try:
+        return check_output(cmd, stderr=STDOUT)
+    except (CalledProcessError, OSError) as e:
+        return e
+
+
+def execute_commands(commands, max_processes=None):
+    """
+    Runs several shell commands concurrently, with at most max_processes
+    running at any time, and returns their outputs (or exceptions) in the
+    order of the commands. Each subprocess is waited for by its own thread,
+    so the outputs are collected as soon as each one finishes.
+
+    Parameters
+    ----------
+    commands : list of lists of str
+        commands and their arguments
+    max_processes : int/None
+        maximum number of simultaneous subprocesses (None => one per CPU)
+    """
+    nprocesses = min(max_processes or cpu_count(), len(commands))
+    if nprocesses <= 1:
+        return [execute_command(cmd) for cmd in commands]
+    pool = ThreadPool(nprocesses)
+    try:
+        return pool.map(execute_command, commands)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def loop_process(in_queue, out_queue):
     """
     Code to spawn a subprocess for running external tasks
@@ -15,16 +58,17 @@ def loop_process(in_queue, out_queue):
     Parameters
     ----------
     in_queue : multiprocessing.Queue
-        (add docstring)
+        commands to run: either a single command (a list of str), or a
+        tuple of (list of commands, max_processes) to run concurrently
     out_queue : multiprocessing.Queue
-        (add docstring)
+        output of the command, or a list of outputs for a tuple
     """
     while True:
         cmd = in_queue.get()
-        try:
-            result = check_output(cmd, stderr=STDOUT)
-        except CalledProcessError as e:
-            result = e
+        if isinstance(cmd, tuple):
+            result = execute_commands(*cmd)
+        else:
+            result = execute_command(cmd)
         out_queue.put(result)
 
 
@@ -78,6 +122,7 @@ class ExternalTaskInterface(object):
     file_objs = None
     inputs = None
     params = None
+    exchange = None
 
     def __init__(self, primitives_class=None, inputs=None, params=None):
         """
@@ -104,10 +149,12 @@ class ExternalTaskInterface(object):
 
     def run(self):
         log.debug("ExternalTaskInterface.run()")
-        self.prepare()
-        self.execute()
-        self.recover()
-        self.clean()
+        try:
+            self.prepare()
+            self.execute()
+            self.recover()
+        finally:
+            self.clean()
 
     def add_param(self, param):
         log.debug("ExternalTaskInterface.add_param()")
@@ -119,6 +166,12 @@ class ExternalTaskInterface(object):
 
     def prepare(self):
         log.debug("ExternalTaskInterface.prepare()")
+        # All the files go in a directory of their own, which is removed
+        # by clean()
+        self.exchange = ETIExchange(nbytes=sum(fil.nbytes()
+                                               for fil in self.file_objs))
+        for fil in self.file_objs:
+            fil.exchange = self.exchange
         for par in self.param_objs:
             par.prepare()
         for fil in self.file_objs:
@@ -136,7 +189,12 @@ class ExternalTaskInterface(object):
 
     def clean(self):
         log.debug("ExternalTaskInterface.clean()")
-        for par in self.param_objs:
-            par.clean()
-        for fil in self.file_objs:
-            fil.clean()
+        try:
+            for par in self.param_objs:
+                par.clean()
+            for fil in self.file_objs:
+                fil.clean()
+        finally:
+            if self.exchange is not None:
+                self.exchange.clean()
+                self.exchange = None
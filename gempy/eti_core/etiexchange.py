@@ -0,0 +1,91 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+from ..utils import logutils
+log = logutils.get_logger(__name__)
+
+# RAM-backed filesystem, used in preference to a disk if it's available
+SHM_DIR = "/dev/shm"
+# Space to leave free on it (bytes)
+SHM_MIN_FREE = 64 * 1024 * 1024
+# Environment variable to override the choice of directory
+TMPDIR_VARIABLE = "ETI_TMPDIR"
+
+# Directories that haven't been cleaned up yet, to be removed at exit
+_live_directories = set()
+
+
+def exchange_directory(nbytes=0):
+    """
+    Chooses where to put the files exchanged with an external task. This
+    is the directory in $ETI_TMPDIR if set, otherwise /dev/shm if it
+    exists, is writable, and has room for twice nbytes, and otherwise
+    the system temporary directory.
+
+    Parameters
+    ----------
+    nbytes : int
+        expected total size of the files
+
+    Returns
+    -------
+    str : name of the directory
+    """
+    tmpdir = os.environ.get(TMPDIR_VARIABLE)
+    if tmpdir:
+        return tmpdir
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK | os.X_OK):
+        try:
+            stat = os.statvfs(SHM_DIR)
+        except OSError:
+            pass
+        else:
+            if stat.f_bavail * stat.f_frsize > 2 * nbytes + SHM_MIN_FREE:
+                return SHM_DIR
+    return tempfile.gettempdir()
+
+
+class ETIExchange(object):
+    """
+    A private directory in which an ETI and its external task exchange
+    files. Each ETI invocation gets a uniquely-named directory, so several
+    can run at the same time (from the same working directory, or in
+    different threads or processes) without their files colliding, and
+    it is removed with all its contents by clean(), or at exit if clean()
+    is never called.
+
+    Parameters
+    ----------
+    nbytes : int
+        expected total size of the files (to decide where to put them)
+    prefix : str
+        prefix for the directory name
+    """
+    def __init__(self, nbytes=0, prefix="eti"):
+        self.path = tempfile.mkdtemp(prefix=prefix,
+                                     dir=exchange_directory(nbytes))
+        _live_directories.add(self.path)
+        log.debug("ETIExchange: using directory {}".format(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.clean()
+
+    def filename(self, name):
+        """Full path of a file in the exchange directory"""
+        return os.path.join(self.path, name)
+
+    def clean(self):
+        """Remove the directory and everything in it"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        _live_directories.discard(self.path)
+
+
+@atexit.register
+def _clean_all():
+    for path in list(_live_directories):
+        shutil.rmtree(path, ignore_errors=True)
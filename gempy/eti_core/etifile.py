@@ -7,6 +7,7 @@ class ETIFile(object):
     inputs = None
     params = None
     name = None
+    exchange = None
     def __init__(self, name=None, inputs=None, params=None):
         """
         :param rc: Used to store reduction information
@@ -17,6 +18,17 @@ class ETIFile(object):
         self.params = params
         self.name = name
 
+    def path(self, filename):
+        """Where the file should go: in the ETI's exchange directory, if
+        it has one, otherwise in the working directory"""
+        if self.exchange is None:
+            return filename
+        return self.exchange.filename(filename)
+
+    def nbytes(self):
+        """Approximate total size of the files (bytes)"""
+        return 0
+
     def prepare(self):
         print("ETIFile prepare()")
 
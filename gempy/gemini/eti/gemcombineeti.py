@@ -79,10 +79,12 @@ class GemcombineETI(PyrafETI):
     def run(self):
         """Convenience function that runs all the needed operations."""
         log.debug("GemcombineETI.run()")
-        self.prepare()
-        self.execute()
-        ad = self.recover()
-        self.clean()
+        try:
+            self.prepare()
+            self.execute()
+            ad = self.recover()
+        finally:
+            self.clean()
         return ad
 
     def recover(self):
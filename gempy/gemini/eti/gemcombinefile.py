@@ -39,6 +39,12 @@ class GemcombineFile(PyrafETIFile):
     def get_prefix(self):
         return "tmp" + self.pid_task
 
+    def remove_file(self, filename):
+        # The task may have failed before writing its outputs
+        if filename and os.path.isfile(filename):
+            os.remove(filename)
+            log.fullinfo("%s was deleted from disk" % filename)
+
 class InAtList(GemcombineFile):
     inputs = None
     params = None
@@ -54,18 +60,22 @@ class InAtList(GemcombineFile):
         GemcombineFile.__init__(self, inputs, params)
         self.atlist = ""
 
+    def nbytes(self):
+        # The inputs (with their VAR and DQ planes) and outputs
+        return 4 * sum(ext.data.nbytes for ad in self.adinput for ext in ad)
+
     def prepare(self):
         log.debug("InAtList prepare()")
         for ad in self.adinput:
             ad = gemini_tools.obsmode_add(ad)
             origname = ad.filename
             ad.update_filename(prefix=self.get_prefix(), strip=True)
-            self.diskinlist.append(ad.filename)
+            self.diskinlist.append(self.path(ad.filename))
             log.fullinfo("Temporary image (%s) on disk for the IRAF task %s" % \
-                          (ad.filename, self.taskname))
-            ad.write(ad.filename, overwrite=True)
+                          (self.diskinlist[-1], self.taskname))
+            ad.write(self.diskinlist[-1], overwrite=True)
             ad.filename = origname
-        self.atlist = "tmpImageList" + self.pid_task
+        self.atlist = self.path("tmpImageList" + self.pid_task)
         fhdl = open(self.atlist, "w")
         for fil in self.diskinlist:
             fhdl.writelines(fil + "\n")
@@ -77,10 +87,8 @@ class InAtList(GemcombineFile):
     def clean(self):
         log.debug("InAtList clean()")
         for a_file in self.diskinlist:
-            os.remove(a_file)
-            log.fullinfo("%s was deleted from disk" % a_file)
-        os.remove(self.atlist)
-        log.fullinfo("%s was deleted from disk" % self.atlist)
+            self.remove_file(a_file)
+        self.remove_file(self.atlist)
 
 class OutFile(GemcombineFile):
     inputs = None
@@ -109,7 +117,7 @@ class OutFile(GemcombineFile):
         outname = self.adinput[0].filename
         self.adinput[0].filename = origname
         self.ad_name = outname
-        self.tmp_name = self.get_prefix() + outname
+        self.tmp_name = self.path(self.get_prefix() + outname)
         self.filedict.update({"output": self.tmp_name})
 
     def recover(self):
@@ -122,8 +130,7 @@ class OutFile(GemcombineFile):
 
     def clean(self):
         log.debug("Outfile clean()")
-        os.remove(self.tmp_name)
-        log.fullinfo(self.tmp_name + " was deleted from disk")
+        self.remove_file(self.tmp_name)
 
 
 class LogFile(GemcombineFile):
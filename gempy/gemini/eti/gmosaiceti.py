@@ -84,10 +84,12 @@ class GmosaicETI(PyrafETI):
         """Convenience function that runs all the needed operations."""
         log.debug("GmosaicETI.run()")
         adlist = []
-        self.prepare()
-        self.execute()
-        adlist = self.recover()
-        self.clean()
+        try:
+            self.prepare()
+            self.execute()
+            adlist = self.recover()
+        finally:
+            self.clean()
         return adlist
 
     def recover(self):
@@ -44,6 +44,12 @@ class GmosaicFile(PyrafETIFile):
     def get_prefix(self):
         return "tmp" + self.pid_task
 
+    def remove_file(self, filename):
+        # The task may have failed before writing its outputs
+        if filename and os.path.isfile(filename):
+            os.remove(filename)
+            log.fullinfo("%s was deleted from disk" % filename)
+
 class InAtList(GmosaicFile):
     inputs = None
     params = None
@@ -58,18 +64,22 @@ class InAtList(GmosaicFile):
         GmosaicFile.__init__(self, inputs, params, ad)
         self.atlist = ""
 
+    def nbytes(self):
+        # The inputs (with their VAR and DQ planes) and outputs
+        return 4 * sum(ext.data.nbytes for ad in self.adinput for ext in ad)
+
     def prepare(self):
         log.debug("InAtList prepare()")
         for ad in self.adinput:
             ad = gemini_tools.obsmode_add(ad)
             origname = ad.filename
             ad.update_filename(prefix=self.get_prefix(), strip=True)
-            self.diskinlist.append(ad.filename)
+            self.diskinlist.append(self.path(ad.filename))
             log.fullinfo("Temporary image (%s) on disk for the IRAF task %s" % \
-                          (ad.filename, self.taskname))
-            ad.write(ad.filename, overwrite=True)
+                          (self.diskinlist[-1], self.taskname))
+            ad.write(self.diskinlist[-1], overwrite=True)
             ad.filename = origname
-        self.atlist = "tmpImageList" + self.pid_task
+        self.atlist = self.path("tmpImageList" + self.pid_task)
         fhdl = open(self.atlist, "w")
         for fil in self.diskinlist:
             fhdl.writelines(fil + "\n")
@@ -81,10 +91,8 @@ class InAtList(GmosaicFile):
     def clean(self):
         log.debug("InAtList clean()")
         for a_file in self.diskinlist:
-            os.remove(a_file)
-            log.fullinfo("%s was deleted from disk" % a_file)
-        os.remove(self.atlist)
-        log.fullinfo("%s was deleted from disk" % self.atlist)
+            self.remove_file(a_file)
+        self.remove_file(self.atlist)
 
 class OutAtList(GmosaicFile):
     inputs = None
@@ -112,9 +120,9 @@ class OutAtList(GmosaicFile):
             origname = ad.filename
             ad.update_filename(suffix=self.suffix, strip=True)
             self.ad_name.append(ad.filename)
-            self.diskoutlist.append(self.get_prefix() + ad.filename)
+            self.diskoutlist.append(self.path(self.get_prefix() + ad.filename))
             ad.filename = origname
-        self.atlist = "tmpOutList" + self.pid_task
+        self.atlist = self.path("tmpOutList" + self.pid_task)
         fhdl = open(self.atlist, "w")
         for fil in self.diskoutlist:
             fhdl.writelines(fil + "\n")
@@ -137,10 +145,8 @@ class OutAtList(GmosaicFile):
     def clean(self):
         log.debug("OutAtList clean()")
         for tmpname in self.diskoutlist:
-            os.remove(tmpname)
-            log.fullinfo(tmpname + " was deleted from disk")
-        os.remove(self.atlist)
-        log.fullinfo(self.atlist + " was deleted from disk")
+            self.remove_file(tmpname)
+        self.remove_file(self.atlist)
 
 
 class LogFile(GmosaicFile):
@@ -1,9 +1,8 @@
 import re
 import subprocess
-from astropy.io import fits
 from collections import deque
 
-from gempy.eti_core.eti import ExternalTaskInterface as ETI
+from gempy.eti_core.eti import ExternalTaskInterface as ETI, execute_commands
 from .sextractoretifile import SExtractorETIFile
 from .sextractoretiparam import SExtractorETIParam
 
@@ -17,7 +16,7 @@ __VERSION_REGEXP__ = ''.join(["^.*version (?P<", __REGEXP_GROUP_NAME__,
 class SExtractorETI(ETI):
     """This class coordinates the ETI as is relates to SExtractor"""
     def __init__(self, primitives_class=None, inputs=None, params=None, mask_dq_bits=None,
-                 getmask=False):
+                 getmask=False, max_processes=None):
         """
         Parameters
         ----------
@@ -33,11 +32,15 @@ class SExtractorETI(ETI):
             boolean array rather than integer
         getmask: bool
             make SExtractor produce an object mask and attach it to the outputs
+        max_processes: int/None
+            maximum number of SExtractor processes to run at the same time
+            (None => one per CPU)
         """
         super(SExtractorETI, self).__init__(primitives_class, inputs=inputs)
         self.add_param(SExtractorETIParam(params))
         self._mask_dq_bits = mask_dq_bits
         self._getmask = getmask
+        self._max_processes = max_processes
 
     def _version_regexp(self):
         """Compile a regular expression for matching the version
@@ -85,25 +88,29 @@ class SExtractorETI(ETI):
             except TypeError:
                 self.add_file(SExtractorETIFile(ad,
                               mask_dq_bits=self._mask_dq_bits))
-        # Run the ETI
-        self.prepare()
-        self.execute()
-        objdata = self.recover()
+        # Run the ETI, making sure the files are removed even if it fails
+        try:
+            self.prepare()
+            self.execute()
+            objdata = self.recover()
+            objmasks = [fil.read_objmask() if self._getmask else None
+                        for fil in self.file_objs]
+        finally:
+            self.clean()
         # Attach the OBJCATs and OBJMASKs to each extension in each input
         # This is kind of ugly, so maybe want to look at it
         i = 0
         for ad in self.inputs:
             try:
                 for ext in ad:
-                    ext.OBJCAT, objmask = objdata[i]
+                    ext.OBJCAT = objdata[i][0]
                     if self._getmask:
-                        ext.OBJMASK = fits.open(objmask)[0].data
+                        ext.OBJMASK = objmasks[i]
                     i += 1
             except TypeError:
-                ad.OBJCAT, objmask = objdata[i]
+                ad.OBJCAT = objdata[i][0]
                 if self._getmask:
-                    ad.OBJMASK = fits.open(objmask)[0].data
-        self.clean()
+                    ad.OBJMASK = objmasks[i]
         return self.inputs
 
     def execute(self):
@@ -123,7 +130,8 @@ class SExtractorETI(ETI):
             elif parameter != 'config':
                 cmd.extend(['-'+parameter, str(value)])
 
-        # Run SExtractor for each input file
+        # Make the SExtractor command for each input file
+        commands = []
         for file_obj in self.file_objs:
             files = ['-CATALOG_NAME', file_obj._catalog_file]
             if self._getmask:
@@ -133,10 +141,14 @@ class SExtractorETI(ETI):
                 files.extend(['-FLAG_IMAGE', file_obj._dq_image])
 
             # Add all the input-specific command-line arguments
-            [files.extend([param, value.popleft()]) for param, value in
-             list_params.items()]
+            [files.extend(['-'+param, str(value.popleft())]) for param, value
+             in list_params.items()]
             files.append(file_obj._sci_image)
-            self._execute(cmd+files)
+            commands.append(cmd+files)
+
+        # and run them all concurrently
+        self._execute_all(commands, [file_obj.name
+                                     for file_obj in self.file_objs])
 
     def recover(self):
         for par in self.param_objs:
@@ -144,12 +156,35 @@ class SExtractorETI(ETI):
         # Return a list of OBJCATs
         return [fil.recover() for fil in self.file_objs]
 
-    def _execute(self, command):
+    def _execute_all(self, commands, names=None):
+        """
+        Runs SExtractor commands concurrently (up to max_processes at once)
+        in the ETI subprocess if there is one, and returns their outputs.
+        If a command fails, the exception includes its output and the
+        name of its input (from names, if given).
+        """
+        if names is None:
+            names = [None] * len(commands)
+        if len(commands) == 1:
+            return [self._execute(commands[0], names[0])]
+        if self.inQueue is not None:
+            self.inQueue.put((commands, self._max_processes))
+            results = self.outQueue.get()
+        else:
+            results = execute_commands(commands, self._max_processes)
+        for result, name in zip(results, names):
+            if isinstance(result, Exception):
+                raise _sextractor_error(getattr(result, 'output', None) or
+                                        str(result), name)
+        return results
+
+    def _execute(self, command, name=None):
         if self.inQueue is not None:
             self.inQueue.put(command)
             result = self.outQueue.get()
             if isinstance(result, Exception):
-                raise result
+                raise _sextractor_error(getattr(result, 'output', None) or
+                                        str(result), name)
         else:
             pipe_out = subprocess.Popen(command,
                                         stdout=subprocess.PIPE,
@@ -157,7 +192,16 @@ class SExtractorETI(ETI):
                                         universal_newlines=True)
             (result, stderrdata) = pipe_out.communicate()
             if pipe_out.returncode != 0:
-                errmsg = ("SExtractor returned an error:\n"
-                          "{0}{1}".format(result, stderrdata))
-                raise Exception(errmsg)
+                raise _sextractor_error(result + stderrdata, name)
         return result
+
+
+def _sextractor_error(output, name=None):
+    """
+    Returns the exception for a failed SExtractor run, with its output
+    and the name of the input, if known
+    """
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+    return Exception("SExtractor returned an error{}:\n{}".format(
+        "" if name is None else " for {}".format(name), output))
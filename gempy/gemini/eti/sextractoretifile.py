@@ -40,12 +40,18 @@ class SExtractorETIFile(ETIFile):
                 self.data[(self.mask & mask_dq_bits)==0])
         self._disk_file = None
         self._catalog_file = None
+        self._objmask_file = None
+
+    def nbytes(self):
+        # Input image and DQ, and the int32 object mask
+        return (self.data.nbytes + 4 * self.data.size +
+                (0 if self.mask is None else 2 * self.mask.size))
 
     def prepare(self):
         # This looks silly, but we're pretending the array data is a "file"
-        self._catalog_file = PREFIX + self.name + '_cat' + SUFFIX
-        self._objmask_file = PREFIX + self.name + '_obj' + SUFFIX
-        filename = PREFIX + self.name + SUFFIX
+        self._catalog_file = self.path(PREFIX + self.name + '_cat' + SUFFIX)
+        self._objmask_file = self.path(PREFIX + self.name + '_obj' + SUFFIX)
+        filename = self.path(PREFIX + self.name + SUFFIX)
         hdulist = fits.HDUList()
         hdulist.append(fits.ImageHDU(self.data,
                                      header=self.header, name='SCI'))
@@ -70,10 +76,12 @@ class SExtractorETIFile(ETIFile):
         objcat = Table.read(self._catalog_file)
         return (objcat, self._objmask_file)
 
+    def read_objmask(self):
+        """Reads the object mask into memory, so the file can be deleted"""
+        return fits.getdata(self._objmask_file, memmap=False)
+
     def clean(self, remove_inputs=True):
-        if os.path.isfile(self._disk_file):
-            os.remove(self._disk_file)
-        if os.path.isfile(self._catalog_file):
-            os.remove(self._catalog_file)
-        if os.path.isfile(self._objmask_file):
-            os.remove(self._objmask_file)
\ No newline at end of file
+        for filename in (self._disk_file, self._catalog_file,
+                         self._objmask_file):
+            if filename is not None and os.path.isfile(filename):
+                os.remove(filename)
\ No newline at end of file
@@ -96,3 +96,17 @@ class TestGemcombine(object):
         del ad_stack
         ##  NEED TO ADD A FITS DIFF.  Then remove overwrite and delete
         ##  the output fits once the diff is completed.
+
+
+def test_clean_missing_outputs(tmpdir):
+    # If gemcombine fails, there's no output to delete
+    from gempy.gemini.eti import gemcombinefile
+    outfile = gemcombinefile.OutFile([], TESTDEFAULTPARAMS)
+    outfile.tmp_name = str(tmpdir.join('tmpstack.fits'))
+    outfile.clean()
+    inlist = gemcombinefile.InAtList([], TESTDEFAULTPARAMS)
+    inlist.diskinlist = [str(tmpdir.join('tmpin.fits'))]
+    inlist.atlist = str(tmpdir.join('tmpImageList'))
+    tmpdir.join('tmpin.fits').write('')
+    inlist.clean()
+    assert tmpdir.listdir() == []
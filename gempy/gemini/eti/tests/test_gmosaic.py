@@ -72,3 +72,14 @@ class TestGmosaic(object):
         del ad_mosaic
         ##  NEED TO ADD A FITS DIFF.  Then remove overwrite and delete
         ##  the output fits once the diff is completed.
+
+
+def test_clean_missing_outputs(tmpdir):
+    # If gmosaic fails, there are no outputs to delete
+    from gempy.gemini.eti import gmosaicfile
+    outlist = gmosaicfile.OutAtList([], TESTDEFAULTPARAMS, None)
+    outlist.diskoutlist = [str(tmpdir.join('tmpmosaic.fits'))]
+    outlist.atlist = str(tmpdir.join('tmpOutList'))
+    tmpdir.join('tmpOutList').write('')
+    outlist.clean()
+    assert tmpdir.listdir() == []
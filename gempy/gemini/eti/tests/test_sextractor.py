@@ -0,0 +1,170 @@
+# pytest suite
+"""
+Tests for the SExtractor eti.
+
+This is a suite of tests to be run with pytest. SExtractor itself is not
+needed: a fake "sex" script, which writes a small catalog and object mask,
+is put at the front of the PATH.
+
+To run:
+    1) py.test -v --capture=no
+"""
+
+import os
+import stat
+import sys
+import threading
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import astrodata
+import gemini_instruments
+
+from gempy.eti_core import etiexchange
+from gempy.eti_core.eti import execute_commands
+from gempy.gemini.eti.sextractoreti import SExtractorETI
+
+FAKE_SEX = """#!{python}
+import os, sys, time
+from astropy.io import fits
+
+if sys.argv[1] == '--version':
+    print("SExtractor version 2.19.5 (2014-03-19)")
+    sys.exit(0)
+args = dict(zip(sys.argv[1:-1:2], sys.argv[2:-1:2]))
+if os.environ.get('FAKE_SEX_FAIL'):
+    print("Error: cannot open " + args['-c'])
+    sys.exit(1)
+with open('sex.log', 'a') as f:
+    f.write('start {{}}\\n'.format(time.time()))
+time.sleep({duration})
+extver = fits.getheader(sys.argv[-1][:-3], 0)['EXTVER']
+fits.BinTableHDU.from_columns([
+    fits.Column(name='NUMBER', format='J', array=[1]),
+    fits.Column(name='X_IMAGE', format='E', array=[10. * extver]),
+    fits.Column(name='Y_IMAGE', format='E',
+                array=[float(args.get('-SATUR_LEVEL', 0))])
+]).writeto(args['-CATALOG_NAME'])
+fits.PrimaryHDU(data=[[extver]]).writeto(args['-CHECKIMAGE_NAME'])
+with open('sex.log', 'a') as f:
+    f.write('end {{}}\\n'.format(time.time()))
+"""
+
+
+@pytest.fixture
+def fake_sex(tmpdir, monkeypatch):
+    def make(duration=0.5):
+        script = tmpdir.join('sex')
+        script.write(FAKE_SEX.format(python=sys.executable, duration=duration))
+        os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IXUSR)
+        monkeypatch.setenv('PATH', str(tmpdir), prepend=os.pathsep)
+        monkeypatch.chdir(tmpdir)
+        return tmpdir
+    return make
+
+
+def make_ad(nextensions):
+    ad = astrodata.create(fits.PrimaryHDU())
+    for i in range(nextensions):
+        ad.append(fits.ImageHDU(data=np.zeros((10, 10), dtype=np.float32),
+                                name='SCI'))
+    ad.filename = 'N20180101S0001.fits'
+    return ad
+
+
+def max_running(logfile):
+    """Maximum number of fake SExtractor processes running at once"""
+    events = sorted((float(t), 1 if what == 'start' else -1)
+                    for what, t in (line.split() for line in logfile.readlines()))
+    return max(np.cumsum([change for _, change in events]))
+
+
+@pytest.mark.parametrize('max_processes', [1, 2, 4])
+def test_sextractor_concurrent(fake_sex, max_processes):
+    tmpdir = fake_sex()
+    ad = make_ad(4)
+    sex_task = SExtractorETI(inputs=[ad], getmask=True,
+                             params={'config': 'default.sex',
+                                     'SATUR_LEVEL': [100, 200, 300, 400]},
+                             max_processes=max_processes)
+    assert sex_task.check_version()
+    sex_task.run()
+
+    running = max_running(tmpdir.join('sex.log'))
+    assert running <= max_processes
+    assert running > 1 or max_processes == 1
+    # Catalogs, masks and per-extension parameters go with the right extension
+    for i, ext in enumerate(ad):
+        assert ext.OBJCAT['X_IMAGE'][0] == 10 * (i + 1)
+        assert ext.OBJCAT['Y_IMAGE'][0] == 100 * (i + 1)
+        assert ext.OBJMASK[0, 0] == i + 1
+    # Temporary files are removed
+    assert sorted(os.listdir(str(tmpdir))) == ['sex', 'sex.log']
+
+
+def test_execute_commands(fake_sex):
+    fake_sex(duration=0)
+    results = execute_commands([['sex', '--version'], ['false'],
+                                ['this_command_does_not_exist']])
+    assert b'version 2.19.5' in results[0]
+    assert isinstance(results[1], Exception)
+    assert isinstance(results[2], Exception)
+
+
+def test_sextractor_exchange(fake_sex, monkeypatch):
+    tmpdir = fake_sex(duration=0.2)
+    exchange_dir = tmpdir.mkdir('exchange')
+    monkeypatch.setenv(etiexchange.TMPDIR_VARIABLE, str(exchange_dir))
+
+    # Simultaneous runs on files with the same name don't collide
+    ads = [make_ad(2) for _ in range(3)]
+    threads = [threading.Thread(target=SExtractorETI(
+        inputs=[ad], getmask=True, params={'config': 'default.sex',
+                                           'SATUR_LEVEL': [100 * i, 100 * i]},
+        max_processes=1).run) for i, ad in enumerate(ads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i, ad in enumerate(ads):
+        for j, ext in enumerate(ad):
+            assert ext.OBJCAT['X_IMAGE'][0] == 10 * (j + 1)
+            assert ext.OBJCAT['Y_IMAGE'][0] == 100 * i
+            assert ext.OBJMASK[0, 0] == j + 1
+    assert os.listdir(str(exchange_dir)) == []
+
+    # and the files are removed if SExtractor fails
+    monkeypatch.setenv('FAKE_SEX_FAIL', '1')
+    with pytest.raises(Exception):
+        SExtractorETI(inputs=[make_ad(2)], getmask=True,
+                      params={'config': 'default.sex'}).run()
+    assert os.listdir(str(exchange_dir)) == []
+    assert sorted(os.listdir(str(tmpdir))) == ['exchange', 'sex', 'sex.log']
+
+
+@pytest.mark.parametrize('nextensions', [1, 2])
+def test_sextractor_error(fake_sex, monkeypatch, nextensions):
+    # The error says which extension failed, and what SExtractor said
+    fake_sex(duration=0)
+    monkeypatch.setenv('FAKE_SEX_FAIL', '1')
+    with pytest.raises(Exception) as err:
+        SExtractorETI(inputs=[make_ad(nextensions)],
+                      params={'config': 'default.sex'}).run()
+    message = str(err.value)
+    assert message.startswith("SExtractor returned an error for "
+                              "N20180101S0001_1:")
+    assert "cannot open default.sex" in message
+
+
+def test_exchange_directory(monkeypatch):
+    monkeypatch.delenv(etiexchange.TMPDIR_VARIABLE, raising=False)
+    directory = etiexchange.exchange_directory()
+    assert os.path.isdir(directory)
+    # Files too big for /dev/shm go elsewhere
+    assert etiexchange.exchange_directory(nbytes=2**60) != etiexchange.SHM_DIR
+    with etiexchange.ETIExchange() as exchange:
+        assert os.path.dirname(exchange.path) == directory
+        open(exchange.filename('test.fits'), 'w').close()
+    assert not os.path.exists(exchange.path)
@@ -4,6 +4,8 @@ this command again under the new environment.::
 
     $ cythonize -i cyclip.pyx
 
+This builds the module without OpenMP, so iterclip() will run serially.
+setup.py builds it with OpenMP if the compiler supports it.
 """
 
 # Specify that this source is nominally based on Python 3 syntax (though the code
@@ -12,35 +14,41 @@ this command again under the new environment.::
 # cython: language_level=3
 #
 
+from multiprocessing import cpu_count
+
 import numpy as np
 from libc.math cimport sqrt
+from libc.stdlib cimport malloc, free
 cimport cython
+from cython.parallel cimport prange, threadid
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 cdef float median(float data[], unsigned short mask[], int has_mask,
-                  int data_size):
+                  int data_size, float tmp[]) nogil:
     """
     One-dimensional true median, with optional masking.
 
     Parameters
     ----------
     data : float array
-        (add description)
+        1D array of datapoints
     mask : unsigned short array
-        (add description)
+        1D array indicating which pixels are masked (non-zero)
     has_mask : int
-        (add description)
+        is there a mask?
     data_size : int
-        (add description)
+        length of array
+    tmp : float array
+        scratch space, at least as long as data
 
     Returns
     -------
-    med : (add type)
-        (add description)
+    med : float
+        median of the unmasked datapoints (or all of them, if they're all
+        masked)
     """
-    cdef float tmp[10000]
     cdef float x, y, med=0.
     cdef int i, j, k, l, m, ncycles, cycle, nused=0
 
@@ -90,8 +98,9 @@ cdef float median(float data[], unsigned short mask[], int has_mask,
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
-cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
-                long data_size, int return_median, double result[2]):
+cdef int mask_stats(float data[], unsigned short mask[], int has_mask,
+                    long data_size, int return_median, double result[2],
+                    float tmp[]) nogil:
     """
     Returns either the mean or median (and variance) of the unmasked pixels in
     an array.
@@ -108,10 +117,13 @@ cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
         length of array
     return_median : int
         return median?
+    tmp : float array
+        scratch space for the median, at least as long as data
 
     Returns
     -------
-
+    result : double array
+        the mean (or median) and variance are placed here
     """
     cdef double mean, sum = 0., sumsq = 0., sumall = 0., sumsqall=0.
     cdef int i, nused = 0
@@ -128,27 +140,28 @@ cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
         nused = data_size
     mean = sum / float(nused)
     if return_median:
-        result[0] = <double>median(data, mask, has_mask, data_size)
+        result[0] = <double>median(data, mask, has_mask, data_size, tmp)
     else:
         result[0] = mean
     result[1] = sumsq / nused - mean*mean
+    return 0
 
 
-cdef long num_good(unsigned short mask[], long data_size):
+cdef long num_good(unsigned short mask[], long data_size) nogil:
     """
     Returns the number of unmasked pixels in an array.
 
     Parameters
     ----------
     mask : unsigned short array
-        (add description)
+        1D array indicating which pixels are masked (non-zero)
     data_size : long
-        (add description)
+        length of array
 
     Returns
     -------
-    ngood : (?)
-        (add description)
+    ngood : long
+        number of pixels where mask==0
     """
     cdef long i, ngood = 0
 
@@ -159,22 +172,79 @@ cdef long num_good(unsigned short mask[], long data_size):
     return ngood
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int clip_pixel(float data[], unsigned short mask[], float variance[],
+                    int has_var, int num_img, long data_size, long i,
+                    double lsigma, double hsigma, int max_iters, int mclip,
+                    int sigclip, float tmpdata[], unsigned short tmpmask[],
+                    float work[]) nogil:
+    """
+    Iterative clipping of the num_img input pixels that make up a single
+    output pixel. Arguments are as for iterclip(), plus the index of the
+    pixel and three scratch arrays of length num_img. Returns 0 (this is
+    an int function, rather than void, so that calling it never needs to
+    acquire the GIL to check for exceptions).
+    """
+    cdef long n, ngood, new_ngood
+    cdef int iter = 0, return_median = 1
+    cdef double result[2]
+    cdef double avg, std
+    cdef float low_limit, high_limit
+
+    for n in range(num_img):
+        tmpdata[n] = data[n*data_size+i]
+        tmpmask[n] = mask[n*data_size+i]
+    ngood = num_good(tmpmask, num_img)
+    while iter < max_iters:
+        mask_stats(tmpdata, tmpmask, 1, num_img, return_median, result, work)
+        avg = result[0]
+        if has_var == 0 or sigclip:
+            std = sqrt(result[1])
+            low_limit = avg - lsigma * std
+            high_limit = avg + hsigma * std
+            for n in range(num_img):
+                if tmpdata[n] < low_limit or tmpdata[n] > high_limit:
+                    tmpmask[n] |= 1
+        else:
+            for n in range(num_img):
+                std = sqrt(variance[n*data_size+i])
+                if tmpdata[n] < avg-lsigma*std or tmpdata[n] > avg+hsigma*std:
+                    tmpmask[n] |= 1
+
+        new_ngood = num_good(tmpmask, num_img)
+        if new_ngood == ngood:
+            break
+        if not mclip:
+            return_median = 0
+        ngood = new_ngood
+        iter += 1
+    for n in range(num_img):
+        mask[n*data_size+i] = tmpmask[n]
+    return 0
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def iterclip(float [:] data, unsigned short [:] mask, float [:] variance,
              int has_var, int num_img, long data_size, double lsigma,
-             double hsigma, int max_iters, int mclip, int sigclip):
+             double hsigma, int max_iters, int mclip, int sigclip,
+             int num_threads=0):
     """
     Iterative sigma-clipping. This is the function that interfaces with python.
 
+    The pixels are processed in parallel with OpenMP, without holding the
+    GIL, if the module was compiled with OpenMP support (otherwise they are
+    processed serially).
+
     Parameters
     ----------
     data : float array
         1D arrays of input, each made up of num_img points for each input pixel.
     mask : unsigned short array
-        (add description)
+        1D array of input masks (modified in place)
     variance : float array
-        (add description)
+        1D array of input variances
     has_var : int
         Worry about the input variance array?
     num_img : int
@@ -192,60 +262,307 @@ def iterclip(float [:] data, unsigned short [:] mask, float [:] variance,
     sigclip : int
         Perform sigma-clipping using the pixel-to-pixel scatter, rather than
         use the variance array?
+    num_threads : int
+        Number of threads to use (0 means one per CPU)
 
     Returns
     -------
     data : numpy.ndarray(np.float)
-        (add description)
+        the input data (unchanged)
     mask : numpy.ndarray(np.float)
-        (add description)
+        the input mask, with clipped pixels flagged with the 1 bit
     variance : numpy.ndarray(np.float)
-        (add description)
+        the input variance (unchanged)
 
     """
 
-    cdef long i, n, ngood, new_ngood
-    cdef int iter, return_median
-    cdef double result[2]
-    cdef double avg, var, std
-    cdef float low_limit, high_limit
-    cdef float tmpdata[10000]
-    cdef unsigned short tmpmask[10000]
+    cdef long i
+    cdef int tid
 
     if max_iters == 0:
         max_iters = 100
+    if num_threads <= 0:
+        num_threads = cpu_count()
 
-    for i in range(data_size):
-        iter = 0
-        return_median = 1
-        for n in range(num_img):
-            tmpdata[n] = data[n*data_size+i]
-            tmpmask[n] = mask[n*data_size+i]
-        ngood = num_good(tmpmask, num_img)
-        while iter < max_iters:
-            mask_stats(tmpdata, tmpmask, 1, num_img, return_median, result)
-            avg = result[0]
-            if has_var == 0 or sigclip:
-                std = sqrt(result[1])
-                low_limit = avg - lsigma * std
-                high_limit = avg + hsigma * std
-                for n in range(num_img):
-                    if tmpdata[n] < low_limit or tmpdata[n] > high_limit:
-                        tmpmask[n] |= 1
+    # Scratch space for each thread, sized from the number of images
+    tmpdata = np.empty((num_threads * num_img,), dtype=np.float32)
+    tmpmask = np.empty((num_threads * num_img,), dtype=np.uint16)
+    work = np.empty((num_threads * num_img,), dtype=np.float32)
+    cdef float [:] tmpdata_view = tmpdata
+    cdef unsigned short [:] tmpmask_view = tmpmask
+    cdef float [:] work_view = work
+
+    for i in prange(data_size, nogil=True, num_threads=num_threads,
+                    schedule='guided'):
+        tid = threadid()
+        clip_pixel(&data[0], &mask[0], &variance[0], has_var, num_img,
+                   data_size, i, lsigma, hsigma, max_iters, mclip, sigclip,
+                   &tmpdata_view[tid*num_img], &tmpmask_view[tid*num_img],
+                   &work_view[tid*num_img])
+
+    return np.asarray(data), np.asarray(mask), np.asarray(variance)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def process_mask(unsigned short [:] mask, unsigned char [:] levels,
+                 int num_img, long data_size):
+    """
+    Resolves the DQ hierarchy for a stack of masks. For each output pixel,
+    the inputs at the least bad level of the hierarchy are used. Their mask
+    values are set to 0 and the other inputs are set to 32768, while the
+    output mask is the bitwise-OR of the inputs that are used. If none of
+    the inputs is at any level of the hierarchy, the input masks are left
+    unchanged and the output mask is 0.
+
+    Parameters
+    ----------
+    mask : unsigned short array
+        1D array of input masks, each made up of data_size points for each
+        input image. This is modified in place.
+    levels : unsigned char array
+        lookup table of the level in the hierarchy of every possible mask
+        value (255 if it's not in the hierarchy)
+    num_img : int
+        Number of input images.
+    data_size : long
+        Number of pixels per input image
+
+    Returns
+    -------
+    mask : numpy.ndarray(np.uint16)
+        the modified input masks, with 0 for the pixels to be used
+    out_mask : numpy.ndarray(np.uint16)
+        the output mask
+    """
+    cdef long i, n, offset
+    cdef unsigned short m
+    cdef unsigned char level
+    out_mask = np.zeros((data_size,), dtype=np.uint16)
+    best = np.full((data_size,), 255, dtype=np.uint8)
+    cdef unsigned short [:] out_mask_view = out_mask
+    cdef unsigned char [:] best_view = best
+
+    # Work through the images in order, so the memory access is sequential
+    for n in range(num_img):
+        offset = n * data_size
+        for i in range(data_size):
+            level = levels[mask[offset+i]]
+            if level < best_view[i]:
+                best_view[i] = level
+
+    for n in range(num_img):
+        offset = n * data_size
+        for i in range(data_size):
+            if best_view[i] == 255:
+                continue
+            m = mask[offset+i]
+            if levels[m] == best_view[i]:
+                out_mask_view[i] |= m
+                mask[offset+i] = 0
             else:
-                for n in range(num_img):
-                    std = sqrt(variance[n*data_size+i])
-                    if tmpdata[n] < avg-lsigma*std or tmpdata[n] > avg+hsigma*std:
-                        tmpmask[n] |= 1
+                mask[offset+i] = 32768
+
+    return np.asarray(mask), out_mask
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void kth_smallest(float data[], int index[], int data_size, int k):
+    """
+    Partially sorts an array in place, so that the k-th smallest element
+    (counting from zero) is at position k, with smaller or equal elements
+    before it and larger or equal elements after it. An array of indices
+    is reordered in the same way, so the original positions of the
+    elements can be recovered.
+
+    Parameters
+    ----------
+    data : float array
+        1D array of datapoints
+    index : int array
+        1D array of indices, reordered along with data
+    data_size : int
+        length of arrays
+    k : int
+        element to select
+    """
+    cdef float x, y
+    cdef int i, j, l = 0, m = data_size - 1, tmp_index
 
-            new_ngood = num_good(tmpmask, num_img)
-            if new_ngood == ngood:
+    while l < m:
+        x = data[k]
+        i = l
+        j = m
+        while True:
+            while data[i] < x:
+                i += 1
+            while x < data[j]:
+                j -= 1
+            if i <= j:
+                y = data[i]
+                data[i] = data[j]
+                data[j] = y
+                tmp_index = index[i]
+                index[i] = index[j]
+                index[j] = tmp_index
+                i += 1
+                j -= 1
+            if i > j:
                 break
-            if not mclip:
-                return_median = 0
-            ngood = new_ngood
-            iter += 1
+        if j < k:
+            l = i
+        if k < i:
+            m = j
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def masked_median(float [:] data, unsigned short [:] mask, float [:] variance,
+                  int has_var, int num_img, long data_size, int low):
+    """
+    Median (or low median) of the unmasked pixels of a stack of images,
+    using quickselect so it is O(num_img) per pixel. If all the input
+    pixels are masked, all of them are used. The variance of the median
+    is the variance of the selected pixel (or the mean of the variances
+    of the two middle pixels, if there's an even number of them).
+
+    Parameters
+    ----------
+    data : float array
+        1D array of input, made up of data_size points for each input image.
+    mask : unsigned short array
+        1D array of input masks; only pixels with a value of zero are used
+    variance : float array
+        1D array of input variances
+    has_var : int
+        Worry about the input variance array?
+    num_img : int
+        Number of input images.
+    data_size : long
+        Number of pixels per input image
+    low : int
+        Return the low median (i.e., the lower of the two middle pixels
+        when there's an even number)?
+
+    Returns
+    -------
+    out_data : numpy.ndarray(np.float32)
+        median of each pixel
+    out_var : numpy.ndarray(np.float32)
+        variance of each median (or None if has_var is false)
+    """
+    cdef long i, n
+    cdef int k, nused
+    cdef float med, medvar = 0.
+    out_data = np.empty((data_size,), dtype=np.float32)
+    out_var = np.empty((data_size,), dtype=np.float32)
+    cdef float [:] out_data_view = out_data
+    cdef float [:] out_var_view = out_var
+    cdef float *tmpdata = <float *> malloc(num_img * sizeof(float))
+    cdef int *tmpindex = <int *> malloc(num_img * sizeof(int))
+    if not tmpdata or not tmpindex:
+        free(tmpdata)
+        free(tmpindex)
+        raise MemoryError()
+
+    for i in range(data_size):
+        nused = 0
         for n in range(num_img):
-            mask[n*data_size+i] = tmpmask[n]
+            if mask[n*data_size+i] == 0:
+                tmpdata[nused] = data[n*data_size+i]
+                tmpindex[nused] = n
+                nused += 1
+        if nused == 0:
+            for n in range(num_img):
+                tmpdata[n] = data[n*data_size+i]
+                tmpindex[n] = n
+            nused = num_img
 
-    return np.asarray(data), np.asarray(mask), np.asarray(variance)
+        k = (nused - 1) // 2
+        kth_smallest(tmpdata, tmpindex, nused, k)
+        med = tmpdata[k]
+        if has_var:
+            medvar = variance[tmpindex[k]*data_size+i]
+        if nused % 2 == 0 and not low:
+            # The next element is the smallest of those above the k-th
+            k += 1
+            for n in range(k+1, nused):
+                if tmpdata[n] < tmpdata[k]:
+                    tmpdata[k], tmpdata[n] = tmpdata[n], tmpdata[k]
+                    tmpindex[k], tmpindex[n] = tmpindex[n], tmpindex[k]
+            med = 0.5 * (med + tmpdata[k])
+            if has_var:
+                medvar = 0.5 * (medvar + variance[tmpindex[k]*data_size+i])
+        out_data_view[i] = med
+        if has_var:
+            out_var_view[i] = medvar
+
+    free(tmpdata)
+    free(tmpindex)
+    return out_data, (out_var if has_var else None)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def minmax(float [:] data, unsigned short [:] mask, int num_img,
+           long data_size, double nlow, double nhigh, unsigned short bad):
+    """
+    Minmax rejection, following IRAF rules. For each pixel, the nlow lowest
+    and nhigh highest of the good input pixels (scaled by the fraction of
+    input pixels that are good) are flagged as bad by setting their
+    lowest mask bit. Pixels are not reordered.
+
+    Parameters
+    ----------
+    data : float array
+        1D array of input, made up of data_size points for each input image.
+    mask : unsigned short array
+        1D array of input masks. This is modified in place.
+    num_img : int
+        Number of input images.
+    data_size : long
+        Number of pixels per input image
+    nlow : double
+        Number of low pixels to reject
+    nhigh : double
+        Number of high pixels to reject
+    bad : unsigned short
+        Mask bits that indicate that an input pixel is not good
+
+    Returns
+    -------
+    mask : numpy.ndarray(np.uint16)
+        the modified input masks
+    """
+    cdef long i, n
+    cdef int nused, nlo, nhi
+    cdef float *tmpdata = <float *> malloc(num_img * sizeof(float))
+    cdef int *tmpindex = <int *> malloc(num_img * sizeof(int))
+    if not tmpdata or not tmpindex:
+        free(tmpdata)
+        free(tmpindex)
+        raise MemoryError()
+
+    for i in range(data_size):
+        nused = 0
+        for n in range(num_img):
+            if mask[n*data_size+i] & bad == 0:
+                tmpdata[nused] = data[n*data_size+i]
+                tmpindex[nused] = n
+                nused += 1
+        # IRAF imcombine maths
+        nlo = <int>(nused * nlow / num_img + 0.001)
+        nhi = nused - <int>(nused * nhigh / num_img + 0.001)
+        if nlo > 0:
+            kth_smallest(tmpdata, tmpindex, nused, nlo-1)
+            for n in range(nlo):
+                mask[tmpindex[n]*data_size+i] |= 1
+        if nhi < nused:
+            kth_smallest(tmpdata+nlo, tmpindex+nlo, nused-nlo, nhi-nlo)
+            for n in range(nhi, nused):
+                mask[tmpindex[n]*data_size+i] |= 1
+
+    free(tmpdata)
+    free(tmpindex)
+    return np.asarray(mask)
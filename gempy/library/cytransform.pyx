@@ -0,0 +1,169 @@
+"""
+Compiled routines for gempy.library.transform. If switching to new versions
+of Python under anaconda, you may need to run this command again under the
+new environment.::
+
+    $ cythonize -i cytransform.pyx
+
+This builds the module without OpenMP, so the loops will run serially.
+setup.py builds it with OpenMP if the compiler supports it.
+"""
+
+# cython: language_level=3
+
+from multiprocessing import cpu_count
+
+import numpy as np
+from libc.math cimport floor
+cimport cython
+from cython.parallel cimport prange
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline unsigned short resample_pixel(const unsigned short[:, ::1] mask,
+                                          double y, double x, int order,
+                                          double threshold,
+                                          unsigned short cval) nogil:
+    """
+    Returns the value of a bitmask at the (y, x) input coordinates. This is
+    equivalent to interpolating each bit plane separately (with the same
+    boundary handling as scipy.ndimage in 'constant' mode), and setting the
+    bit if the interpolated value exceeds threshold. The interpolation
+    weights are computed once and applied to all the bits.
+    """
+    cdef Py_ssize_t ny = mask.shape[0], nx = mask.shape[1]
+    cdef Py_ssize_t y0, x0
+    cdef double dy, dx, wy, wx, w
+    cdef double tally[16]
+    cdef unsigned short value, present = 0, result = 0
+    cdef int bit, i, j
+
+    if y < 0 or x < 0 or y > ny - 1 or x > nx - 1:
+        return cval
+    if order == 0:
+        return mask[<Py_ssize_t>floor(y + 0.5), <Py_ssize_t>floor(x + 0.5)]
+
+    y0 = <Py_ssize_t>floor(y)
+    x0 = <Py_ssize_t>floor(x)
+    dy = y - y0
+    dx = x - x0
+    for bit in range(16):
+        tally[bit] = 0.
+    for i in range(2):
+        wy = dy if i else 1. - dy
+        # This also stops us from going past the last row/column
+        if wy == 0:
+            continue
+        for j in range(2):
+            wx = dx if j else 1. - dx
+            if wx == 0:
+                continue
+            w = wy * wx
+            value = mask[y0+i, x0+j]
+            present |= value
+            bit = 0
+            while value:
+                if value & 1:
+                    tally[bit] += w
+                value >>= 1
+                bit += 1
+
+    for bit in range(16):
+        if present & (1 << bit) and tally[bit] > threshold:
+            result |= 1 << bit
+    return result
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def bitmask_affine_transform(const unsigned short[:, ::1] mask, matrix, offset,
+                             output_shape, int order=1, double threshold=0.01,
+                             unsigned short cval=0, int num_threads=0):
+    """
+    Affine transformation of a 16-bit mask, the equivalent of calling
+    scipy.ndimage.affine_transform() on every bit plane.
+
+    Parameters
+    ----------
+    mask : 2D uint16 array
+        Input bitmask
+    matrix : 2x2 array
+        Matrix of the transformation (output -> input coordinates)
+    offset : sequence
+        Offset of the transformation
+    output_shape : tuple
+        Shape of the output array
+    order : int (0-1)
+        Order of interpolation (nearest-neighbour or linear)
+    threshold : float
+        Fraction of a pixel that needs to be flagged with a bit for this
+        bit to be set in the output
+    cval : int
+        Output value for pixels that map outside the input array
+    num_threads : int
+        Number of threads to use (0 means one per CPU)
+
+    Returns
+    -------
+    uint16 array
+    """
+    cdef double m00 = matrix[0][0], m01 = matrix[0][1]
+    cdef double m10 = matrix[1][0], m11 = matrix[1][1]
+    cdef double off0 = offset[0], off1 = offset[1]
+    cdef Py_ssize_t i, j, nyout = output_shape[0], nxout = output_shape[1]
+
+    if order not in (0, 1):
+        raise ValueError("Only orders 0 and 1 are supported")
+    if num_threads <= 0:
+        num_threads = cpu_count()
+
+    out = np.empty((nyout, nxout), dtype=np.uint16)
+    cdef unsigned short[:, ::1] outview = out
+
+    for i in prange(nyout, nogil=True, num_threads=num_threads):
+        for j in range(nxout):
+            outview[i, j] = resample_pixel(mask, m00 * i + m01 * j + off0,
+                                           m10 * i + m11 * j + off1,
+                                           order, threshold, cval)
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def bitmask_map_coordinates(const unsigned short[:, ::1] mask,
+                            const float[:, :, :] coords, int order=1,
+                            double threshold=0.01, unsigned short cval=0,
+                            int num_threads=0):
+    """
+    Geometric transformation of a 16-bit mask, the equivalent of calling
+    scipy.ndimage.map_coordinates() on every bit plane.
+
+    Parameters
+    ----------
+    mask : 2D uint16 array
+        Input bitmask
+    coords : float32 array (2, ny, nx)
+        Input coordinates for every output pixel (as in GeoMap.coords)
+    order, threshold, cval, num_threads :
+        See bitmask_affine_transform()
+
+    Returns
+    -------
+    uint16 array
+    """
+    cdef Py_ssize_t i, j, nyout = coords.shape[1], nxout = coords.shape[2]
+
+    if order not in (0, 1):
+        raise ValueError("Only orders 0 and 1 are supported")
+    if num_threads <= 0:
+        num_threads = cpu_count()
+
+    out = np.empty((nyout, nxout), dtype=np.uint16)
+    cdef unsigned short[:, ::1] outview = out
+
+    for i in prange(nyout, nogil=True, num_threads=num_threads):
+        for j in range(nxout):
+            outview[i, j] = resample_pixel(mask, coords[0, i, j], coords[1, i, j],
+                                           order, threshold, cval)
+    return out
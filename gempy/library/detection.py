@@ -0,0 +1,577 @@
+# detection.py -- in-process source detection
+#
+# This module finds and measures sources in images with numpy and scipy,
+# as an alternative to running SExtractor through the ETI. It follows the
+# same steps as SExtractor (background mesh, convolution, thresholding,
+# labelling, isophotal measurements, and Kron photometry) and produces
+# an OBJCAT with the SExtractor columns used by the rest of the package,
+# plus a segmentation map for the OBJMASK, without any temporary files.
+#
+# X_IMAGE and Y_IMAGE are isophotal barycentres, as SExtractor's are, and
+# XWIN_IMAGE and YWIN_IMAGE are the positions refined iteratively within a
+# Gaussian window, as SExtractor's windowed positions are; these are more
+# precise for faint sources but aren't used elsewhere in the package.
+# There is no multi-threshold deblending, so blended sources are reported
+# as a single object, and CLASS_STAR is a simple comparison of the FWHM
+# with the seeing rather than SExtractor's neural network.
+
+from __future__ import division, print_function
+
+import numpy as np
+from scipy import interpolate, ndimage
+from astropy.table import Table
+from astropy.wcs import WCS
+
+# SExtractor FLAGS values
+FLAG_NEIGHBOURS = 1
+FLAG_SATURATED = 4
+FLAG_TRUNCATED = 8
+
+# Parameters, with SExtractor's names, used if they're not in the config
+DEFAULTS = {'DETECT_MINAREA': 5, 'DETECT_THRESH': 1.5, 'ANALYSIS_THRESH': 1.5,
+            'FILTER': 'Y', 'FILTER_NAME': None, 'PHOT_AUTOPARAMS': '2.5,3.5',
+            'PHOT_FLUXFRAC': 0.5, 'SATUR_LEVEL': 50000., 'MAG_ZEROPOINT': 0.,
+            'GAIN': 0., 'PIXEL_SCALE': 0., 'SEEING_FWHM': None,
+            'BACK_SIZE': 64, 'BACK_FILTERSIZE': 3}
+
+
+def read_config(filename):
+    """
+    Reads a SExtractor configuration (.sex) file
+
+    Parameters
+    ----------
+    filename: str
+        name of the file
+
+    Returns
+    -------
+    dict: {parameter name: value (as a string)}
+    """
+    config = {}
+    with open(filename) as f:
+        for line in f:
+            items = line.split('#')[0].split(None, 1)
+            if len(items) == 2:
+                config[items[0].upper()] = items[1].strip()
+    return config
+
+
+def read_kernel(filename):
+    """
+    Reads a SExtractor convolution (.conv) file
+
+    Parameters
+    ----------
+    filename: str
+        name of the file
+
+    Returns
+    -------
+    2D float array: the (normalized) convolution kernel
+    """
+    rows = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line and not (line.startswith('#') or line.startswith('CONV')):
+                rows.append([float(x) for x in line.split()])
+    kernel = np.array(rows)
+    return kernel / kernel.sum()
+
+
+def _interpolate_mesh(mesh, shape, mesh_size):
+    """
+    Interpolates a background mesh (with values at the centres of the
+    mesh cells) to the full image with cubic splines, keeping the values
+    constant beyond the outermost cell centres. This is done one axis at
+    a time, so no full-size coordinate arrays are needed.
+    """
+    for axis, length in enumerate(shape):
+        ncells = mesh.shape[axis]
+        if ncells == 1:
+            mesh = np.repeat(mesh, length, axis=axis)
+            continue
+        centres = (np.arange(ncells) + 0.5) * mesh_size - 0.5
+        coords = np.clip(np.arange(length), centres[0], centres[-1])
+        mesh = interpolate.interp1d(centres, mesh, axis=axis, assume_sorted=True,
+                                    kind='cubic' if ncells > 3 else 'linear')(coords)
+    return mesh
+
+
+def background_mesh(data, mask=None, mesh_size=64, filter_size=3, sigma=3.0,
+                    niter=3):
+    """
+    Estimates the background level and noise of an image, in the same way
+    as SExtractor. The image is divided into square cells, and in each the
+    background is estimated from the sigma-clipped pixels as
+    2.5*median - 1.5*mean (or the median, if the distribution is very
+    skewed). The mesh of values is median-filtered and then interpolated.
+
+    Parameters
+    ----------
+    data: 2D array
+        image data
+    mask: 2D bool array/None
+        pixels to ignore
+    mesh_size: int
+        size of the mesh cells (pixels)
+    filter_size: int
+        size of the median filter (mesh cells)
+    sigma: float
+        clipping threshold (standard deviations)
+    niter: int
+        number of clipping iterations
+
+    Returns
+    -------
+    background, rms: 2D arrays
+        the background level and noise at each pixel
+    """
+    ny, nx = data.shape
+    nycells, nxcells = -(-ny // mesh_size), -(-nx // mesh_size)
+    padded = np.full((nycells * mesh_size, nxcells * mesh_size), np.nan)
+    padded[:ny, :nx] = data
+    if mask is not None:
+        padded[:ny, :nx][mask] = np.nan
+    cells = padded.reshape(nycells, mesh_size, nxcells, mesh_size).swapaxes(
+        1, 2).reshape(nycells, nxcells, -1)
+
+    with np.errstate(invalid='ignore'):
+        for _ in range(niter):
+            median = np.nanmedian(cells, axis=-1)
+            std = np.nanstd(cells, axis=-1)
+            cells = np.where(abs(cells - median[..., np.newaxis]) >
+                             sigma * std[..., np.newaxis], np.nan, cells)
+        median = np.nanmedian(cells, axis=-1)
+        mean = np.nanmean(cells, axis=-1)
+        std = np.nanstd(cells, axis=-1)
+        mode = np.where(abs(mean - median) < 0.3 * std,
+                        2.5 * median - 1.5 * mean, median)
+
+    # Cells with too few good pixels take the typical value
+    bad = np.sum(np.isfinite(cells), axis=-1) < 0.1 * mesh_size * mesh_size
+    meshes = []
+    for values in (mode, std):
+        values[bad] = np.median(values[~bad]) if np.any(~bad) else 0.
+        values = ndimage.median_filter(values, size=filter_size, mode='nearest')
+        meshes.append(_interpolate_mesh(values, data.shape, mesh_size))
+    return tuple(meshes)
+
+
+def _ellipse(xx, yy, xy):
+    """
+    Semi-major and semi-minor axes, and position angle (radians), of the
+    ellipses with these second moments (or covariances)
+    """
+    half_sum = 0.5 * (xx + yy)
+    half_diff = np.sqrt(0.25 * (xx - yy) ** 2 + xy * xy)
+    return (np.sqrt(half_sum + half_diff),
+            np.sqrt(np.maximum(half_sum - half_diff, 0)),
+            0.5 * np.arctan2(2 * xy, xx - yy))
+
+
+def _world_moments(wcs, x, y, xx, yy, xy):
+    """
+    Transforms second moments (or covariances) at the 1-based pixel
+    positions (x, y) to world coordinates, (alpha*cos(delta), delta) in
+    degrees, using the local Jacobian of the WCS
+    """
+    if len(x) == 0:
+        return xx, yy, xy
+    ra, dec = wcs.all_pix2world(x, y, 1)
+    jacobian = np.empty((len(x), 2, 2))
+    for axis, (x1, y1) in enumerate(((x + 1, y), (x, y + 1))):
+        ra1, dec1 = wcs.all_pix2world(x1, y1, 1)
+        jacobian[:, 0, axis] = (((ra1 - ra + 180) % 360 - 180) *
+                                np.cos(np.radians(dec)))
+        jacobian[:, 1, axis] = dec1 - dec
+    moments = np.array([[xx, xy], [xy, yy]]).transpose(2, 0, 1)
+    world = np.einsum('nij,njk,nlk->nil', jacobian, moments, jacobian)
+    return world[:, 0, 0], world[:, 1, 1], world[:, 0, 1]
+
+
+def _windowed_centroid(image, labels, number, x, y, sigma, niter=16,
+                       tolerance=2e-4):
+    """
+    Refines the position of a source iteratively, from the first moments
+    of the pixels within 4 sigma, weighted by a circular Gaussian of this
+    sigma, as SExtractor does for XWIN_IMAGE and YWIN_IMAGE. Pixels in
+    other sources are ignored, and the original position is returned if
+    the weighted flux isn't positive.
+    """
+    ny, nx = image.shape
+    extent = int(np.ceil(4 * sigma)) + 1
+    xwin, ywin = x, y
+    for _ in range(niter):
+        ix, iy = int(round(xwin)), int(round(ywin))
+        region = (slice(max(iy - extent, 0), min(iy + extent + 1, ny)),
+                  slice(max(ix - extent, 0), min(ix + extent + 1, nx)))
+        sy, sx = np.mgrid[region]
+        sx, sy = sx - xwin, sy - ywin
+        rsq = sx * sx + sy * sy
+        stamp_labels = labels[region]
+        use = ((rsq < 16 * sigma * sigma) &
+               ((stamp_labels == 0) | (stamp_labels == number)))
+        weighted = image[region][use] * np.exp(-0.5 * rsq[use] / sigma**2)
+        total = weighted.sum()
+        if total <= 0:
+            return x, y
+        dx = 2 * np.sum(weighted * sx[use]) / total
+        dy = 2 * np.sum(weighted * sy[use]) / total
+        xwin, ywin = xwin + dx, ywin + dy
+        if dx * dx + dy * dy < tolerance * tolerance:
+            break
+    return xwin, ywin
+
+
+def detect_sources(data, mask=None, wcs=None, detect_thresh=1.5,
+                   analysis_thresh=1.5, detect_minarea=5, kernel=None,
+                   back_size=64, back_filtersize=3, kron_factor=2.5,
+                   min_radius=3.5, flux_fraction=0.5, satur_level=None,
+                   gain=0., mag_zeropoint=0., pixel_scale=None,
+                   seeing_fwhm=None):
+    """
+    Finds and measures the sources in an image, giving the same columns
+    as SExtractor (with XWIN_IMAGE and YWIN_IMAGE too). Pixels are considered part of a source if the
+    background-subtracted and convolved image exceeds analysis_thresh
+    times the background noise, and a source must have at least
+    detect_minarea pixels above detect_thresh times the noise.
+
+    Parameters
+    ----------
+    data: 2D array
+        image data
+    mask: 2D int array/None
+        DQ array (pixels with any bit set are ignored in the background,
+        and give IMAFLAGS_ISO and NIMAFLAGS_ISO)
+    wcs: WCS/None
+        WCS for the world coordinates (None => no world columns)
+    detect_thresh, analysis_thresh: float
+        detection and analysis thresholds (standard deviations)
+    detect_minarea: int
+        minimum number of pixels above the detection threshold
+    kernel: 2D array/None
+        convolution kernel for detection
+    back_size, back_filtersize: int
+        size of the background mesh (pixels), and of its median filter
+    kron_factor, min_radius: float
+        scaling of the Kron radius, and minimum radius (in units of the
+        semi-major and semi-minor axes) for FLUX_AUTO
+    flux_fraction: float
+        fraction of FLUX_AUTO within FLUX_RADIUS
+    satur_level: float/None
+        saturation level (in the same units as data)
+    gain: float
+        gain for the Poisson noise (0 => ignore it)
+    mag_zeropoint: float
+        zeropoint for MAG_AUTO
+    pixel_scale: float/None
+        pixel scale (arcsec), if there's no WCS
+    seeing_fwhm: float/None
+        stellar FWHM (arcsec) for CLASS_STAR. If None, this is taken from
+        the brightest compact sources in the image
+
+    Returns
+    -------
+    Table: the measurements (one row per source)
+    int32 array: segmentation map (the NUMBER of the source at each pixel)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    ny, nx = data.shape
+    bad = None if mask is None else mask > 0
+    background, rms = background_mesh(data, mask=bad, mesh_size=back_size,
+                                      filter_size=back_filtersize)
+    image = data - background
+    filtered = image if kernel is None else ndimage.convolve(image, kernel,
+                                                             mode='nearest')
+
+    # Find the sources and renumber them consecutively
+    above_detect = filtered > detect_thresh * rms
+    labels, nlabels = ndimage.label(filtered > min(detect_thresh, analysis_thresh)
+                                    * rms, structure=np.ones((3, 3)))
+    area = np.bincount(labels[above_detect], minlength=nlabels+1)
+    area[0] = 0
+    numbers = np.zeros((nlabels+1,), dtype=np.int32)
+    keep = area >= detect_minarea
+    nobj = keep.sum()
+    numbers[keep] = np.arange(1, nobj+1)
+    labels = numbers[labels]
+
+    # Isophotal measurements from the pixels of each object
+    pixels = np.flatnonzero(labels)
+    obj = labels.ravel()[pixels] - 1
+    y, x = np.divmod(pixels, nx)
+    values = image.ravel()[pixels]
+    weights = np.maximum(values, 0)
+    isoarea = np.bincount(obj, minlength=nobj)
+    total = np.maximum(np.bincount(obj, weights, minlength=nobj), 1e-30)
+    xc = np.bincount(obj, weights * x, minlength=nobj) / total
+    yc = np.bincount(obj, weights * y, minlength=nobj) / total
+    dx, dy = x - xc[obj], y - yc[obj]
+    x2 = np.bincount(obj, weights * dx * dx, minlength=nobj) / total
+    y2 = np.bincount(obj, weights * dy * dy, minlength=nobj) / total
+    xy = np.bincount(obj, weights * dx * dy, minlength=nobj) / total
+    # Objects that are too small or thin have their moments "blurred"
+    singular = x2 * y2 - xy * xy < 1. / 144
+    x2[singular] += 1. / 12
+    y2[singular] += 1. / 12
+
+    variance = rms.ravel()[pixels] ** 2
+    if gain > 0:
+        variance = variance + weights / gain
+    errx2 = np.bincount(obj, variance * dx * dx, minlength=nobj) / total**2
+    erry2 = np.bincount(obj, variance * dy * dy, minlength=nobj) / total**2
+    errxy = np.bincount(obj, variance * dx * dy, minlength=nobj) / total**2
+
+    a_image, b_image, theta = _ellipse(x2, y2, xy)
+    erra_image, errb_image, errtheta = _ellipse(errx2, erry2, errxy)
+
+    # Peak values, and FWHM from the area above half the peak
+    order = np.argsort(obj, kind='mergesort')
+    starts = np.searchsorted(obj[order], np.arange(nobj))
+    flux_max = (np.maximum.reduceat(values[order], starts) if nobj
+                else np.zeros((0,)))
+    nhalf = np.bincount(obj[values > 0.5 * flux_max[obj]], minlength=nobj)
+    fwhm = 2 * np.sqrt(nhalf / np.pi)
+
+    flags = np.zeros((nobj,), dtype=np.int32)
+    if satur_level is not None:
+        saturated = np.bincount(obj[data.ravel()[pixels] >= satur_level],
+                                minlength=nobj)
+        flags[saturated > 0] |= FLAG_SATURATED
+    if mask is not None:
+        dq = mask.ravel()[pixels].astype(np.int32)
+        imaflags = np.zeros((nobj,), dtype=np.int32)
+        for bit in range(16):
+            has_bit = np.bincount(obj[(dq & (1 << bit)) > 0], minlength=nobj)
+            imaflags[has_bit > 0] |= 1 << bit
+        nimaflags = np.bincount(obj[dq > 0], minlength=nobj)
+
+    # Kron photometry in an elliptical aperture around each object
+    cos, sin = np.cos(theta), np.sin(theta)
+    cxx = cos**2 / a_image**2 + sin**2 / np.maximum(b_image, 1e-3)**2
+    cyy = sin**2 / a_image**2 + cos**2 / np.maximum(b_image, 1e-3)**2
+    cxy = 2 * cos * sin * (1. / a_image**2 - 1. / np.maximum(b_image, 1e-3)**2)
+    flux_auto = np.zeros((nobj,))
+    fluxerr_auto = np.zeros((nobj,))
+    flux_radius = np.zeros((nobj,))
+    xwin, ywin = xc.copy(), yc.copy()
+
+    def aperture(i, scale):
+        """Pixels within an elliptical radius of object i, and their offsets"""
+        extent = int(np.ceil(scale * a_image[i])) + 1
+        ix, iy = int(xc[i]), int(yc[i])
+        region = (slice(max(iy - extent, 0), min(iy + extent + 1, ny)),
+                  slice(max(ix - extent, 0), min(ix + extent + 1, nx)))
+        sy, sx = np.mgrid[region]
+        sx, sy = sx - xc[i], sy - yc[i]
+        inside = (cxx[i] * sx * sx + cyy[i] * sy * sy + cxy[i] * sx * sy
+                  <= scale * scale)
+        stamp_labels = labels[region]
+        use = inside & ((stamp_labels == 0) | (stamp_labels == i + 1))
+        truncated = (inside[0].any() and region[0].start == 0 or
+                     inside[-1].any() and region[0].stop == ny or
+                     inside[:, 0].any() and region[1].start == 0 or
+                     inside[:, -1].any() and region[1].stop == nx)
+        return region, sx[use], sy[use], use, truncated, np.any(inside & ~use)
+
+    for i in range(nobj):
+        # First-moment (Kron) radius within 6 isophotal radii
+        region, sx, sy, use, _, _ = aperture(i, 6.)
+        stamp = image[region][use]
+        radius = np.sqrt(np.maximum(cxx[i] * sx * sx + cyy[i] * sy * sy +
+                                    cxy[i] * sx * sy, 0))
+        kron_radius = (np.sum(radius * stamp) / np.sum(stamp)
+                       if np.sum(stamp) > 0 else 0.)
+
+        region, sx, sy, use, truncated, crowded = aperture(
+            i, max(kron_factor * kron_radius, min_radius))
+        if truncated:
+            flags[i] |= FLAG_TRUNCATED
+        if crowded:
+            flags[i] |= FLAG_NEIGHBOURS
+        stamp = image[region][use]
+        flux_auto[i] = stamp.sum()
+        stamp_variance = np.sum(rms[region][use] ** 2)
+        if gain > 0:
+            stamp_variance += max(flux_auto[i], 0) / gain
+        fluxerr_auto[i] = np.sqrt(stamp_variance)
+
+        # Circular radius containing a fraction of the flux
+        circ = np.sqrt(sx * sx + sy * sy)
+        sort_order = np.argsort(circ)
+        enclosed = np.flatnonzero(np.cumsum(stamp[sort_order]) >=
+                                  flux_fraction * flux_auto[i])
+        flux_radius[i] = circ[sort_order][enclosed[0]] if len(enclosed) else 0.
+
+        # Windowed position, with the window matched to the half-light
+        # diameter (as SExtractor does)
+        if flux_radius[i] > 0:
+            xwin[i], ywin[i] = _windowed_centroid(
+                image, labels, i + 1, xc[i], yc[i], flux_radius[i] / 1.1774)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        good_flux = flux_auto > 0
+        mag_auto = np.where(good_flux, mag_zeropoint -
+                            2.5 * np.log10(np.where(good_flux, flux_auto, 1)), 99.)
+        magerr_auto = np.where(good_flux, 1.0857 * fluxerr_auto /
+                               np.where(good_flux, flux_auto, 1), 99.)
+
+    if wcs is not None:
+        pixel_scale = np.sqrt(abs(np.linalg.det(wcs.pixel_scale_matrix))) * 3600
+    if not pixel_scale:
+        pixel_scale = 1.0
+    ellipticity = 1 - b_image / a_image
+
+    # Compare the FWHM with the seeing (or that of the bright compact sources)
+    if seeing_fwhm:
+        stellar_fwhm = seeing_fwhm / pixel_scale
+    else:
+        compact = (flags == 0) & (ellipticity < 0.3) & (isoarea >= detect_minarea)
+        bright = compact & (flux_auto > 20 * fluxerr_auto)
+        candidates = fwhm[bright] if bright.sum() >= 3 else fwhm[compact]
+        stellar_fwhm = (np.percentile(candidates, 25) if len(candidates)
+                        else np.median(fwhm) if nobj else 1.)
+    class_star = np.exp(-0.5 * ((fwhm - stellar_fwhm) /
+                                (0.25 * max(stellar_fwhm, 1.))) ** 2)
+
+    columns = [('NUMBER', np.arange(1, nobj+1, dtype=np.int32)),
+               ('X_IMAGE', xc + 1), ('Y_IMAGE', yc + 1),
+               ('ERRX2_IMAGE', errx2), ('ERRY2_IMAGE', erry2),
+               ('ERRXY_IMAGE', errxy)]
+    if wcs is not None:
+        scale_deg = pixel_scale / 3600.
+        ra, dec = wcs.all_pix2world(xc + 1, yc + 1, 1) if nobj else ([], [])
+        err_world = _world_moments(wcs, xc + 1, yc + 1, errx2, erry2, errxy)
+        a_world, b_world, theta_world = _ellipse(
+            *_world_moments(wcs, xc + 1, yc + 1, x2, y2, xy))
+        erra_world, errb_world, errtheta_world = _ellipse(*err_world)
+        rawin, decwin = (wcs.all_pix2world(xwin + 1, ywin + 1, 1) if nobj
+                         else ([], []))
+        columns += [('X_WORLD', ra), ('Y_WORLD', dec),
+                    ('ERRX2_WORLD', err_world[0]),
+                    ('ERRY2_WORLD', err_world[1]),
+                    ('ERRXY_WORLD', err_world[2]),
+                    ('XWIN_WORLD', rawin), ('YWIN_WORLD', decwin)]
+    columns += [('XWIN_IMAGE', xwin + 1), ('YWIN_IMAGE', ywin + 1)]
+    columns += [('A_IMAGE', a_image), ('B_IMAGE', b_image),
+                ('THETA_IMAGE', np.degrees(theta)),
+                ('ERRA_IMAGE', erra_image), ('ERRB_IMAGE', errb_image),
+                ('ERRTHETA_IMAGE', np.degrees(errtheta))]
+    if wcs is not None:
+        columns += [('A_WORLD', a_world), ('B_WORLD', b_world),
+                    ('THETA_WORLD', np.degrees(theta_world)),
+                    ('ERRA_WORLD', erra_world), ('ERRB_WORLD', errb_world),
+                    ('ERRTHETA_WORLD', np.degrees(errtheta_world))]
+    columns += [('FWHM_IMAGE', fwhm)]
+    if wcs is not None:
+        columns += [('FWHM_WORLD', fwhm * scale_deg)]
+    columns += [('FLUX_RADIUS', flux_radius), ('ELLIPTICITY', ellipticity),
+                ('FLUX_AUTO', flux_auto), ('FLUXERR_AUTO', fluxerr_auto),
+                ('MAG_AUTO', mag_auto), ('MAGERR_AUTO', magerr_auto),
+                ('FLUX_MAX', flux_max), ('CLASS_STAR', class_star),
+                ('ISOAREA_IMAGE', isoarea.astype(np.int32)), ('FLAGS', flags)]
+    if mask is not None:
+        columns += [('IMAFLAGS_ISO', imaflags),
+                    ('NIMAFLAGS_ISO', nimaflags.astype(np.int32))]
+    yint = np.clip(np.round(yc).astype(int), 0, ny-1)
+    xint = np.clip(np.round(xc).astype(int), 0, nx-1)
+    columns += [('BACKGROUND', background[yint, xint])]
+
+    names = [name for name, _ in columns]
+    objcat = Table([np.asarray(array, dtype=np.int32 if name in
+                                ('NUMBER', 'ISOAREA_IMAGE', 'FLAGS', 'IMAFLAGS_ISO',
+                                 'NIMAFLAGS_ISO') else np.float64)
+                    for name, array in columns], names=names)
+    return objcat, labels.astype(np.int32)
+
+
+class SourceDetector(object):
+    """
+    Runs detect_sources() on AstroData extensions and attaches the OBJCAT
+    (and OBJMASK) to each, as SExtractorETI does, but in-process. The
+    parameters are taken from a SExtractor configuration file and the
+    same command-line parameters, so it can be used in place of
+    SExtractorETI.
+    """
+    def __init__(self, inputs=None, params=None, mask_dq_bits=None,
+                 getmask=False):
+        """
+        Parameters
+        ----------
+        inputs: list of AstroData objects
+            AD objects (or single slices) to find sources in
+        params: dict
+            SExtractor parameters: "config" is the name of the .sex file,
+            and other parameters override its values. A parameter can be a
+            list of values, one for each extension
+        mask_dq_bits: int/bool/None
+            DQ(mask) bits which, if any is set, should have the data replaced
+            by the median of the good data
+        getmask: bool
+            attach the segmentation map to the outputs as an OBJMASK?
+        """
+        self.inputs = inputs
+        self.params = params or {}
+        self._mask_dq_bits = mask_dq_bits
+        self._getmask = getmask
+
+    def run(self):
+        config = DEFAULTS.copy()
+        if 'config' in self.params:
+            config.update(read_config(self.params['config']))
+        config.update({key.upper(): value for key, value in self.params.items()
+                       if key != 'config'})
+
+        # self.inputs is a list, but its items might be single slices
+        # or sliceable AD objects, so cater for both
+        extensions = []
+        for ad in self.inputs:
+            try:
+                extensions.extend(ext for ext in ad)
+            except TypeError:
+                extensions.append(ad)
+
+        kernel = None
+        if (str(config['FILTER']).upper().startswith('Y') and
+                config['FILTER_NAME'] is not None):
+            kernel = read_kernel(config['FILTER_NAME'])
+
+        for index, ext in enumerate(extensions):
+            # Per-extension values are given as lists
+            pars = {key: value[index] if isinstance(value, list) else value
+                    for key, value in config.items()}
+            kron_factor, min_radius = [float(x) for x in
+                                       str(pars['PHOT_AUTOPARAMS']).split(',')]
+            data = ext.data
+            if self._mask_dq_bits and ext.mask is not None:
+                data = data.copy()
+                data[(ext.mask & self._mask_dq_bits)>0] = np.median(
+                    data[(ext.mask & self._mask_dq_bits)==0])
+            try:
+                wcs = WCS(ext.hdr)
+            except Exception:
+                wcs = None
+            else:
+                if not wcs.has_celestial:
+                    wcs = None
+            objcat, objmask = detect_sources(
+                data, mask=ext.mask, wcs=wcs, kernel=kernel,
+                detect_thresh=float(pars['DETECT_THRESH']),
+                analysis_thresh=float(pars['ANALYSIS_THRESH']),
+                detect_minarea=int(pars['DETECT_MINAREA']),
+                back_size=int(str(pars['BACK_SIZE']).split(',')[0]),
+                back_filtersize=int(str(pars['BACK_FILTERSIZE']).split(',')[0]),
+                kron_factor=kron_factor, min_radius=min_radius,
+                flux_fraction=float(pars['PHOT_FLUXFRAC']),
+                satur_level=float(pars['SATUR_LEVEL']),
+                gain=float(pars['GAIN']),
+                mag_zeropoint=float(pars['MAG_ZEROPOINT']),
+                pixel_scale=float(pars['PIXEL_SCALE']),
+                seeing_fwhm=(None if 'SEEING_FWHM' not in self.params
+                             else float(pars['SEEING_FWHM'])))
+            ext.OBJCAT = objcat
+            if self._getmask:
+                ext.OBJMASK = objmask
+        return self.inputs
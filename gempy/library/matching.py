@@ -1,5 +1,6 @@
 import numpy as np
 import math
+import itertools
 from astropy.modeling.fitting import (_validate_model,
                                       _fitter_to_model_params,
                                       _model_to_fit_params, Fitter,
@@ -7,7 +8,8 @@ from astropy.modeling.fitting import (_validate_model,
 from astropy.modeling import models, FittableModel, Parameter
 from astropy.wcs import WCS
 
-from scipy import optimize, spatial
+from scipy import ndimage, optimize, spatial
+from scipy.fftpack import next_fast_len
 from datetime import datetime
 
 from gempy.gemini import gemini_tools as gt
@@ -148,10 +150,11 @@ def _landstat(landscape, updated_model, x, y):
         statistic representing quality of fit to be minimized
     """
     xt, yt = updated_model(x, y)
-    sum = np.sum(landscape[iy,ix] for ix,iy in zip((xt-0.5).astype(int),
-                                                   (yt-0.5).astype(int))
-                  if ix>=0 and iy>=0 and ix<landscape.shape[1]
-                                     and iy<landscape.shape[0])
+    ix = (xt-0.5).astype(int)
+    iy = (yt-0.5).astype(int)
+    on_land = ((ix >= 0) & (iy >= 0) & (ix < landscape.shape[1]) &
+               (iy < landscape.shape[0]))
+    sum = landscape[iy[on_land], ix[on_land]].sum()
     #print updated_model.x_offset.value, updated_model.y_offset.value, sum
     return -sum  # to minimize
 
@@ -182,10 +185,11 @@ def _stat(tree, updated_model, x, y, sigma, maxsig):
     f = 0.5/(sigma*sigma)
     maxsep = maxsig*sigma
     xt, yt = updated_model(x, y)
-    start = datetime.now()
-    dist, idx = tree.query(list(zip(xt, yt)), k=5, distance_upper_bound=maxsep)
-    sum = np.sum(np.exp(-f*d*d) for dd in dist for d in dd)
-    #print (datetime.now()-start).total_seconds(), updated_model.parameters, sum
+    dist, idx = tree.query(np.column_stack((xt, yt)), k=5,
+                           distance_upper_bound=maxsep)
+    # Missing neighbours are at infinite distance, so contribute nothing
+    sum = np.exp(-f*dist*dist).sum()
+    #print updated_model.parameters, sum
     return -sum  # to minimize
 
 class KDTreeFitter(Fitter):
@@ -262,12 +266,18 @@ class BruteLandscapeFitter(Fitter):
         try:
             iter(coords[0])
         except TypeError:
-            coords = (coords,)
+            coords = [[pos] for pos in coords]
 
         landscape = np.zeros(landshape)
         hw = int(maxsig * sigma)
+        npoints = len(coords[0])
+        # Placing a mountain costs about as much as 10000 pixel operations
+        # of the convolution, so use that for large catalogs
+        if npoints * 10000 > (landscape.size * (2*hw+1) * landscape.ndim):
+            return self._convolved_landscape(coords, sigma, hw, landshape)
+
         grid = np.meshgrid(*[np.arange(0, hw*2+1)]*landscape.ndim)
-        rsq = np.sum((ax - hw)**2 for ax in grid)
+        rsq = sum((ax - hw)**2 for ax in grid)
         mountain = np.exp(-0.5 * rsq / (sigma * sigma))
 
         # Place a mountain onto the landscape for each coord in coords
@@ -292,6 +302,29 @@ class BruteLandscapeFitter(Fitter):
                 landscape[tuple(lslice)] += mountain[tuple(mslice)]
         return landscape
 
+    @staticmethod
+    def _convolved_landscape(coords, sigma, hw, landshape):
+        """
+        Makes the same landscape as mklandscape() by counting the sources
+        in each pixel and convolving this with the (separable) mountain.
+        The array is padded so that sources off the edge still contribute.
+        """
+        centres = [(np.asarray(pos, dtype=float)-0.5).astype(int) + hw
+                   for pos in coords[::-1]]
+        padded_shape = tuple(length + 2*hw for length in landshape)
+        on_land = np.logical_and.reduce([(centre >= 0) & (centre < length)
+                                         for centre, length in
+                                         zip(centres, padded_shape)])
+        index = np.ravel_multi_index([centre[on_land] for centre in centres],
+                                     padded_shape)
+        landscape = np.bincount(index, minlength=int(np.multiply.reduce(
+            padded_shape))).reshape(padded_shape).astype(float)
+        profile = np.exp(-0.5 * np.arange(-hw, hw+1)**2 / (sigma * sigma))
+        for axis in range(len(landshape)):
+            landscape = ndimage.correlate1d(landscape, profile, axis=axis,
+                                            mode='constant')
+        return landscape[tuple(slice(hw, hw+length) for length in landshape)]
+
     def __call__(self, model, in_coords, ref_coords, sigma=5.0, maxsig=4.0,
                  **kwargs):
         model_copy = _validate_model(model, ['bounds'])
@@ -326,7 +359,7 @@ class BruteLandscapeFitter(Fitter):
         return model_copy
 
 def fit_brute_then_simplex(model, xin, xout, sigma=5.0, tolerance=0.001,
-                           release=False, verbose=True):
+                           release=False, verbose=True, brute=True):
     """
     Finds the best-fitting mapping to convert from xin to xout, using a
     two-step approach by first doing a brute-force scan of parameter space,
@@ -349,6 +382,9 @@ def fit_brute_then_simplex(model, xin, xout, sigma=5.0, tolerance=0.001,
         undo the parameter bounds for the simplex fit?
     verbose: boolean
         output model and time info?
+    brute: boolean
+        do the brute-force scan? (if False, the model must already be
+        close to the answer, e.g., from find_offsets())
 
     Returns
     -------
@@ -366,11 +402,14 @@ def fit_brute_then_simplex(model, xin, xout, sigma=5.0, tolerance=0.001,
             getattr(model, p).fixed = False
 
     # Brute-force grid search using an image landscape
-    fit_it = BruteLandscapeFitter()
-    m = fit_it(model, xin, xout, sigma=sigma)
-    if verbose:
-        log.stdinfo(_show_model(m, "Coarse model in {:.2f} seconds".
-                                format((datetime.now() - start).total_seconds())))
+    if brute:
+        fit_it = BruteLandscapeFitter()
+        m = fit_it(model, xin, xout, sigma=sigma)
+        if verbose:
+            log.stdinfo(_show_model(m, "Coarse model in {:.2f} seconds".
+                                    format((datetime.now() - start).total_seconds())))
+    else:
+        m = model.copy()
 
     # Re-fix parameters in the intermediate model, if they were fixed
     # in the original model
@@ -413,11 +452,161 @@ def _show_model(model, intro=""):
     return model_str
 
 
+def find_offsets(xin, yin, xref, yref, range=(-300, 300), sigma=5.0):
+    """
+    Find the offsets that best align two catalogs, by cross-correlating a
+    landscape of "mountains" at the reference positions with the input
+    positions, using FFTs. Every shift in the search range is evaluated in
+    one pass, so this is fast even for large ranges, but the answer is
+    only accurate to about a pixel.
+
+    Parameters
+    ----------
+    xin, yin: float arrays
+        input coordinates
+    xref, yref: float arrays
+        reference coordinates
+    range: 2-tuple or 2x2-tuple
+        search limits (same for x and y), or search limits for x and y
+    sigma: float
+        standard deviation of Gaussian (in pixels) used to represent each source
+
+    Returns
+    -------
+    dx, dy: float
+        offsets to add to the input coordinates to match the reference
+    """
+    limits = np.array(range, dtype=float)
+    if limits.ndim == 1:
+        limits = np.array([limits, limits])
+    return _cross_correlate((xin, yin), (xref, yref), limits, sigma)[:2]
+
+
+def _cross_correlate(in_coords, ref_coords, limits, sigma):
+    """
+    Does the work for find_offsets(), returning the offsets and the value
+    of the cross-correlation peak (the sum of the landscape values at the
+    shifted input positions, as _landstat() would compute). The catalogs
+    are binned to pixels of about sigma/2 for speed, and the peak is
+    interpolated within these.
+
+    Parameters
+    ----------
+    in_coords, ref_coords: 2xN float arrays
+        input and reference coordinates
+    limits: 2x2 array
+        search limits for x and y
+    sigma: float
+        standard deviation of the mountains, in pixels
+
+    Returns
+    -------
+    dx, dy, peak: floats
+    """
+    binning = max(int(0.5 * sigma), 1)
+    # Mountains extend to 4 sigma, so pad the arrays to keep them
+    pad = int(np.ceil(4 * sigma / binning))
+    in_coords = [np.asarray(coord, dtype=float) for coord in in_coords[::-1]]
+    ref_coords = [np.asarray(coord, dtype=float) for coord in ref_coords[::-1]]
+    origins = [min(np.min(c1), np.min(c2)) for c1, c2 in zip(in_coords, ref_coords)]
+    in_bins = [((coord - origin) / binning).astype(int) + pad
+               for coord, origin in zip(in_coords, origins)]
+    ref_bins = [((coord - origin) / binning).astype(int) + pad
+                for coord, origin in zip(ref_coords, origins)]
+    shape = tuple(max(np.max(b1), np.max(b2)) + pad + 1
+                  for b1, b2 in zip(in_bins, ref_bins))
+
+    # Search limits in binned pixels, in python order
+    bin_limits = [(int(np.floor(lim[0] / binning)), int(np.ceil(lim[1] / binning)))
+                  for lim in limits[::-1]]
+    # The arrays must be padded by the largest shift to avoid wrapping
+    fft_shape = [next_fast_len(length + max(abs(lim[0]), abs(lim[1])) + 1)
+                 for length, lim in zip(shape, bin_limits)]
+
+    points = np.zeros(shape)
+    np.add.at(points, tuple(in_bins), 1)
+    landscape = np.zeros(shape)
+    np.add.at(landscape, tuple(ref_bins), 1)
+    landscape = ndimage.gaussian_filter(landscape, sigma / binning,
+                                        mode='constant', truncate=4.0)
+    # corr[s] = sum(landscape[q+s] * points[q])
+    corr = np.fft.irfftn(np.fft.rfftn(landscape, fft_shape) *
+                         np.conj(np.fft.rfftn(points, fft_shape)), fft_shape)
+    window = corr[np.ix_(*[np.arange(lim[0], lim[1]+1) % length
+                           for lim, length in zip(bin_limits, fft_shape)])]
+    peak = np.unravel_index(np.argmax(window), window.shape)
+
+    # Parabolic interpolation of the peak along each axis
+    offsets = []
+    for axis, lim in enumerate(bin_limits):
+        pos = peak[axis]
+        offset = lim[0] + pos
+        if 0 < pos < window.shape[axis] - 1:
+            index = list(peak)
+            values = []
+            for i in (pos-1, pos, pos+1):
+                index[axis] = i
+                values.append(window[tuple(index)])
+            curvature = values[0] - 2 * values[1] + values[2]
+            if curvature < 0:
+                offset += 0.5 * (values[0] - values[2]) / curvature
+        offsets.append(offset * binning)
+    dy, dx = offsets
+    return dx, dy, window[peak]
+
+
+def _fft_coarse_model(model, trans_model, rot_model, mag_model, xin, yin,
+                      xref, yref, sigma):
+    """
+    Sets the parameters of the model made by align_catalogs() to the best
+    coarse alignment, found by cross-correlating the catalogs (with
+    find_offsets) for each of a grid of rotations and magnifications.
+    The grids have steps of sigma, since the rotation and magnification
+    parameters are scaled so a change of 1 moves sources at the edge of
+    the field by about a pixel.
+    """
+    log = logutils.get_logger(__name__)
+    params = [getattr(m, m.param_names[0]) for m in (rot_model, mag_model)
+              if m is not None]
+    grids = []
+    for param in params:
+        if param.fixed or None in param.bounds:
+            grids.append([param.value])
+        else:
+            nsteps = int(np.diff(param.bounds)[0] / sigma) + 1
+            grids.append(np.linspace(*param.bounds, num=nsteps + 1))
+    limits = np.array([trans_model.x_offset.bounds, trans_model.y_offset.bounds])
+
+    best = None
+    for values in itertools.product(*grids):
+        for param, value in zip(params, values):
+            param.value = value
+        # The translation is applied before any rotation and magnification,
+        # so shifts in the reference frame are mapped back through the
+        # linear part of the transformation
+        trans_model.x_offset.value = trans_model.y_offset.value = 0
+        xt, yt = model(xin, yin)
+        origin = np.array(model(0., 0.)).ravel()
+        matrix = np.array([np.array(model(1., 0.)).ravel() - origin,
+                           np.array(model(0., 1.)).ravel() - origin]).T
+        dx, dy, peak = _cross_correlate((xt, yt), (xref, yref), limits, sigma)
+        if best is None or peak > best[0]:
+            best = (peak, np.linalg.solve(matrix, [dx, dy]), values)
+
+    _, (xoff, yoff), values = best
+    for param, value in zip(params, values):
+        param.value = value
+    trans_model.x_offset.value = xoff
+    trans_model.y_offset.value = yoff
+    log.debug(_show_model(model, "Cross-correlation model"))
+    return model
+
+
 def align_catalogs(xin, yin, xref, yref, model_guess=None,
                    translation=None, translation_range=None,
                    rotation=None, rotation_range=None,
                    magnification=None, magnification_range=None,
-                   tolerance=0.1, center_of_field=None):
+                   tolerance=0.1, center_of_field=None, coarse='brute'):
     """
     Generic interface for a 2D catalog match. Either an initial model guess
     is provided, or a model will be created using a combination of
@@ -456,6 +645,11 @@ def align_catalogs(xin, yin, xref, yref, model_guess=None,
     center_of_field: 2-tuple
         rotation and magnification have no effect at this location
          (if None, uses middle of xin,yin ranges)
+    coarse: str ('brute' | 'fft')
+        method for the initial alignment: a brute-force scan of parameter
+        space, or cross-correlation of the catalogs with FFTs (faster for
+        large translation ranges; only used if both offsets are free and
+        no model_guess is given)
 
     Returns
     -------
@@ -489,6 +683,9 @@ def align_catalogs(xin, yin, xref, yref, model_guess=None,
             return None, None
 
     log = logutils.get_logger(__name__)
+    if coarse not in ('brute', 'fft'):
+        raise ValueError("coarse must be 'brute' or 'fft'")
+    use_fft = False
     if model_guess is None:
         # Some useful numbers for later
         x1, x2 = np.min(xin), np.max(xin)
@@ -536,6 +733,10 @@ def align_catalogs(xin, yin, xref, yref, model_guess=None,
                 rot_model.angle.bounds = tuple(x*rot_scaling for x in rrange)
 
         # Set up magnification part of the model
+        # (a range without an initial guess is about no magnification)
+        if (magnification is None and magnification_range is not None
+                and np.size(magnification_range) == 1):
+            magnification = 1.0
         mvalue, mrange = _get_value_and_range(magnification, magnification_range)
         if mvalue is None:
             mag_model = None
@@ -573,6 +774,13 @@ def align_catalogs(xin, yin, xref, yref, model_guess=None,
             if mag_model is not None:
                 init_model |= mag_model
             init_model |= restore
+
+        use_fft = (coarse == 'fft' and trans_model is not None and
+                   xrange is not None and yrange is not None)
+        if use_fft:
+            init_model = _fft_coarse_model(init_model, trans_model, rot_model,
+                                           mag_model, xin, yin, xref, yref,
+                                           sigma=10.0)
     elif model_guess.fittable:
         init_model = model_guess
     else:
@@ -580,7 +788,8 @@ def align_catalogs(xin, yin, xref, yref, model_guess=None,
         return models.Identity(2)
 
     final_model = fit_brute_then_simplex(init_model, (xin, yin), (xref, yref),
-                               sigma=10.0, tolerance=tolerance)
+                               sigma=10.0, tolerance=tolerance,
+                               brute=not use_fft)
     return final_model
 
 def match_sources(incoords, refcoords, radius=2.0, priority=[]):
@@ -626,7 +835,7 @@ def match_catalogs(xin, yin, xref, yref, use_in=None, use_ref=None,
                    translation_range=None, rotation=None,
                    rotation_range=None, magnification=None,
                    magnification_range=None, tolerance=0.1,
-                   center_of_field=None, match_radius=1.0):
+                   center_of_field=None, match_radius=1.0, coarse='brute'):
     """
     Aligns catalogs with align_catalogs(), and then matches sources with
     match_sources()
@@ -662,6 +871,10 @@ def match_catalogs(xin, yin, xref, yref, use_in=None, use_ref=None,
     center_of_field: 2-tuple
         rotation and magnification have no effect at this location
          (if None, uses middle of xin,yin ranges)
+    match_radius: float
+        maximum separation for a match
+    coarse: str ('brute' | 'fft')
+        method for the initial alignment (see align_catalogs)
 
     Returns
     -------
@@ -680,7 +893,7 @@ def match_catalogs(xin, yin, xref, yref, use_in=None, use_ref=None,
                            translation_range=translation_range, rotation=rotation,
                            rotation_range=rotation_range, magnification=magnification,
                            magnification_range=magnification_range, tolerance=tolerance,
-                           center_of_field=center_of_field)
+                           center_of_field=center_of_field, coarse=coarse)
     matched = match_sources(model(xin, yin), (xref, yref), radius=match_radius,
                                priority=use_in)
     return matched, model
@@ -688,7 +901,8 @@ def match_catalogs(xin, yin, xref, yref, use_in=None, use_ref=None,
 def align_images_from_wcs(adinput, adref, first_pass=10, cull_sources=False,
                           initial_shift = (0,0), min_sources=1, rotate=False,
                           scale=False, full_wcs=False, refine=False,
-                          tolerance=0.1, return_matches=False):
+                          tolerance=0.1, return_matches=False, sources=None,
+                          ref_sources=None):
     """
     This function takes two images (an input image, and a reference image) and
     works out the modifications needed to the WCS of the input images so that
@@ -728,6 +942,12 @@ def align_images_from_wcs(adinput, adref, first_pass=10, cull_sources=False,
         matching requirement (in pixels)
     return_matches: bool
         return a list of matched objects?
+    sources: 2-tuple/None
+        sources in adinput, as returned by get_sources() (None => compute)
+    ref_sources: 2-tuple/None
+        sources in adref, as returned by get_sources() (None => compute).
+        When aligning many images to the same reference, computing this
+        once saves repeating the work for every image
 
     Returns
     -------
@@ -743,30 +963,96 @@ def align_images_from_wcs(adinput, adref, first_pass=10, cull_sources=False,
         log.warning('Both input images must have object catalogs')
         return None
 
+    if sources is None:
+        sources = get_sources(adinput, cull_sources)
+    if ref_sources is None:
+        ref_sources = get_sources(adref, cull_sources)
+    return align_sources_from_wcs(sources, WCS(adinput[0].hdr), ref_sources,
+                                  WCS(adref[0].hdr), adinput[0].data.shape,
+                                  first_pass=first_pass,
+                                  cull_sources=cull_sources,
+                                  initial_shift=initial_shift,
+                                  min_sources=min_sources, rotate=rotate,
+                                  scale=scale, full_wcs=full_wcs, refine=refine,
+                                  tolerance=tolerance,
+                                  return_matches=return_matches)
+
+
+def get_sources(ad, cull_sources=False):
+    """
+    Returns the positions of the OBJCAT sources in a single-extension
+    AstroData object, in the form needed by align_images_from_wcs()
+
+    Parameters
+    ----------
+    ad: AstroData
+        image with an OBJCAT
+    cull_sources: bool
+        also find the "good" (i.e., stellar) objects?
+
+    Returns
+    -------
+    2-tuple: (x, y) of all the sources, and (x, y) of the good sources
+             (None if cull_sources is False)
+    """
+    all_sources = (ad[0].OBJCAT['X_IMAGE'], ad[0].OBJCAT['Y_IMAGE'])
     if cull_sources:
-        good_src1 = gt.clip_sources(adinput)[0]
-        good_src2 = gt.clip_sources(adref)[0]
-        if len(good_src1) < min_sources or len(good_src2) < min_sources:
+        good_src = gt.clip_sources(ad)[0]
+        return all_sources, (good_src["x"], good_src["y"])
+    return all_sources, None
+
+
+def align_sources_from_wcs(sources, wcs, ref_sources, ref_wcs, shape,
+                           first_pass=10, cull_sources=False,
+                           initial_shift=(0,0), min_sources=1, rotate=False,
+                           scale=False, full_wcs=False, refine=False,
+                           tolerance=0.1, return_matches=False):
+    """
+    Does the work of align_images_from_wcs() from the sources and WCSs of
+    the two images, rather than the AstroData objects themselves, so that
+    it can be run in another process.
+
+    Parameters
+    ----------
+    sources: 2-tuple
+        sources in the input image, as returned by get_sources()
+    wcs: WCS
+        WCS of the input image
+    ref_sources: 2-tuple
+        sources in the reference image, as returned by get_sources()
+    ref_wcs: WCS
+        WCS of the reference image
+    shape: tuple
+        shape of the input image
+    other parameters:
+        see align_images_from_wcs()
+
+    Returns
+    -------
+    see align_images_from_wcs()
+    """
+    log = logutils.get_logger(__name__)
+    (x1, y1), good_src1 = sources
+    (x2, y2), good_src2 = ref_sources
+    if cull_sources:
+        if (good_src1 is None or good_src2 is None or
+                len(good_src1[0]) < min_sources or
+                len(good_src2[0]) < min_sources):
             log.warning("Too few sources in culled list, using full set "
                         "of sources")
-            x1, y1 = adinput[0].OBJCAT['X_IMAGE'], adinput[0].OBJCAT['Y_IMAGE']
-            x2, y2 = adref[0].OBJCAT['X_IMAGE'], adref[0].OBJCAT['Y_IMAGE']
         else:
-            x1, y1 = good_src1["x"], good_src1["y"]
-            x2, y2 = good_src2["x"], good_src2["y"]
-    else:
-        x1, y1 = adinput[0].OBJCAT['X_IMAGE'], adinput[0].OBJCAT['Y_IMAGE']
-        x2, y2 = adref[0].OBJCAT['X_IMAGE'], adref[0].OBJCAT['Y_IMAGE']
+            x1, y1 = good_src1
+            x2, y2 = good_src2
 
     # convert reference positions to sky coordinates
-    ra2, dec2 = WCS(adref[0].hdr).all_pix2world(x2, y2, 1)
+    ra2, dec2 = ref_wcs.all_pix2world(x2, y2, 1)
 
     func = match_catalogs if return_matches else align_catalogs
 
     if full_wcs:
         # Set up the (inverse) Pix2Sky transform with appropriate scalings
-        pixel_range = max(adinput[0].data.shape)
-        transform = Pix2Sky(WCS(adinput[0].hdr), factor=pixel_range,
+        pixel_range = max(shape)
+        transform = Pix2Sky(wcs, factor=pixel_range,
                             factor_scale=pixel_range, angle=0.0,
                             angle_scale=pixel_range/57.3, direction=-1)
         x_offset, y_offset = initial_shift
@@ -796,7 +1082,7 @@ def align_images_from_wcs(adinput, adref, first_pass=10, cull_sources=False,
             func_ret = func(ra2, dec2, x1, y1, model_guess=transform,
                             tolerance=tolerance)
     else:
-        x2a, y2a = WCS(adinput[0].hdr).all_world2pix(ra2, dec2, 1)
+        x2a, y2a = wcs.all_world2pix(ra2, dec2, 1)
         func_ret = func(x2a, y2a, x1, y1, model_guess=None,
                         translation=initial_shift,
                         translation_range=first_pass,
@@ -813,3 +1099,51 @@ def align_images_from_wcs(adinput, adref, first_pass=10, cull_sources=False,
         return obj_list, transform
     else:
         return func_ret
+
+
+def solve_global_offsets(coords, radius=1.0, min_matches=1):
+    """
+    Finds the translations that best align a set of catalogs with each
+    other, by a least-squares solution for the mean separations of the
+    sources matched between every pair of catalogs (not just between each
+    catalog and the first one). The first catalog is kept fixed, and
+    catalogs with no matches to any other are not moved.
+
+    Parameters
+    ----------
+    coords: list of 2xN arrays
+        coordinates of the sources in each catalog, on a common frame
+    radius: float
+        maximum separation for a match
+    min_matches: int
+        minimum number of matches for a pair of catalogs to be used
+
+    Returns
+    -------
+    array of shape (len(coords), 2):
+        (dx, dy) to add to the coordinates of each catalog
+    """
+    points = [np.array(c, dtype=float).reshape(2, -1).T for c in coords]
+    trees = [spatial.cKDTree(p) if len(p) else None for p in points]
+    rows, deltas, weights = [], [], []
+    for i, j in itertools.combinations(range(len(points)), 2):
+        if trees[i] is None or trees[j] is None:
+            continue
+        # Only use sources that are each other's nearest neighbours
+        idx = trees[j].query(points[i], distance_upper_bound=radius)[1]
+        back = trees[i].query(points[j], distance_upper_bound=radius)[1]
+        good = np.flatnonzero(idx < len(points[j]))
+        good = good[back[idx[good]] == good]
+        if len(good) >= max(min_matches, 1):
+            row = np.zeros((len(points),))
+            row[i], row[j] = 1, -1
+            rows.append(row)
+            deltas.append(np.mean(points[j][idx[good]] - points[i][good], axis=0))
+            weights.append(np.sqrt(len(good)))
+
+    offsets = np.zeros((len(points), 2))
+    if rows:
+        weights = np.array(weights)[:, np.newaxis]
+        offsets[1:] = np.linalg.lstsq(np.array(rows)[:, 1:] * weights,
+                                      np.array(deltas) * weights, rcond=-1)[0]
+    return offsets
@@ -9,6 +9,10 @@
 #
 # The methods of this class are static so they can be called on any dataset
 # to reduce its dimensionality by one.
+#
+# The NDStreamStacker class provides some of the same combiners and rejectors
+# without ever holding more than one input in memory, at the cost of reading
+# the inputs several times.
 
 from __future__ import print_function
 
@@ -36,6 +40,24 @@ DQhierarchy = (DQ.no_data, DQ.unilluminated, DQ.bad_pixel, DQ.overlap,
 ZERO = DQ.datatype(0)
 ONE = DQ.datatype(DQ.bad_pixel)
 
+def _dq_levels():
+    """
+    Returns a lookup table of the position in the DQhierarchy of every
+    possible mask value, i.e., the smallest k such that all the bits set
+    are in the k+1 least bad entries. Pixels with no bits set are at level
+    0, like non-linear or saturated pixels. Values with bits outside the
+    hierarchy are given level 255.
+    """
+    values = np.arange(65536, dtype=DQ.datatype)
+    levels = np.full(values.shape, 255, dtype=np.uint8)
+    consider_all = ZERO
+    for level, consider_bits in enumerate(reversed(DQhierarchy)):
+        consider_all |= consider_bits
+        levels[(values & consider_all == values) & (levels == 255)] = level
+    return levels
+
+DQ_LEVELS = _dq_levels()
+
 import inspect
 
 def take_along_axis(arr, ind, axis):
@@ -150,8 +172,13 @@ def rejector(fn):
 class NDStacker(object):
     # Base class from which all stacking functions should subclass.
     # Put helper functions here so they can be inherited.
-    def __init__(self, combine='mean', reject='none', log=None, **kwargs):
+    def __init__(self, combine='mean', reject='none', log=None, num_threads=0,
+                 **kwargs):
+        # num_threads is passed to the rejectors that run in parallel (0
+        # means one thread per CPU); callers that run several stackers at
+        # once should set it to 1 to avoid oversubscribing the CPUs
         self._log = log
+        kwargs['num_threads'] = num_threads
         try:
             combiner = getattr(self, combine)
             assert getattr(combiner, 'is_combiner')
@@ -190,14 +217,13 @@ class NDStacker(object):
         select which pixels should be combined, and what the output mask pixel
         should be.
 
-        It works through the DQhierarchy, allowing pixels with increasing
-        levels of badness. After each iteration, output pixels which have at
-        least one input pixel have their input mask pixels reset to either 0
-        (use to calculate output) or 32768 (don't use). This is a slightly
-        hacky way to do things but we can use the 32768 bit to indicate that
-        we don't need to process this particular pixel any more, even if we
-        have to continue to iterate in order to get inputs for other output
-        pixels.
+        For each output pixel, the input pixels at the least bad level of
+        the DQhierarchy are used, and the output mask is the bitwise-OR of
+        their mask values. The input mask pixels are reset to either 0 (use
+        to calculate output) or 32768 (don't use). The work is done by a
+        Cython routine, which looks up the level of each input pixel in the
+        DQ_LEVELS table, so no temporary arrays the size of the input are
+        created. The input mask may be modified in place.
 
         Parameters
         ----------
@@ -222,6 +248,28 @@ class NDStacker(object):
             mask ^= out_mask  # Set mask=0 if all pixels have mask=1
             return mask, out_mask
 
+        # The Cython routine works on a 1D view, with all the pixels from
+        # the first image, then all the pixels from the second image, ...
+        shape = mask.shape
+        data_size = int(np.prod(shape[1:]))
+        mask, out_mask = cyclip.process_mask(
+            np.ascontiguousarray(mask, dtype=DQ.datatype).ravel(), DQ_LEVELS,
+            num_img=shape[0], data_size=data_size)
+        return mask.reshape(shape), out_mask.reshape(shape[1:])
+
+    @staticmethod
+    def _process_mask_numpy(mask):
+        # SUPERSEDED BY CYTHON ROUTINE
+        """Pure-numpy version of _process_mask(), kept for reference."""
+        if mask is None:
+            return None, None
+
+        # It it's a boolean mask we don't need to do much
+        if mask.dtype == bool:
+            out_mask = np.bitwise_and.reduce(mask, axis=0)
+            mask ^= out_mask  # Set mask=0 if all pixels have mask=1
+            return mask, out_mask
+
         consider_all = ZERO
         out_mask = np.full(mask.shape[1:], 0, dtype=DQ.datatype)
         for consider_bits in reversed(DQhierarchy):
@@ -341,16 +389,7 @@ class NDStacker(object):
             out_mask = None
         else:
             mask, out_mask = NDStacker._process_mask(mask)
-            arg = np.argsort(np.where(mask>0, np.inf, data), axis=0)
-            num_img = NDStacker._num_good(mask>0)
-            med_index = num_img // 2
-            med_indices = np.array([np.where(num_img % 2, med_index, med_index-1),
-                                    np.where(num_img % 2, med_index, med_index)])
-            indices = take_along_axis(arg, med_indices, axis=0)
-            out_data = take_along_axis(data, indices, axis=0).mean(axis=0).astype(data.dtype)
-            #out_mask = np.bitwise_or(*take_along_axis(mask, indices, axis=0))
-            out_var = (None if variance is None else
-                       take_along_axis(variance, indices, axis=0).mean(axis=0).astype(data.dtype))
+            out_data, out_var = NDStacker._cymedian(data, mask, variance, low=False)
         if variance is None:  # IRAF gemcombine calculation
             out_var = NDStacker.calculate_variance(data, mask, out_data)
         return out_data, out_mask, out_var
@@ -364,21 +403,36 @@ class NDStacker(object):
             med_index = (num_img - 1) // 2
             index = np.argpartition(data, med_index, axis=0)[med_index]
             out_mask = None
+            out_data = take_along_axis(data, index, axis=0)
+            out_var = (None if variance is None else
+                       take_along_axis(variance, index, axis=0))
         else:
             mask, out_mask = NDStacker._process_mask(mask)
-            # Because I'm sorting, I'll put large dummy values in a numpy array
-            # np.choose() can't handle more than 32 input images
-            # Partitioning the bottom half is slower than a full sort
-            arg = np.argsort(np.where(mask>0, np.inf, data), axis=0)
-            med_index = (NDStacker._num_good(mask>0) - 1) // 2
-            index = take_along_axis(arg, med_index, axis=0)
-        out_data = take_along_axis(data, index, axis=0)
+            out_data, out_var = NDStacker._cymedian(data, mask, variance, low=True)
         if variance is None:  # IRAF gemcombine calculation
             out_var = NDStacker.calculate_variance(data, mask, out_data)
-        else:
-            out_var = take_along_axis(variance, index, axis=0)
         return out_data, out_mask, out_var
 
+    @staticmethod
+    def _cymedian(data, mask, variance=None, low=False):
+        # Prepares data for Cython median routine, which uses only the
+        # pixels where mask==0
+        if variance is None:
+            variance = np.empty((1,), dtype=np.float32)
+            has_var = False
+        else:
+            has_var = True
+        shape = data.shape
+        num_img = shape[0]
+        data_size = int(np.prod(shape[1:]))
+        out_data, out_var = cyclip.masked_median(
+            np.ascontiguousarray(data, dtype=np.float32).ravel(),
+            np.ascontiguousarray(mask, dtype=DQ.datatype).ravel(),
+            np.ascontiguousarray(variance, dtype=np.float32).ravel(),
+            has_var=has_var, num_img=num_img, data_size=data_size, low=int(low))
+        return (out_data.reshape(shape[1:]),
+                None if out_var is None else out_var.reshape(shape[1:]))
+
     #------------------------ REJECTOR METHODS ----------------------------
     # These methods must all return data, mask, and variance arrays of the
     # same size as the input, but with pixels reflagged if necessary to
@@ -404,53 +458,40 @@ class NDStacker(object):
             raise ValueError("Only {} images but nlow={} and nhigh={}"
                              .format(num_img, nlow, nhigh))
         if mask is None:
-            nlo = int(nlow+0.001)
-            nhi = data.shape[0] - int(nhigh+0.001)
-            # Sorts variance with data
-            arg = np.argsort(data, axis=0)
-            data = take_along_axis(data, arg, axis=0)
-            variance = take_along_axis(variance, arg, axis=0)
-            mask = np.zeros_like(data, dtype=bool)
-            mask[:nlo] = True
-            mask[nhi:] = True
-        else:
-            # Because I'm sorting, I'll put large dummy values in a numpy array
-            # Have to keep all values if all values are masked!
-            # Sorts variance and mask with data
-            arg = np.argsort(np.where(mask & BAD, np.inf, data), axis=0)
-            data = take_along_axis(data, arg, axis=0)
-            variance = take_along_axis(variance, arg, axis=0)
-            mask = take_along_axis(mask, arg, axis=0)
-            # IRAF imcombine maths
-            num_good = NDStacker._num_good(mask & BAD > 0)
-            nlo = (num_good * float(nlow) / num_img + 0.001).astype(int)
-            nhi = num_good - (num_good * float(nhigh) / num_img + 0.001).astype(int) - 1
-            for i in range(num_img):
-                mask[i][i<nlo] |= ONE
-                mask[i][np.logical_and(i>nhi, i<num_good)] |= ONE
-        return data, mask, variance
+            mask = np.zeros_like(data, dtype=DQ.datatype)
+        # The Cython routine flags pixels without reordering them, using
+        # quickselect rather than a full sort
+        shape = data.shape
+        data_size = int(np.prod(shape[1:]))
+        mask = cyclip.minmax(np.ascontiguousarray(data, dtype=np.float32).ravel(),
+                             np.ascontiguousarray(mask, dtype=DQ.datatype).ravel(),
+                             num_img=num_img, data_size=data_size,
+                             nlow=nlow, nhigh=nhigh, bad=BAD)
+        return data, mask.reshape(shape), variance
 
     @staticmethod
     @rejector
     def sigclip(data, mask=None, variance=None, mclip=True, lsigma=3.0,
-                hsigma=3.0, max_iters=None):
+                hsigma=3.0, max_iters=None, num_threads=0):
         # Sigma-clipping based on scatter of data
         return NDStacker._cyclip(data, mask=mask, variance=variance,
                                   mclip=mclip, lsigma=lsigma, hsigma=hsigma,
-                                  max_iters=max_iters, sigclip=True)
+                                  max_iters=max_iters, sigclip=True,
+                                  num_threads=num_threads)
 
     @staticmethod
     @rejector
     def varclip(data, mask=None, variance=None, mclip=True, lsigma=3.0,
-                hsigma=3.0, max_iters=None):
+                hsigma=3.0, max_iters=None, num_threads=0):
         # Sigma-type-clipping where VAR array is used to determine deviancy
         return NDStacker._cyclip(data, mask=mask, variance=variance,
                                   mclip=mclip, lsigma=lsigma, hsigma=hsigma,
-                                  max_iters=max_iters, sigclip=False)
+                                  max_iters=max_iters, sigclip=False,
+                                  num_threads=num_threads)
 
     @staticmethod
     def _cyclip(data, mask=None, variance=None, mclip=True, lsigma=3.0,
-                 hsigma=3.0, max_iters=None, sigclip=False):
+                 hsigma=3.0, max_iters=None, sigclip=False, num_threads=0):
         # Prepares data for Cython iterative-clippingroutine
         if mask is None:
             mask = np.zeros_like(data, dtype=DQ.datatype)
@@ -470,7 +511,8 @@ class NDStacker(object):
         data, mask, variance = cyclip.iterclip(data.ravel(), mask.ravel(), variance.ravel(),
                                                has_var=has_var, num_img=num_img, data_size=data_size,
                                                mclip=int(mclip), lsigma=lsigma, hsigma=hsigma,
-                                               max_iters=max_iters, sigclip=int(sigclip))
+                                               max_iters=max_iters, sigclip=int(sigclip),
+                                               num_threads=num_threads)
         return data.reshape(shape), mask.reshape(shape), (None if not has_var else variance.reshape(shape))
 
     @staticmethod
@@ -513,3 +555,286 @@ class NDStacker(object):
         else:
             mask |= clipped_data.mask
         return data, mask, variance
+
+
+class NDStreamStacker(object):
+    """
+    Stacker that combines NDData-like objects one input at a time, rather
+    than building an (N x input_shape) cube of the data, mask and variance
+    like NDStacker does. The state kept for each output pixel (sums,
+    rejection limits, and median histograms) is of a fixed size, so the
+    memory footprint scales with the size of the image rather than the
+    number of images. The inputs may be read several times, so this is
+    most useful when they are lazily loaded.
+
+    The "mean" and "wtmean" combiners give the same results as NDStacker,
+    as do the "sigclip" and "varclip" rejectors except that the median
+    they use (in the first iteration, or all of them if mclip=True) is
+    approximate. The median is found by histogramming the pixel values
+    in nbins bins within one standard deviation of the mean (the median
+    always lies in this range) and refining the bin containing the median
+    npasses times, so it is accurate to 2*sigma/nbins**npasses. When
+    there are variance planes, the variance of the median is estimated as
+    the mean of the input variances.
+
+    Like NDStacker, an instance is called with a sequence of NDData-like
+    objects and optional scale factors and zero offsets.
+    """
+    combiners = ('mean', 'average', 'wtmean', 'median')
+    rejectors = ('none', 'sigclip', 'varclip')
+
+    def __init__(self, combine='mean', reject='none', log=None, nbins=16,
+                 npasses=3, **kwargs):
+        if combine not in self.combiners:
+            raise ValueError("Combiner {} is not supported for streaming".
+                             format(combine))
+        if reject not in self.rejectors:
+            raise ValueError("Rejector {} is not supported for streaming".
+                             format(reject))
+        self._log = log
+        self._combine = 'mean' if combine == 'average' else combine
+        self._reject = reject
+        self._nbins = nbins
+        self._npasses = npasses
+        self._dict = {k: kwargs[k] for k in ('mclip', 'lsigma', 'hsigma',
+                                             'max_iters') if k in kwargs}
+
+    def bytes_per_pixel(self):
+        """
+        Approximate peak memory used for each output pixel, in bytes, not
+        counting the input being read. If a median is needed (to combine,
+        or to clip around), this is dominated by its histograms, so it
+        scales with nbins.
+
+        Returns
+        -------
+        int : number of bytes per pixel
+        """
+        nbins = self._nbins
+        # Two (nbins,)+shape uint16 histograms, plus the (uint64) cumulative
+        # sum of one and the float64 sum of that with the counts below the
+        # range, while that sum for the other histogram is still held; then
+        # the int32 counts below, the float64 ranges, the pixel indices, and
+        # the temporaries for each input
+        median = (2*2 + 3*8) * nbins + 2*4 + 6*8 + 40
+        # DQ level, mask, int32 counter and five float64 sums, plus the
+        # temporaries for each input
+        combine = 1 + 2 + 4 + 5*8 + 7*8
+        if self._combine == 'median':
+            # ...and the mean and variance the median is found from
+            combine += 3*8 + median
+        if self._reject == 'none':
+            return combine
+        # The float64 clipping limits are kept throughout. In each iteration
+        # there are two int32 counters and four float64 sums (plus the
+        # temporaries for each input) for the moments, and then the number,
+        # mean and variance of the good pixels while finding the median
+        limits = 2*8 + 1 + 2*4
+        moments = 2*4 + 4*8 + 4*8
+        return limits + max(moments, 2*4 + 2*8 + 1 + median, combine)
+
+    @staticmethod
+    def _levels(mask):
+        # Position of each pixel in the DQhierarchy
+        return DQ_LEVELS[mask]
+
+    def _inputs(self, sequence, scale, zero):
+        # Return a function that yields the (data, mask, variance) arrays of
+        # each input in turn, reading them afresh each time
+        nddata_list = list(sequence)
+        if scale is None:
+            scale = [1.0] * len(nddata_list)
+        if zero is None:
+            zero = [0.0] * len(nddata_list)
+        has_mask = not any(ndd.mask is None for ndd in nddata_list)
+        has_var = not any(ndd.variance is None for ndd in nddata_list)
+
+        def generator():
+            for ndd, s, z in zip(nddata_list, scale, zero):
+                data = (ndd.data * s + z).astype(np.float32)
+                if has_mask:
+                    mask = ndd.mask
+                    if mask.dtype == bool:
+                        mask = np.where(mask, ONE, ZERO)
+                    else:
+                        mask = mask.astype(DQ.datatype)
+                else:
+                    mask = np.zeros(data.shape, dtype=DQ.datatype)
+                variance = ndd.variance * s*s if has_var else None
+                yield data, mask, variance
+
+        return generator, nddata_list[0].shape, has_mask, has_var
+
+    @staticmethod
+    def _moments(frames, selector, shape):
+        # Number, mean, and (population) variance of the selected pixels.
+        # Where no pixels are selected, all the pixels are used.
+        n, sumx, sumsq = (np.zeros(shape, dtype=np.int32),
+                          np.zeros(shape), np.zeros(shape))
+        nall, sumxall, sumsqall = (np.zeros(shape, dtype=np.int32),
+                                   np.zeros(shape), np.zeros(shape))
+        for i, (data, mask, variance) in enumerate(frames()):
+            use = selector(i, data, mask, variance)
+            datasq = np.square(data, dtype=np.float64)
+            n += use
+            sumx += np.where(use, data, 0)
+            sumsq += np.where(use, datasq, 0)
+            nall += 1
+            sumxall += data
+            sumsqall += datasq
+        none_used = (n == 0)
+        n = np.where(none_used, nall, n)
+        sumx = np.where(none_used, sumxall, sumx)
+        sumsq = np.where(none_used, sumsqall, sumsq)
+        mean = sumx / np.maximum(n, 1)
+        var = np.maximum(sumsq / np.maximum(n, 1) - mean*mean, 0)
+        return n, mean, var, none_used
+
+    def _median(self, frames, selector, shape, n, mean, var, none_used):
+        # Approximate median of the selected pixels, given their number,
+        # mean and variance. Each pass histograms the pixels and narrows the
+        # range to the bin containing the median. For an even number of
+        # pixels, the two middle pixels are found and averaged.
+        nbins = self._nbins
+        std = np.sqrt(var)
+        ranks = ((n - 1) // 2, n // 2)
+        lo = [mean - std for rank in ranks]
+        width = 2 * std
+        pixels = np.arange(int(np.prod(shape))).reshape(shape)
+        for _ in range(self._npasses):
+            scaled_width = np.where(width > 0, width, 1) / nbins
+            nbelow = [np.zeros(shape, dtype=np.int32) for rank in ranks]
+            counts = [np.zeros((nbins,) + shape, dtype=np.uint16)
+                      for rank in ranks]
+            for i, (data, mask, variance) in enumerate(frames()):
+                use = selector(i, data, mask, variance) | none_used
+                for j in range(len(ranks)):
+                    bin = np.floor((data - lo[j]) / scaled_width).astype(np.int32)
+                    nbelow[j] += use & (bin < 0)
+                    inrange = use & (bin >= 0) & (bin < nbins)
+                    counts[j].reshape(nbins, -1)[bin[inrange], pixels[inrange]] += 1
+            for j, rank in enumerate(ranks):
+                cumcounts = nbelow[j] + np.cumsum(counts[j], axis=0)
+                medbin = np.minimum(np.sum(cumcounts <= rank, axis=0), nbins-1)
+                lo[j] += medbin * scaled_width
+            width = scaled_width
+        return np.where(width > 0, 0.5 * (lo[0] + lo[1] + width), mean)
+
+    def _rejection_limits(self, frames, shape, has_var):
+        # Replicates the iterative clipping of cyclip.iterclip, one iteration
+        # per pass through the inputs. A pixel is rejected if it is outside
+        # the limits of any iteration, so for sigma-clipping we need only
+        # keep the intersection of the intervals, and for variance-clipping
+        # the range of central values.
+        mclip = self._dict.get('mclip', True)
+        lsigma = self._dict.get('lsigma', 3.0)
+        hsigma = self._dict.get('hsigma', 3.0)
+        max_iters = self._dict.get('max_iters') or 100
+        sigclip = self._reject == 'sigclip' or not has_var
+        lo_lim = np.full(shape, -np.inf)
+        hi_lim = np.full(shape, np.inf)
+
+        def rejected(data, variance):
+            if sigclip:
+                return (data < lo_lim) | (data > hi_lim)
+            std = np.sqrt(variance)
+            return (data < lo_lim - lsigma*std) | (data > hi_lim + hsigma*std)
+
+        def selector(i, data, mask, variance):
+            return (mask == 0) & ~rejected(data, variance)
+
+        active = np.ones(shape, dtype=bool)
+        ngood = None
+        for iter in range(max_iters):
+            n, mean, var, none_used = self._moments(frames, selector, shape)
+            new_ngood = np.where(none_used, 0, n)
+            if ngood is not None:
+                active &= (new_ngood != ngood)
+                if not active.any():
+                    break
+            ngood = new_ngood
+            if iter == 0 or mclip:
+                avg = self._median(frames, selector, shape, n, mean, var,
+                                   none_used)
+            else:
+                avg = mean
+            if sigclip:
+                std = np.sqrt(var)
+                lo_lim = np.where(active, np.maximum(lo_lim, avg-lsigma*std), lo_lim)
+                hi_lim = np.where(active, np.minimum(hi_lim, avg+hsigma*std), hi_lim)
+            else:
+                lo_lim = np.where(active, np.maximum(lo_lim, avg), lo_lim)
+                hi_lim = np.where(active, np.minimum(hi_lim, avg), hi_lim)
+        return rejected
+
+    def __call__(self, sequence, scale=None, zero=None):
+        frames, shape, has_mask, has_var = self._inputs(sequence, scale, zero)
+        if self._reject == 'none':
+            rejected = None
+        else:
+            rejected = self._rejection_limits(frames, shape, has_var)
+
+        rejected_level = self._levels(ONE)
+
+        def level(data, mask, variance):
+            # Rejected pixels get flagged as bad, like NDStacker does
+            lvl = self._levels(mask)
+            if rejected is None:
+                return lvl, mask
+            rej = rejected(data, variance)
+            return (np.where(rej, np.maximum(lvl, rejected_level), lvl),
+                    mask | np.where(rej, ONE, ZERO))
+
+        # Accumulate statistics only from the least bad pixels, resetting
+        # them whenever a better pixel is found
+        best = np.full(shape, 255, dtype=np.uint8)
+        out_mask = np.zeros(shape, dtype=DQ.datatype)
+        n = np.zeros(shape, dtype=np.int32)
+        sums = np.zeros((5,) + shape)  # data, data^2, var, 1/var, data/var
+        for data, mask, variance in frames():
+            lvl, mask = level(data, mask, variance)
+            better = lvl < best
+            best[better] = lvl[better]
+            n[better] = 0
+            out_mask[better] = 0
+            sums[:, better] = 0
+            use = (lvl == best)
+            n += use
+            out_mask |= np.where(use, mask, ZERO)
+            sums[0] += np.where(use, data, 0)
+            sums[1] += np.where(use, np.square(data, dtype=np.float64), 0)
+            if has_var:
+                sums[2] += np.where(use, variance, 0)
+                with np.errstate(divide='ignore'):
+                    sums[3] += np.where(use, 1. / variance, 0)
+                    sums[4] += np.where(use, data / variance, 0)
+
+        nn = np.maximum(n, 1)
+        mean = sums[0] / nn
+        # Sum of squared deviations about the mean
+        sumsqdev = np.maximum(sums[1] - nn * mean * mean, 0)
+
+        if self._combine == 'wtmean' and has_var:
+            out_data = NDStacker._divide0(sums[4], sums[3])
+            out_var = NDStacker._divide0(np.ones_like(sums[3]), sums[3])
+        elif self._combine == 'median':
+            def selector(i, data, mask, variance):
+                return level(data, mask, variance)[0] == best
+            out_data = self._median(frames, selector, shape, n, mean,
+                                    sumsqdev / nn, n == 0)
+            if has_var:
+                out_var = sums[2] / nn
+            else:
+                out_var = NDStacker._divide0(sumsqdev + n * np.square(mean - out_data),
+                                             (n * (n - 1)).astype(np.float64))
+        else:
+            out_data = mean
+            if has_var:
+                out_var = sums[2] / (nn * nn)
+            else:  # IRAF gemcombine calculation
+                out_var = NDStacker._divide0(sumsqdev, (n * (n - 1)).astype(np.float64))
+
+        ret_value = NDAstroData(out_data.astype(np.float32),
+                                mask=out_mask if (has_mask or rejected is not None) else None)
+        ret_value.variance = out_var.astype(np.float32)
+        return ret_value
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark for the catalog alignment in gempy.library.matching, using
+synthetic catalogs of 1000 and 10000 sources. This is not run by pytest;
+run this file directly:
+
+    $ python bench_matching.py [--repeat 3] [--rotation] [--nsources 1000 10000]
+                               [--range 50] [--coarse brute fft]
+
+The times of the objective functions of the two fitters (called thousands
+of times by align_catalogs) are reported as well as the whole alignment,
+for each method of finding the initial alignment.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+from scipy import spatial
+
+from gempy.library import matching
+
+
+def make_catalogs(nsources, size=2048, shift=(15.3, -22.1), seed=0):
+    rng = np.random.RandomState(seed)
+    xin, yin = rng.uniform(low=0.05*size, high=0.95*size, size=(2, nsources))
+    xref = xin + shift[0] + rng.normal(scale=0.5, size=nsources)
+    yref = yin + shift[1] + rng.normal(scale=0.5, size=nsources)
+    return (xin, yin), (xref, yref)
+
+
+def best_time(func, repeat, *args, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = func(*args, **kwargs)
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def bench_align(nsources_list, repeat, rotation, translation_range, methods):
+    print("{:>10s}{:>14s}{:>14s}{:>14s}{:>8s}{:>12s}{:>12s}".format(
+        "nsources", "landscape(ms)", "_landstat(ms)", "_stat(ms)",
+        "coarse", "align(s)", "error(pix)"))
+    for nsources in nsources_list:
+        (xin, yin), (xref, yref) = make_catalogs(nsources)
+        model = matching.Shift2D(14.0, -21.0)
+
+        fit_it = matching.BruteLandscapeFitter()
+        t_land, landscape = best_time(fit_it.mklandscape, repeat, (xref, yref),
+                                      10.0, 4.0, (2150, 2150))
+        t_landstat, _ = best_time(matching._landstat, repeat * 10, landscape,
+                                  model, xin, yin)
+        tree = spatial.cKDTree(list(zip(xref, yref)))
+        t_stat, _ = best_time(matching._stat, repeat * 10, tree, model,
+                              xin, yin, 10.0, 4.0)
+
+        for coarse in methods:
+            kwargs = {'translation_range': translation_range,
+                      'tolerance': 0.1, 'coarse': coarse}
+            if rotation:
+                kwargs.update({'rotation_range': 1.0})
+            t_align, aligned = best_time(matching.align_catalogs, repeat, xin,
+                                         yin, xref, yref, **kwargs)
+            xt, yt = aligned(xin, yin)
+            error = np.sqrt(np.mean((xt - xin - 15.3)**2 + (yt - yin + 22.1)**2))
+            print("{:10d}{:14.2f}{:14.3f}{:14.3f}{:>8s}{:12.2f}{:12.2f}".format(
+                nsources, t_land * 1000, t_landstat * 1000, t_stat * 1000,
+                coarse, t_align, error))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark align_catalogs")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of alignments (the best one is kept)")
+    parser.add_argument("--rotation", action="store_true",
+                        help="also search for a rotation")
+    parser.add_argument("--nsources", type=int, nargs="+",
+                        default=[1000, 10000], help="catalog sizes")
+    parser.add_argument("--range", type=float, default=50,
+                        help="translation search range (pixels)")
+    parser.add_argument("--coarse", nargs="+", default=["brute", "fft"],
+                        choices=["brute", "fft"],
+                        help="methods for the initial alignment")
+    args = parser.parse_args()
+    bench_align(args.nsources, args.repeat, args.rotation, args.range,
+                args.coarse)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Benchmarks for gempy.library.nddops. These are not run by pytest; run this
+file directly:
+
+    $ python bench_nddops.py [--size 512]
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+from gempy.library.nddops import NDStacker
+from geminidr.gemini.lookups import DQ_definitions as DQ
+
+
+def make_masks(num_img, size, seed=0):
+    # Mostly good pixels, with a sprinkling of the usual DQ bits
+    rng = np.random.RandomState(seed)
+    mask = np.zeros((num_img, size, size), dtype=DQ.datatype)
+    flagged = rng.uniform(size=mask.shape) > 0.9
+    mask[flagged] = rng.choice([DQ.bad_pixel, DQ.non_linear, DQ.saturated,
+                                DQ.cosmic_ray, DQ.no_data, DQ.overlap,
+                                DQ.unilluminated], size=flagged.sum())
+    return mask
+
+
+def best_time(func, mask, repeat):
+    # The masks may be modified in place, so each call gets a fresh copy
+    times = []
+    for _ in range(repeat):
+        m = mask.copy()
+        start = time.time()
+        func(m)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_process_mask(size, repeat=3):
+    print("NDStacker._process_mask on {0}x{0} images".format(size))
+    print("{:>8s}{:>12s}{:>12s}{:>10s}".format("num_img", "numpy (s)",
+                                              "Cython (s)", "speedup"))
+    for num_img in (10, 50, 200):
+        mask = make_masks(num_img, size)
+        t_numpy = best_time(NDStacker._process_mask_numpy, mask, repeat)
+        t_cython = best_time(NDStacker._process_mask, mask, repeat)
+        print("{:8d}{:12.4f}{:12.4f}{:10.1f}".format(num_img, t_numpy, t_cython,
+                                                   t_numpy / t_cython))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark nddops")
+    parser.add_argument("--size", type=int, default=512,
+                        help="size of (square) input images")
+    args = parser.parse_args()
+    bench_process_mask(args.size)
@@ -0,0 +1,152 @@
+import numpy as np
+from astropy.io import fits
+from scipy import spatial
+
+import astrodata
+import gemini_instruments
+from gempy.library.detection import (detect_sources, SourceDetector,
+                                     FLAG_SATURATED)
+
+
+def make_image(nsources=50, shape=(512, 512), sigma=2.0, seed=0):
+    """Gaussian stars on a sloping background with noise"""
+    rng = np.random.RandomState(seed)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    data = 100 + 0.02 * xx + rng.normal(scale=5, size=shape)
+    x = rng.uniform(20, shape[1] - 20, nsources)
+    y = rng.uniform(20, shape[0] - 20, nsources)
+    flux = rng.uniform(2000, 50000, nsources)
+    for xs, ys, fs in zip(x, y, flux):
+        data += fs / (2 * np.pi * sigma**2) * np.exp(
+            -0.5 * ((xx - xs)**2 + (yy - ys)**2) / sigma**2)
+    return data, x, y, flux
+
+
+def match(objcat, x, y):
+    dist, index = spatial.cKDTree(np.c_[x + 1, y + 1]).query(
+        np.c_[objcat['X_IMAGE'], objcat['Y_IMAGE']])
+    return dist, index
+
+
+def test_detect_sources():
+    data, x, y, flux = make_image(nsources=30)
+    kernel = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]]) / 16.
+    objcat, objmask = detect_sources(data, kernel=kernel, detect_minarea=8,
+                                     detect_thresh=2., analysis_thresh=2.,
+                                     back_size=32, back_filtersize=8)
+    # A few stars may be blended, since there's no deblending
+    assert len(objcat) >= 0.85 * len(x)
+    dist, index = match(objcat, x, y)
+    # Blends are elongated
+    isolated = (objcat['FLAGS'] == 0) & (objcat['ELLIPTICITY'] < 0.2)
+    assert isolated.sum() > 0.8 * len(objcat)
+    assert np.all(dist[isolated] < 0.1)
+    # and the windowed positions are closer still (on the whole, since
+    # the faintest stars are limited by the noise)
+    windist, winindex = spatial.cKDTree(np.c_[x + 1, y + 1]).query(
+        np.c_[objcat['XWIN_IMAGE'], objcat['YWIN_IMAGE']])
+    assert np.all(winindex[isolated] == index[isolated])
+    assert np.all(windist[isolated] < 0.2)
+    assert np.median(windist[isolated]) < np.median(dist[isolated])
+    np.testing.assert_allclose(objcat['FLUX_AUTO'][isolated],
+                               flux[index][isolated], rtol=0.05)
+    np.testing.assert_allclose(np.median(objcat['FWHM_IMAGE']), 2.355 * 2.0,
+                               rtol=0.1)
+    np.testing.assert_allclose(np.median(objcat['FLUX_RADIUS']), 1.177 * 2.0,
+                               rtol=0.1)
+    assert np.median(objcat['CLASS_STAR'][isolated]) > 0.8
+    np.testing.assert_allclose(objcat['BACKGROUND'],
+                               100 + 0.02 * (objcat['X_IMAGE'] - 1), atol=1)
+
+    # The segmentation map is labelled with the NUMBER of each object
+    assert objmask.max() == len(objcat)
+    for row in objcat:
+        assert objmask[int(round(row['Y_IMAGE'] - 1)),
+                       int(round(row['X_IMAGE'] - 1))] == row['NUMBER']
+    assert np.all(np.bincount(objmask.ravel())[1:] == objcat['ISOAREA_IMAGE'])
+
+
+def test_detect_sources_flags():
+    data, x, y, flux = make_image(nsources=10)
+    mask = np.zeros(data.shape, dtype=np.uint16)
+    iy, ix = int(y[0]), int(x[0])
+    mask[iy-1:iy+2, ix-1:ix+2] = 4
+    objcat, _ = detect_sources(data, mask=mask, detect_minarea=8,
+                               satur_level=data[iy, ix] - 1)
+    dist, index = match(objcat, x, y)
+    row = objcat[index == 0][0]
+    assert row['FLAGS'] & FLAG_SATURATED
+    assert row['IMAFLAGS_ISO'] == 4 and row['NIMAFLAGS_ISO'] == 9
+    assert np.all(objcat['NIMAFLAGS_ISO'][index != 0] == 0)
+
+
+def test_source_detector():
+    data, x, y, flux = make_image(nsources=20)
+    ad = astrodata.create(fits.PrimaryHDU())
+    for _ in range(2):
+        ad.append(fits.ImageHDU(data=data.astype(np.float32), name='SCI'))
+    ad.filename = 'N20180101S0001.fits'
+    SourceDetector(inputs=[ad], params={'DETECT_MINAREA': 8,
+                                        'SATUR_LEVEL': [1e6, 0]},
+                   getmask=True).run()
+    for ext in ad:
+        assert len(ext.OBJCAT) >= 18
+        assert ext.OBJMASK.shape == data.shape
+    # Per-extension parameters go with the right extension
+    assert np.all(ad[0].OBJCAT['FLAGS'] & FLAG_SATURATED == 0)
+    assert np.all(ad[1].OBJCAT['FLAGS'] & FLAG_SATURATED)
+
+
+def test_detect_sources_objcat():
+    # Elongated sources at 30 degrees (counter-clockwise) from the x axis,
+    # which is -30 degrees from the +RA axis, since RA increases to the left
+    import os
+    from gempy.gemini import gemini_tools as gt
+    from geminidr.gemini.lookups.source_detection import sextractor_dict
+
+    rng = np.random.RandomState(1)
+    shape = (256, 256)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    data = 100 + rng.normal(scale=5, size=shape)
+    angle = np.radians(30)
+    for xs, ys in rng.uniform(30, 226, (12, 2)):
+        u = (xx - xs) * np.cos(angle) + (yy - ys) * np.sin(angle)
+        v = -(xx - xs) * np.sin(angle) + (yy - ys) * np.cos(angle)
+        data += 20000 / (2 * np.pi * 3 * 2) * np.exp(
+            -0.5 * (u**2 / 9 + v**2 / 4))
+
+    ad = astrodata.create(fits.PrimaryHDU(header=fits.Header(
+        {'OBSERVAT': 'Gemini-North'})))
+    ad.append(fits.ImageHDU(data=data.astype(np.float32), name='SCI'))
+    ad[0].hdr.update({'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+                      'CRVAL1': 150., 'CRVAL2': 30., 'CRPIX1': 128.,
+                      'CRPIX2': 128., 'CD1_1': -4e-5, 'CD1_2': 0.,
+                      'CD2_1': 0., 'CD2_2': 4e-5})
+    ad[0].mask = np.zeros(shape, dtype=np.uint16)
+    SourceDetector(inputs=[ad], params={'DETECT_MINAREA': 8}).run()
+    objcat = ad[0].OBJCAT
+    assert len(objcat) >= 10
+    np.testing.assert_allclose(np.median(objcat['THETA_IMAGE']), 30, atol=2)
+    np.testing.assert_allclose(np.median(objcat['THETA_WORLD']), -30, atol=2)
+    np.testing.assert_allclose(objcat['A_WORLD'] / objcat['A_IMAGE'],
+                               0.144 / 3600, rtol=1e-3)
+    for name in ('ERRA_IMAGE', 'ERRB_IMAGE', 'ERRA_WORLD', 'ERRB_WORLD'):
+        assert np.all(objcat[name] > 0)
+    assert np.all(objcat['ERRA_IMAGE'] >= objcat['ERRB_IMAGE'])
+
+    # None of the columns gt.add_objcat expects from SExtractor is missing
+    sx_dict = {key: os.path.join(os.path.dirname(sextractor_dict.__file__),
+                                 value)
+               for key, value in sextractor_dict.sx_dict.items()}
+    gt.add_objcat(ad, replace=True, table=objcat, sx_dict=sx_dict)
+    objcat = ad[0].OBJCAT
+    expected = gt.parse_sextractor_param(sx_dict['dq', 'param'])
+    for name in expected:
+        assert np.all(objcat[name] != -999), name
+    # and the position angles make it through clip_sources()
+    objcat['PROFILE_FWHM'] = objcat['FWHM_IMAGE']
+    objcat['PROFILE_EE50'] = 2 * objcat['FWHM_IMAGE']
+    objcat['CLASS_STAR'] = 1
+    sources = gt.clip_sources(ad)[0]
+    assert len(sources) > 0
+    np.testing.assert_allclose(sources['pa'], -30, atol=5)
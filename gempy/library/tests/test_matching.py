@@ -92,6 +92,21 @@ class TestMatching:
             assert (abs(getattr(model, p) - getattr(real_model, p)) <
                     max(3.0*sig/np.sqrt(nsources), tol))
 
+    def test_align_catalogs_fft(self):
+        nsources = 100
+        sig = 1.0
+        tol = 0.01
+        xshift, yshift = -123.4, 87.6
+        xin, yin = self.make_catalog(nsources, 1024)
+        real_model = matching.Shift2D(xshift, yshift)
+        xref, yref = self.transform_coords((xin, yin), real_model, sig)
+        model = matching.align_catalogs(xin, yin, xref, yref,
+                                        translation_range=200, tolerance=tol,
+                                        coarse='fft')
+        for p in model.param_names:
+            assert (abs(getattr(model, p) - getattr(real_model, p)) <
+                    max(3.0*sig/np.sqrt(nsources), tol))
+
     def test_match_sources(self):
         yin, xin = np.mgrid[0:5, 0:5]
         xref = np.array([2.1, 3.1])
@@ -104,4 +119,57 @@ class TestMatching:
         matched = matching.match_sources((xin.ravel(), yin.ravel()),
                                          (xref, yref), priority=[4])
         assert matched[22] == 0
-        assert matched[4] == 1
\ No newline at end of file
+        assert matched[4] == 1
+
+    def test_mklandscape(self):
+        # Both ways of making the landscape must agree, including for
+        # sources whose mountains fall partly or wholly off the edges
+        x, y = np.random.uniform(low=-50, high=550, size=(2, 200))
+        landshape = (300, 500)
+        fit_it = matching.BruteLandscapeFitter()
+        landscape = fit_it.mklandscape((x, y), 5.0, 4.0, landshape)
+        convolved = fit_it._convolved_landscape((x, y), 5.0, 20, landshape)
+        assert landscape.shape == landshape
+        np.testing.assert_allclose(landscape, convolved, atol=1e-12)
+        # A single source is a single mountain
+        landscape = fit_it.mklandscape((100.3, 50.7), 2.0, 3.0, landshape)
+        assert landscape[50, 99] == landscape.max() == 1.0
+        assert np.isclose(landscape.sum(), 2 * np.pi * 4, rtol=0.01)
+
+    def test_statistics(self):
+        x, y = self.make_catalog(300, 1024)
+        xref, yref = self.transform_coords((x, y), matching.Shift2D(5.0, 10.0),
+                                           1.0)
+        model = matching.Shift2D(4.0, 9.0)
+        xt, yt = model(x, y)
+
+        landscape = matching.BruteLandscapeFitter().mklandscape(
+            (xref, yref), 5.0, 4.0, (1000, 1000))
+        expected = sum(landscape[int(yy-0.5), int(xx-0.5)]
+                       for xx, yy in zip(xt, yt)
+                       if 0 <= int(xx-0.5) < 1000 and 0 <= int(yy-0.5) < 1000)
+        assert np.isclose(matching._landstat(landscape, model, x, y), -expected)
+
+        tree = matching.spatial.cKDTree(list(zip(xref, yref)))
+        dist, _ = tree.query(list(zip(xt, yt)), k=5, distance_upper_bound=20.)
+        expected = sum(np.exp(-0.5*d*d/25.) for d in dist.ravel())
+        assert np.isclose(matching._stat(tree, model, x, y, 5.0, 4.0), -expected)
+
+    def test_solve_global_offsets(self):
+        # Dithered catalogs from one field, with small registration errors;
+        # the last catalog doesn't overlap the first, so can only be placed
+        # via the others
+        x, y = self.make_catalog(400, 1024)
+        shifts = np.array([[0., 0.], [0.62, -0.35], [-0.48, 0.21], [0.33, 0.57]])
+        windows = [(0, 600), (200, 800), (300, 900), (650, 1024)]
+        coords = []
+        for (dx, dy), (x1, x2) in zip(shifts, windows):
+            good = (x >= x1) & (x < x2)
+            coords.append(np.array([x[good] - dx, y[good] - dy]) +
+                          np.random.normal(scale=0.05, size=(2, good.sum())))
+        offsets = matching.solve_global_offsets(coords, radius=2.0,
+                                                min_matches=3)
+        np.testing.assert_allclose(offsets, shifts, atol=0.02)
+        # Catalogs with no matches are left alone
+        offsets = matching.solve_global_offsets(coords + [np.empty((2, 0))])
+        assert np.all(offsets[-1] == 0)
@@ -1,5 +1,7 @@
 import numpy as np
-from gempy.library.nddops import NDStacker
+from astrodata import NDAstroData
+from astrodata.fits import windowedOp
+from gempy.library.nddops import NDStacker, NDStreamStacker, take_along_axis
 from geminidr.gemini.lookups import DQ_definitions as DQ
 
 def test_process_mask():
@@ -27,3 +29,165 @@ def test_process_mask():
         mask, out_mask = NDStacker._process_mask(in_mask)
         assert out_mask[0] == correct_output
         assert np.array_equal(mask.T[0], pixel_usage)
+
+
+def test_process_mask_matches_numpy():
+    # The Cython routine must reproduce the pure-numpy version exactly
+    rng = np.random.RandomState(0)
+    bits = [0, 1, 2, 4, 8, 16, 32, 64, 128, 3, 24, 65]
+    in_mask = rng.choice(bits, size=(7, 40, 50)).astype(DQ.datatype)
+    mask, out_mask = NDStacker._process_mask(in_mask.copy())
+    np_mask, np_out_mask = NDStacker._process_mask_numpy(in_mask.copy())
+    assert np.array_equal(mask, np_mask)
+    assert np.array_equal(out_mask, np_out_mask)
+
+
+def test_masked_median():
+    # Compare the Cython median and low median with masked-array versions
+    rng = np.random.RandomState(2)
+    for num_img in (6, 7):
+        data = rng.normal(size=(num_img, 20, 30)).astype(np.float32)
+        mask = (rng.uniform(size=data.shape) > 0.7).astype(DQ.datatype)
+        mask[:, 0, 0] = 0  # ensure every pixel has some good inputs
+        mask[0] = 0
+        masked_data = np.ma.masked_array(data, mask=mask)
+        out_data, out_mask, out_var = NDStacker.median(data, mask.copy())
+        assert np.allclose(out_data, np.ma.median(masked_data, axis=0))
+        out_data, out_mask, out_var = NDStacker.lmedian(data, mask.copy())
+        ngood = NDStacker._num_good(mask)
+        lmed = take_along_axis(np.sort(masked_data, axis=0).data,
+                               (ngood - 1) // 2, axis=0)
+        assert np.allclose(out_data, lmed)
+
+
+def test_minmax():
+    # The right number of pixels should be flagged, and they should be
+    # the extreme ones
+    rng = np.random.RandomState(3)
+    data = rng.normal(size=(10, 20, 30)).astype(np.float32)
+    for mask in (None, np.zeros(data.shape, dtype=DQ.datatype)):
+        out_data, out_mask, out_var = NDStacker.minmax(data, mask, nlow=2, nhigh=3)
+        assert np.array_equal(out_mask.sum(axis=0), np.full((20, 30), 5))
+        ranks = np.argsort(np.argsort(data, axis=0), axis=0)
+        assert np.array_equal(out_mask > 0, (ranks < 2) | (ranks >= 7))
+
+
+def test_sigclip_many_images():
+    # The Cython clipping routine used to have a fixed 10000-element buffer
+    rng = np.random.RandomState(4)
+    data = rng.normal(size=(12000, 2, 3)).astype(np.float32)
+    data[0] = 100.
+    out_data, out_mask, out_var = NDStacker.sigclip(data)
+    assert np.all(out_mask[0] & 1)
+    assert out_mask[1:].sum() < 0.01 * out_mask[1:].size
+
+
+def test_parallel_windowedop():
+    # Stacking in parallel row-chunks must give the same answer as doing
+    # the whole image at once
+    rng = np.random.RandomState(0)
+    ndds = []
+    for i in range(7):
+        ndd = NDAstroData(rng.normal(size=(50, 20)).astype(np.float32),
+                          mask=(rng.uniform(size=(50, 20)) > 0.9).astype(DQ.datatype))
+        ndd.variance = np.ones((50, 20), dtype=np.float32)
+        ndds.append(ndd)
+    stack_function = NDStacker(combine='mean', reject='sigclip')
+    serial = windowedOp(stack_function, ndds, kernel=(50, 20), dtype=np.float32,
+                        with_uncertainty=True, with_mask=True)
+    parallel = windowedOp(stack_function, ndds, kernel=(7, 20), dtype=np.float32,
+                          with_uncertainty=True, with_mask=True, num_workers=4)
+    assert np.allclose(serial.data, parallel.data)
+    assert np.allclose(serial.variance, parallel.variance)
+    assert np.array_equal(serial.mask, parallel.mask)
+
+    # Each worker clipping in a single thread gives the same answer
+    stack_function = NDStacker(combine='mean', reject='sigclip', num_threads=1)
+    single = windowedOp(stack_function, ndds, kernel=(7, 20), dtype=np.float32,
+                        with_uncertainty=True, with_mask=True, num_workers=4)
+    assert np.allclose(serial.data, single.data)
+    assert np.allclose(serial.variance, single.variance)
+    assert np.array_equal(serial.mask, single.mask)
+
+
+def test_num_threads(monkeypatch):
+    # The thread count is passed to the Cython clipping routine
+    from gempy.library import cyclip
+    iterclip = cyclip.iterclip
+    used = []
+
+    def fake_iterclip(*args, **kwargs):
+        used.append(kwargs['num_threads'])
+        return iterclip(*args, **kwargs)
+
+    monkeypatch.setattr(cyclip, 'iterclip', fake_iterclip)
+    rng = np.random.RandomState(0)
+    ndds = []
+    for i in range(5):
+        ndd = NDAstroData(rng.normal(size=(10, 10)).astype(np.float32))
+        ndd.variance = np.ones((10, 10), dtype=np.float32)
+        ndds.append(ndd)
+    for reject in ('sigclip', 'varclip'):
+        for num_threads in (0, 1):
+            NDStacker(combine='mean', reject=reject,
+                      num_threads=num_threads)(ndds)
+    assert used == [0, 1, 0, 1]
+
+
+def test_stream_stacker():
+    # Results of the streaming stacker should agree with those of NDStacker
+    # (the median is approximate, so there's a tolerance)
+    rng = np.random.RandomState(1)
+    ndds = []
+    for i in range(10):
+        data = rng.normal(100, 10, size=(20, 30)).astype(np.float32)
+        data[rng.uniform(size=data.shape) > 0.97] += 500
+        mask = np.where(rng.uniform(size=data.shape) > 0.9,
+                        rng.choice([1, 2, 4, 8, 16, 32, 64], size=data.shape),
+                        0).astype(DQ.datatype)
+        ndd = NDAstroData(data, mask=mask)
+        ndd.variance = np.full(data.shape, rng.uniform(50, 200), dtype=np.float32)
+        ndds.append(ndd)
+
+    for combine in ('mean', 'wtmean'):
+        for reject, kwargs in (('none', {}), ('sigclip', {'mclip': False}),
+                               ('varclip', {'mclip': True})):
+            full = NDStacker(combine, reject, **kwargs)(ndds)
+            streamed = NDStreamStacker(combine, reject, npasses=4, **kwargs)(ndds)
+            assert np.allclose(full.data, streamed.data, atol=1e-3)
+            assert np.allclose(full.variance, streamed.variance, rtol=1e-5)
+            assert np.array_equal(full.mask, streamed.mask)
+
+    full = NDStacker('median', 'none')(ndds)
+    streamed = NDStreamStacker('median', 'none')(ndds)
+    assert np.allclose(full.data, streamed.data, atol=0.1)
+    assert np.array_equal(full.mask, streamed.mask)
+
+
+def test_stream_stacker_memory():
+    # The estimated footprint must cover what's actually used, besides the
+    # input being read (its data, mask, and variance, and a scaled copy)
+    import tracemalloc
+    rng = np.random.RandomState(2)
+    shape = (100, 100)
+    ndds = []
+    for i in range(7):
+        ndd = NDAstroData(rng.normal(size=shape).astype(np.float32),
+                          mask=np.zeros(shape, dtype=DQ.datatype))
+        ndd.variance = np.ones(shape, dtype=np.float32)
+        ndds.append(ndd)
+    input_bytes = 2 * (4 + 2 + 4) * ndds[0].data.size
+
+    for combine in ('mean', 'median'):
+        for reject in ('none', 'sigclip', 'varclip'):
+            for nbins in (16, 64):
+                stack_function = NDStreamStacker(combine, reject, nbins=nbins)
+                tracemalloc.start()
+                try:
+                    stack_function(ndds)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                estimate = stack_function.bytes_per_pixel() * ndds[0].data.size
+                assert peak <= estimate + input_bytes
+                assert estimate < 1.2 * peak
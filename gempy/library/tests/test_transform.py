@@ -0,0 +1,202 @@
+import pytest
+import threading
+import time
+import numpy as np
+
+from astropy.modeling import models
+from astropy.wcs import WCS
+
+from astrodata import NDAstroData
+from gempy.library import transform
+from gempy.library.matching import Pix2Sky, Scale2D
+from geminidr.gemini.lookups import DQ_definitions as DQ
+
+
+def make_datagroup(seed=0):
+    rng = np.random.RandomState(seed)
+    arrays = []
+    for i in range(2):
+        data = rng.normal(size=(120, 100)).astype(np.float32)
+        mask = np.zeros(data.shape, dtype=DQ.datatype)
+        flagged = rng.uniform(size=mask.shape) > 0.95
+        mask[flagged] = rng.choice([DQ.bad_pixel, DQ.non_linear, DQ.saturated,
+                                    DQ.cosmic_ray, DQ.unilluminated],
+                                   size=flagged.sum())
+        arrays.append(NDAstroData(data, mask=mask))
+    transforms = [transform.Transform([models.Shift(3.3) & models.Shift(-1.7),
+                                       models.Rotation2D(0.8)]),
+                  transform.Transform([models.Shift(110.4) & models.Shift(2.1),
+                                       models.Rotation2D(-0.5)])]
+    dg = transform.DataGroup(arrays, transforms)
+    dg.no_data['mask'] = DQ.no_data
+    return dg
+
+
+@pytest.mark.parametrize('order', [0, 1])
+def test_single_pass_bitmask(order, monkeypatch):
+    single = make_datagroup().transform(attributes=['data', 'mask'],
+                                        order=order)
+    monkeypatch.setattr(transform.DataGroup, '_single_pass_bitmask',
+                        staticmethod(lambda *args: False))
+    bitwise = make_datagroup().transform(attributes=['data', 'mask'],
+                                         order=order)
+    assert single['mask'].dtype == bitwise['mask'].dtype
+    np.testing.assert_array_equal(single['mask'], bitwise['mask'])
+    np.testing.assert_array_equal(single['data'], bitwise['data'])
+    assert (single['mask'] & DQ.no_data).any()
+
+
+@pytest.mark.parametrize('order', [1, 3])
+def test_parallel_transform(order):
+    # order=3 transforms the mask bit-by-bit, which makes plenty of jobs
+    serial = make_datagroup().transform(attributes=['data', 'mask'],
+                                        order=order)
+    parallel = make_datagroup().transform(attributes=['data', 'mask'],
+                                          order=order, parallel=True)
+    for attr in ('data', 'mask'):
+        assert serial[attr].dtype == parallel[attr].dtype
+        np.testing.assert_array_equal(serial[attr], parallel[attr])
+
+
+def test_parallel_transform_error(monkeypatch):
+    # A failed job is only reraised once the others have stopped running
+    apply_transform = transform.DataGroup._apply_geometric_transform
+    calls, running = [], []
+
+    def failing_transform(self, *args, **kwargs):
+        calls.append(None)
+        running.append(None)
+        try:
+            if len(calls) == 2:
+                raise ValueError("bad job")
+            time.sleep(0.05)
+            apply_transform(self, *args, **kwargs)
+        finally:
+            running.pop()
+
+    monkeypatch.setattr(transform.DataGroup, '_apply_geometric_transform',
+                        failing_transform)
+    monkeypatch.setattr(transform.multi, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(transform, '_pool', None)
+    with pytest.raises(ValueError, match="bad job"):
+        make_datagroup().transform(attributes=['data', 'mask'], order=3,
+                                   parallel=True)
+    assert not running
+
+
+def test_worker_pool_threads(monkeypatch):
+    # Threads asking for the pool at the same time all get the same one
+    monkeypatch.setattr(transform, '_pool', None)
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(
+        transform._worker_pool())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(pools) == 8 and all(pool is pools[0] for pool in pools)
+
+
+def test_mapping_cache():
+    cache = transform.MappingCache()
+    t = transform.Transform([models.Shift(3.3) & models.Shift(-1.7),
+                             models.Rotation2D(0.8)])
+    geomap = cache.geomap(t, (50, 40))
+    assert cache.geomap(t.copy(), (50, 40)) is geomap
+    assert cache.memory == 2 * 50 * 40 * 4
+    np.testing.assert_array_equal(
+        geomap.coords, transform.GeoMap(t, (50, 40), inverse=True).coords)
+
+    # Different parameters, models or shapes all need new mappings
+    assert cache.geomap(t, (40, 50)) is not geomap
+    t2 = transform.Transform([models.Shift(3.3) & models.Shift(-1.7),
+                              models.Rotation2D(0.9)])
+    assert cache.geomap(t2, (50, 40)) is not geomap
+    t3 = transform.Transform([models.Shift(3.3) & models.Shift(-1.7),
+                              models.Scale(0.8) & models.Scale(0.8)])
+    assert cache.geomap(t3, (50, 40)) is not geomap
+    assert len(cache) == 4
+
+    # Least recently used mappings are discarded first
+    cache.max_memory = 3 * geomap.coords[0].nbytes * 2
+    cache.geomap(t, (50, 40))
+    cache.geomap(t, (60, 40))
+    assert len(cache) == 2
+    assert cache.geomap(t, (50, 40)) is geomap
+
+    cache.clear()
+    assert len(cache) == 0 and cache.memory == 0
+
+
+def test_mapping_cache_model_state():
+    # Models with state that isn't in their parameters get different keys
+    cache = transform.MappingCache()
+    points = (np.arange(5.),)
+    t1 = transform.Transform([models.Tabular1D(points, np.arange(5.) * 2) &
+                              models.Identity(1)])
+    t2 = transform.Transform([models.Tabular1D(points, np.arange(5.) * 3) &
+                              models.Identity(1)])
+    assert cache.transform_key(t1) != cache.transform_key(t2)
+    geomap1 = cache.geomap(t1, (4, 4))
+    geomap2 = cache.geomap(t2, (4, 4))
+    assert geomap2 is not geomap1
+    np.testing.assert_array_equal(
+        geomap2.coords, transform.GeoMap(t2, (4, 4), inverse=True).coords)
+    t3 = transform.Transform([models.Tabular1D(points, np.arange(5.) * 2) &
+                              models.Identity(1)])
+    assert cache.geomap(t3, (4, 4)) is geomap1
+
+    assert (cache.transform_key(transform.Transform([Scale2D(2., 1.)])) !=
+            cache.transform_key(transform.Transform([Scale2D(2., 2.)])))
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.cd = [[-1e-4, 0], [0, 1e-4]]
+    keys = set()
+    for crval in ([10., 20.], [10., 21.]):
+        wcs.wcs.crval = crval
+        for direction in (1, -1):
+            keys.add(cache.transform_key(transform.Transform(
+                [Pix2Sky(wcs, direction=direction)])))
+    assert len(keys) == 4 and None not in keys
+
+    # and Models that aren't known about aren't cached at all
+    class Custom(models.Shift):
+        pass
+
+    t = transform.Transform([Custom(1.) & Custom(2.)])
+    assert cache.transform_key(t) is None
+    ncached = len(cache)
+    assert cache.geomap(t, (4, 4)) is not cache.geomap(t, (4, 4))
+    assert len(cache) == ncached
+
+
+def test_transform_uses_mapping_cache(monkeypatch):
+    cache = transform.MappingCache()
+    monkeypatch.setattr(transform, 'mapping_cache', cache)
+    first = make_datagroup().transform(attributes=['data', 'mask'])
+    nmappings = len(cache)
+    monkeypatch.setattr(transform.Transform, 'affine_matrices', None)
+    second = make_datagroup().transform(attributes=['data', 'mask'])
+    assert len(cache) == nmappings
+    for attr in ('data', 'mask'):
+        np.testing.assert_array_equal(first[attr], second[attr])
+
+
+@pytest.mark.parametrize('affine', [True, False])
+@pytest.mark.parametrize('order', [0, 1, 3])
+def test_banded_transform(order, affine):
+    def datagroup():
+        dg = make_datagroup()
+        for t in dg.transforms:
+            t._affine = affine  # so a GeoMap is used if False
+        return dg
+
+    whole = datagroup().transform(attributes=['data', 'mask'], order=order)
+    dg = datagroup()
+    memory = 20 * 100 * dg.bytes_per_pixel
+    banded = dg.transform(attributes=['data', 'mask'], order=order,
+                          memory=memory, memmap=True)
+    assert len(dg._output_bands((120, 100), 1, memory)) == 6
+    for attr in ('data', 'mask'):
+        assert isinstance(banded[attr], np.memmap)
+        np.testing.assert_array_equal(whole[attr], banded[attr])
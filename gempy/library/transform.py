@@ -12,6 +12,8 @@ Classes:
                a transformation from one set of coordinates to another
     GeoMap: a callable object that accepts coordinates and returns
             geometrically-transformed coordinates
+    MappingCache: a least-recently-used cache of the GeoMaps and affine
+                  matrices computed for transformations
     DataGroup: a collection of array-like objects and transforms that will be
                combined into a single output (more precisely, a single output
                per attribute)
@@ -19,8 +21,10 @@ Classes:
 """
 import numpy as np
 import copy
+import hashlib
 from functools import reduce
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from threading import Lock
 
 from astropy.modeling import models, Model
 from astropy.modeling.core import _model_oper
@@ -29,22 +33,50 @@ from astropy.wcs import WCS
 from scipy import ndimage
 
 from gempy.library import astrotools as at
+try:
+    from gempy.library import cytransform
+except ImportError:
+    raise ImportError("Run 'cythonize -i cytransform.pyx' in gempy/library")
 
 import multiprocessing as multi
+import os
+import tempfile
+from multiprocessing.pool import ThreadPool
+from future.moves import queue
+from future.utils import string_types
 from geminidr.gemini.lookups import DQ_definitions as DQ
 
 import astrodata, gemini_instruments
 
-from .matching import Rotate2D, Shift2D, Scale2D
+from .matching import Pix2Sky, Rotate2D, Shift2D, Scale2D
 from ..utils import logutils
 
 AffineMatrices = namedtuple("AffineMatrices", "matrix offset")
+CoordinateMap = namedtuple("CoordinateMap", "coords")
 
 # Table attribute names that should be modified to represent the
 # coordinates in the Block, not their individual arrays.
 # NB. Standard python ordering!
 catalog_coordinate_columns = {'OBJCAT': (['Y_IMAGE'], ['X_IMAGE'])}
 
+# Pool of threads used by DataGroup.transform(parallel=True), and the PID of
+# the process that created it (a forked child needs a new one). Threads are
+# enough because scipy.ndimage and cytransform release the GIL
+_pool = None
+_pool_pid = None
+_pool_lock = Lock()
+
+
+def _worker_pool():
+    """Returns the pool of worker threads, creating it if necessary"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPool(multi.cpu_count())
+            _pool_pid = os.getpid()
+        return _pool
+
+
 class Block(object):
     """
     A Block is a container for multiple AD slices/NDData/ndarray objects
@@ -770,6 +802,211 @@ class GeoMap(object):
 
 #----------------------------------------------------------------------------------
 
+class MappingCache(object):
+    """
+    A least-recently-used cache of the mappings (GeoMaps and AffineMatrices)
+    from output to input coordinates. The same geometry is applied to every
+    frame from an instrument, so these can be reused rather than recomputed
+    each time. Mappings are keyed by the models, parameters and other state
+    of the (output->input) Transform and the output shape, which includes
+    any subsampling. Transforms with models whose state isn't known (see
+    _model_state) aren't cached. Once the coordinate arrays exceed max_memory (in bytes),
+    the least recently used mappings are discarded.
+
+    Parameters
+    ----------
+    max_memory: int
+        maximum memory to use (0 disables the cache)
+    """
+    # Non-Parameter attributes that affect the result of a Model
+    model_attributes = ('mapping', 'domain', 'window', 'x_domain', 'y_domain',
+                        'x_window', 'y_window')
+    # Modules of astropy Models whose results depend only on their parameters
+    # and the attributes above. Other Models are only cached if _model_state()
+    # knows about the rest of their state
+    safe_modules = ('astropy.modeling.functional_models',
+                    'astropy.modeling.polynomial',
+                    'astropy.modeling.projections',
+                    'astropy.modeling.rotations',
+                    'astropy.modeling.mappings')
+
+    def __init__(self, max_memory=512*1024*1024):
+        self.max_memory = max_memory
+        self.memory = 0
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        """Empty the cache"""
+        with self._lock:
+            self._cache.clear()
+            self.memory = 0
+
+    def get(self, key, function, *args, **kwargs):
+        """
+        Return the value cached with key, calling function(*args, **kwargs)
+        to compute (and cache) it if it's not there.
+
+        Parameters
+        ----------
+        key: hashable
+            identifier for this value
+        function: callable
+            function that computes the value
+
+        Returns
+        -------
+        the (cached) value, which must not be modified
+        """
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._cache[key] = value
+                return value
+
+        value = function(*args, **kwargs)
+        size = self._nbytes(value)
+        if size > self.max_memory:
+            return value
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = value
+                self.memory += size
+            while self.memory > self.max_memory:
+                self.memory -= self._nbytes(self._cache.popitem(last=False)[1])
+        return value
+
+    def affine_matrices(self, transform, shape):
+        """
+        Return the AffineMatrices of an output->input Transform
+
+        Parameters
+        ----------
+        transform: Transform
+            the output->input transformation
+        shape: tuple
+            shape of the output array
+        """
+        key = self.transform_key(transform)
+        if key is None:
+            return transform.affine_matrices(shape=shape)
+        return self.get(('affine', key, tuple(shape)),
+                        transform.affine_matrices, shape=shape)
+
+    def geomap(self, transform, shape):
+        """
+        Return the GeoMap of an output->input Transform
+
+        Parameters
+        ----------
+        transform: Transform
+            the output->input transformation
+        shape: tuple
+            shape of the output array
+        """
+        key = self.transform_key(transform)
+        if key is None:
+            return GeoMap(transform, shape, inverse=True)
+        return self.get(('geomap', key, tuple(shape)),
+                        GeoMap, transform, shape, inverse=True)
+
+    @classmethod
+    def transform_key(cls, transform):
+        """
+        Return a hashable representation of a Transform, from the classes
+        of its component Models, how they are combined, their parameter
+        values and any other state that affects what they compute, or None
+        if it contains Models that aren't known to be safe to cache
+        """
+        key = tuple(cls._model_key(m) for m in transform)
+        return None if None in key else key
+
+    @classmethod
+    def _model_key(cls, model):
+        try:
+            nodes = [node.value for node in model._tree.traverse_postorder()]
+        except AttributeError:
+            try:  # astropy 4+ CompoundModel
+                nodes = list(model.traverse_postorder(include_operator=True))
+            except AttributeError:
+                nodes = [model]
+        structure = []
+        for node in nodes:
+            if isinstance(node, string_types):
+                structure.append(node)
+                continue
+            state = cls._model_state(node)
+            if state is None:
+                return None
+            structure.append((node if isinstance(node, type) else
+                              node.__class__, node.n_inputs) +
+                             tuple(str(getattr(node, attr)) for attr in
+                                   cls.model_attributes if hasattr(node, attr))
+                             + state)
+        return tuple(structure) + (tuple(model.parameters),)
+
+    @classmethod
+    def _model_state(cls, model):
+        """
+        Return a hashable representation of the state of a Model that isn't
+        held in its parameters or model_attributes, or None if the Model's
+        class isn't known to be safe to cache
+        """
+        model_class = model if isinstance(model, type) else model.__class__
+        if not issubclass(model_class, Model):
+            return None
+        if model_class.__module__ in cls.safe_modules or model_class is Shift2D:
+            return ()
+        if isinstance(model, type):
+            return None
+        if model_class in (models.Tabular1D, models.Tabular2D):
+            return ((cls._array_key(model.lookup_table),
+                     str(getattr(model.lookup_table, 'unit', None))) +
+                    tuple(cls._array_key(p) for p in model.points) +
+                    (model.method, model.bounds_error, str(model.fill_value)))
+        if model_class is Scale2D:
+            return (model._factor_scale,)
+        if model_class is Rotate2D:
+            return (model._angle_scale,)
+        if model_class is Pix2Sky:
+            wcs = model._wcs
+            # Table-lookup distortions aren't in the header string
+            if any(getattr(wcs, attr, None) is not None for attr in
+                   ('cpdis1', 'cpdis2', 'det2im1', 'det2im2')):
+                return None
+            return (wcs.to_header_string(relax=True), model._direction,
+                    model._factor_scale, model._angle_scale)
+        return None
+
+    @staticmethod
+    def _array_key(array):
+        """Hashable representation of an array's contents"""
+        array = np.ascontiguousarray(array)
+        return (array.dtype.str, array.shape,
+                hashlib.md5(array.tobytes()).hexdigest())
+
+    @staticmethod
+    def _nbytes(value):
+        """Memory used by the arrays in a cached value"""
+        if isinstance(value, GeoMap):
+            value = value.coords
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return sum(MappingCache._nbytes(v) for v in value)
+        return 0
+
+# The cache used by DataGroup and the mosaic package
+mapping_cache = MappingCache()
+
+#----------------------------------------------------------------------------------
+
 class DataGroup(object):
     """
     A DataGroup is a collection of an equal number array-like objects and
@@ -777,6 +1014,10 @@ class DataGroup(object):
     output array.
     """
     UnequalError = ValueError("Number of arrays and transforms must be equal")
+    # Generous estimate of the memory needed per (subsampled) output pixel
+    # when transforming: the interpolated array, the rescaled copy of it,
+    # and the input section (as float, for bitmasks)
+    bytes_per_pixel = 32
 
     def __init__(self, arrays=[], transforms=None):
         if transforms:
@@ -858,15 +1099,25 @@ class DataGroup(object):
         self.origin = tuple(min_ for min_, max_ in limits)
 
     def transform(self, attributes=['data'], order=1, subsample=1,
-                  threshold=0.01, conserve=False, parallel=False):
+                  threshold=0.01, conserve=False, parallel=False,
+                  memory=None, memmap=False):
         """
         This method transforms and combines the arrays into a single output
         array. The inputs, after transforming, shouldn't interfere with each
         other (i.e., no output pixel should have signal from more than one
         input object). Bit-masks (identified as being arrays of unsigned
-        integer type) are transformed bit-by-bit. If an attribute's name is a
-        key in the no_data dict, then that value is used to represent empty
-        regions in the output array of this attribute.
+        integer type) are transformed bit-by-bit (for 2D masks of up to 16
+        bits and interpolation orders 0 and 1, all bits are transformed in a
+        single pass). If an attribute's name is a key in the no_data dict,
+        then that value is used to represent empty regions in the output
+        array of this attribute. Arrays that are already in the output_dict
+        (e.g., memory-mapped files) are used as the outputs of their
+        attributes; these should be filled with the no_data value.
+
+        If memory is set, the region of the output that each input maps to
+        is transformed in bands of rows, so that the intermediate arrays
+        fit in that much memory. For interpolation orders 0 and 1, only the
+        section of each input that a band needs is used.
 
         Parameters
         ----------
@@ -882,161 +1133,223 @@ class DataGroup(object):
         conserve: bool
             conserve flux by applying Jacobian?
         parallel: bool
-            perform operations in parallel using multiprocessing?
+            perform the interpolations in parallel, using a pool of threads?
+        memory: int/None
+            memory available (in bytes) for the intermediate arrays
+            (None means each input is transformed in one go)
+        memmap: bool
+            create the output arrays as memory-mapped temporary files?
 
         Returns
         -------
         dict: {key: array} of arrays containing the transformed attributes
         """
+        self.output_arrays = {}
+        nworkers = multi.cpu_count() if parallel else 1
         if parallel:
-            processes = []
-            process_keys = []
-            manager = multi.Manager()
-            self.output_arrays = manager.dict()
-        else:
-            self.output_arrays = {}
-
-        if self.output_shape is None:
-            self.calculate_output_shape()
+            pool = _worker_pool()
+            finished = queue.Queue()
+            njobs = 0
 
-        self.corners = []
-        self.jfactors = []
-
-        if subsample > 1:
-            self.log.warning("Subsampling has not been fully tested")
-
-        for input_array, transform in zip(self._arrays, self._transforms):
-            # Since this may be modified, deepcopy to preserve the one if
-            # the DataGroup's _transforms list
-            transform = copy.deepcopy(transform)
-            if self.origin:
-                transform.append(reduce(Model.__and__,
-                                 [models.Shift(-offset) for offset in self.origin[::-1]]))
-            output_corners = self._prepare_for_output(input_array,
-                                                      transform, subsample)
-            output_array_shape = tuple(max_ - min_ for min_, max_ in output_corners)
-
-            # Create a mapping from output pixel to input pixels
-            mapping = transform.inverse.affine_matrices(shape=output_array_shape)
-            jfactor = abs(np.linalg.det(mapping.matrix))
-            if not conserve:
-                jfactor = 1
-            self.jfactors.append(jfactor)
-
-            integer_shift = (transform.is_affine
-                and np.array_equal(mapping.matrix, np.eye(mapping.matrix.ndim)) and
-                                 np.array_equal(mapping.offset, mapping.offset.astype(int)))
-
-            if not integer_shift:
-                ndim = transform.ndim
-                # Apply scale and shift for subsampling. Recall that (0,0) is the middle of
-                # the pixel, not the corner, so a shift is required as well.
-                if subsample > 1:
-                    rescale = reduce(Model.__and__, [models.Scale(subsample)] * ndim)
-                    rescale_shift = reduce(Model.__and__, [models.Shift(0.5 * (subsample - 1))] * ndim)
-                    transform.append([rescale, rescale_shift])
-
-                trans_output_shape = tuple(length * subsample for length in output_array_shape)
-                if transform.is_affine:
-                    mapping = transform.inverse.affine_matrices(shape=trans_output_shape)
-                else:
-                    # If we're conserving the flux, we need to compute the
-                    # Jacobian at every input point. This is done by numerical
-                    # derivatives so expand the output pixel grid.
-                    if conserve:
-                        self.log.warning("Flux conservation has not been fully"
-                                         "test for non-affine transforms")
-                        jacobian_shape = tuple(length + 2 for length in trans_output_shape)
-                        transform.append(reduce(Model.__and__, [models.Shift(1)] * ndim))
-                        jacobian_mapping = GeoMap(transform, jacobian_shape)
-                        det_matrices = np.empty((ndim, ndim, np.multiply.reduce(trans_output_shape)))
-                        for num_axis in range(ndim):
-                            coords = jacobian_mapping.coords[num_axis]
-                            for denom_axis in range(ndim):
-                                diff_coords = coords - np.roll(coords, 2, axis=denom_axis)
-                                slice_ = [slice(1, -1)] * ndim
-                                slice_[denom_axis] = slice(2, None)
-                                # Account for the fact that we are measuring
-                                # differences in the subsampled plane
-                                det_matrices[num_axis, denom_axis] = \
-                                    diff_coords[slice_].flatten() / (2*subsample)
-                        jfactor = 1. / abs(np.linalg.det(np.moveaxis(det_matrices, -1, 0))).reshape(trans_output_shape)
-                        # Delete the extra Shift(1) and put a better jfactor in the list
-                        del transform[-1]
-                        self.jfactors[-1] = np.mean(jfactor)
-                    mapping = GeoMap(transform, trans_output_shape)
-
-            for attr in attributes:
-                if isinstance(input_array, np.ndarray) and attr == "data":
-                    arr = input_array
-                else:  # let this raise an AttributeError
-                    arr = getattr(input_array, attr)
-
-                # Create an output array if we haven't seen this attribute yet.
-                # We only do this now so that we know the dtype.
-                cval = self.no_data.get(attr, 0)
-                if attr not in self.output_dict:
-                    self.output_dict[attr] = np.full(self.output_shape, cval, dtype=arr.dtype)
-
-                # Integer shifts mean the output will be unchanged by the
-                # transform, so we can put it straight in the output, since
-                # only this array will map into the region.
-                if integer_shift:
-                    self.log.debug("Placing {} array in [".format(attr) +
-                                   ",".join(["{}:{}".format(limits[0] + 1, limits[1])
-                                             for limits in output_corners[::-1]]) + "]")
-                    slice_ = tuple(slice(min_, max_) for min_, max_ in output_corners)
-                    self.output_dict[attr][slice_] = arr
-                    continue
-
-                # Set up the functions to call to transform this attribute
-                jobs = []
-                if np.issubdtype(arr.dtype, np.unsignedinteger):
-                    for j in range(0, 16):
-                        bit = 2**j
-                        if bit == cval or np.sum(arr & bit) > 0:
-                            key = ((attr,bit), output_corners)
-                            jobs.append((key, arr & bit, {'cval': bit & cval,
-                                                          'threshold': threshold*bit}))
-                else:
-                    key = (attr, output_corners)
-                    jobs.append((key, arr, {}))
-
-                # Perform the jobs (in parallel, if we can)
-                for (key, arr, kwargs) in jobs:
-                    args = (arr, mapping, key, output_array_shape)
-                    kwargs.update({'dtype': self.output_dict[attr].dtype,
-                                   'order': order,
-                                   'subsample': subsample,
-                                   'jfactor': jfactor})
-                    if parallel:
-                        p = multi.Process(target=self._apply_geometric_transform,
-                                          args=args, kwargs=kwargs)
-                        processes.append(p)
-                        process_keys.append(key)
-                        p.start()
+        try:
+            if self.output_shape is None:
+                self.calculate_output_shape()
+
+            self.corners = []
+            self.jfactors = []
+
+            if subsample > 1:
+                self.log.warning("Subsampling has not been fully tested")
+
+            for input_array, transform in zip(self._arrays, self._transforms):
+                # Since this may be modified, deepcopy to preserve the one if
+                # the DataGroup's _transforms list
+                transform = copy.deepcopy(transform)
+                if self.origin:
+                    transform.append(reduce(Model.__and__,
+                                     [models.Shift(-offset) for offset in self.origin[::-1]]))
+                output_corners = self._prepare_for_output(input_array,
+                                                          transform, subsample)
+                output_array_shape = tuple(max_ - min_ for min_, max_ in output_corners)
+
+                # Create a mapping from output pixel to input pixels
+                mapping = mapping_cache.affine_matrices(transform.inverse,
+                                                        output_array_shape)
+                jfactor = abs(np.linalg.det(mapping.matrix))
+                if not conserve:
+                    jfactor = 1
+                self.jfactors.append(jfactor)
+
+                integer_shift = (transform.is_affine
+                    and np.array_equal(mapping.matrix, np.eye(mapping.matrix.ndim)) and
+                                     np.array_equal(mapping.offset, mapping.offset.astype(int)))
+
+                if not integer_shift:
+                    ndim = transform.ndim
+                    # Apply scale and shift for subsampling. Recall that (0,0) is the middle of
+                    # the pixel, not the corner, so a shift is required as well.
+                    if subsample > 1:
+                        rescale = reduce(Model.__and__, [models.Scale(subsample)] * ndim)
+                        rescale_shift = reduce(Model.__and__, [models.Shift(0.5 * (subsample - 1))] * ndim)
+                        transform.append([rescale, rescale_shift])
+
+                    trans_output_shape = tuple(length * subsample for length in output_array_shape)
+                    if transform.is_affine:
+                        mapping = mapping_cache.affine_matrices(transform.inverse,
+                                                                trans_output_shape)
                     else:
-                        self._apply_geometric_transform(*args, **kwargs)
-                        self._add_to_output(key)
-
-        # If we're in parallel, we need to place the outputs into the final
-        # arrays as they finish. This should avoid hogging memory. Note that if
-        # we've applied integer shifts, the processes list will be empty so this
-        # will pass through quickly.
-        if parallel:
-            finished = False
-            while not finished:
-                finished = True
-                for p, key in zip(processes, process_keys):
-                    if not p.is_alive():
-                        if key in self.output_arrays:
+                        # If we're conserving the flux, we need to compute the
+                        # Jacobian at every input point. This is done by numerical
+                        # derivatives so expand the output pixel grid.
+                        if conserve:
+                            self.log.warning("Flux conservation has not been fully"
+                                             "test for non-affine transforms")
+                            jacobian_shape = tuple(length + 2 for length in trans_output_shape)
+                            transform.append(reduce(Model.__and__, [models.Shift(1)] * ndim))
+                            jacobian_mapping = mapping_cache.geomap(transform.inverse,
+                                                                    jacobian_shape)
+                            det_matrices = np.empty((ndim, ndim, np.multiply.reduce(trans_output_shape)))
+                            for num_axis in range(ndim):
+                                coords = jacobian_mapping.coords[num_axis]
+                                for denom_axis in range(ndim):
+                                    diff_coords = coords - np.roll(coords, 2, axis=denom_axis)
+                                    slice_ = [slice(1, -1)] * ndim
+                                    slice_[denom_axis] = slice(2, None)
+                                    # Account for the fact that we are measuring
+                                    # differences in the subsampled plane
+                                    det_matrices[num_axis, denom_axis] = \
+                                        diff_coords[slice_].flatten() / (2*subsample)
+                            jfactor = 1. / abs(np.linalg.det(np.moveaxis(det_matrices, -1, 0))).reshape(trans_output_shape)
+                            # Delete the extra Shift(1) and put a better jfactor in the list
+                            del transform[-1]
+                            self.jfactors[-1] = np.mean(jfactor)
+                        mapping = mapping_cache.geomap(transform.inverse,
+                                                       trans_output_shape)
+
+                bands = self._output_bands(output_array_shape, subsample,
+                                           memory, nworkers)
+
+                for attr in attributes:
+                    if isinstance(input_array, np.ndarray) and attr == "data":
+                        arr = input_array
+                    else:  # let this raise an AttributeError
+                        arr = getattr(input_array, attr)
+
+                    # Create an output array if we haven't seen this attribute yet.
+                    # We only do this now so that we know the dtype.
+                    cval = self.no_data.get(attr, 0)
+                    if attr not in self.output_dict:
+                        self.output_dict[attr] = self._create_output(arr.dtype, cval,
+                                                                     memmap)
+
+                    # Integer shifts mean the output will be unchanged by the
+                    # transform, so we can put it straight in the output, since
+                    # only this array will map into the region.
+                    if integer_shift:
+                        self.log.debug("Placing {} array in [".format(attr) +
+                                       ",".join(["{}:{}".format(limits[0] + 1, limits[1])
+                                                 for limits in output_corners[::-1]]) + "]")
+                        slice_ = tuple(slice(min_, max_) for min_, max_ in output_corners)
+                        self.output_dict[attr][slice_] = arr
+                        continue
+
+                    # Set up the functions to call to transform this attribute
+                    jobs = []
+                    for start, stop in bands:
+                        band_corners = (((output_corners[0][0] + start,
+                                          output_corners[0][0] + stop),) +
+                                        output_corners[1:])
+                        band_shape = (stop - start,) + output_array_shape[1:]
+                        if len(bands) == 1:
+                            band_arr, band_mapping, band_jfactor = arr, mapping, jfactor
+                        else:
+                            band_mapping, section = self._band_mapping(
+                                mapping, start * subsample, stop * subsample,
+                                trans_output_shape, arr.shape, order)
+                            band_arr = arr[section]
+                            band_jfactor = (jfactor[start * subsample:stop * subsample]
+                                            if isinstance(jfactor, np.ndarray) else jfactor)
+                        band_kwargs = {'mapping': band_mapping, 'shape': band_shape,
+                                       'jfactor': band_jfactor}
+
+                        if (np.issubdtype(arr.dtype, np.unsignedinteger) and
+                                self._single_pass_bitmask(arr, order, subsample)):
+                            key = (attr, band_corners)
+                            jobs.append((key, band_arr, dict(band_kwargs, cval=cval,
+                                        threshold=threshold, bitmask=True)))
+                        elif np.issubdtype(arr.dtype, np.unsignedinteger):
+                            bits_set = np.bitwise_or.reduce(band_arr, axis=None)
+                            for j in range(0, 16):
+                                bit = 2**j
+                                if bit == cval or bits_set & bit:
+                                    key = ((attr,bit), band_corners)
+                                    jobs.append((key, band_arr, dict(band_kwargs,
+                                                 cval=bit & cval, bit=bit,
+                                                 threshold=threshold*bit)))
+                        else:
+                            key = (attr, band_corners)
+                            jobs.append((key, band_arr, band_kwargs))
+
+                    # Perform the jobs (in parallel, if we can)
+                    for (key, arr, kwargs) in jobs:
+                        args = (arr, kwargs.pop('mapping'), key, kwargs.pop('shape'))
+                        kwargs.update({'dtype': self.output_dict[attr].dtype,
+                                       'order': order,
+                                       'subsample': subsample})
+                        if parallel:
+                            # The pool already keeps every CPU busy
+                            kwargs['num_threads'] = 1
+                            pool.apply_async(self._run_job, (finished, args, kwargs))
+                            njobs += 1
+                            # Place any outputs that are ready, to save memory
+                            while not finished.empty():
+                                njobs -= 1
+                                self._add_to_output(self._job_result(finished))
+                        else:
+                            self._apply_geometric_transform(*args, **kwargs)
                             self._add_to_output(key)
-                    else:
-                        finished = False
+
+            # If we're in parallel, we need to place the outputs into the final
+            # arrays as they finish. Only this thread writes to the final arrays,
+            # since the regions of different inputs may overlap at their edges.
+            if parallel:
+                while njobs:
+                    njobs -= 1
+                    self._add_to_output(self._job_result(finished))
+        except Exception:
+            # Wait for the jobs still running, which write into the arrays,
+            # before giving up on them
+            if parallel:
+                for _ in range(njobs):
+                    finished.get()
+            raise
 
         del self.output_arrays
         return self.output_dict
 
+    def _run_job(self, finished, args, kwargs):
+        """
+        Runs _apply_geometric_transform() in a worker thread and puts the
+        output key (or the exception raised) in the "finished" Queue
+        """
+        try:
+            self._apply_geometric_transform(*args, **kwargs)
+        except Exception as e:
+            finished.put((args[2], e))
+        else:
+            finished.put((args[2], None))
+
+    @staticmethod
+    def _job_result(finished):
+        """
+        Waits for a job to finish and returns its output key, reraising any
+        exception raised by the job
+        """
+        key, exception = finished.get()
+        if exception is not None:
+            raise exception
+        return key
+
     def _prepare_for_output(self, input_array, transform, subsample):
         """
         Determine the shape of the output array that this input will be
@@ -1080,6 +1393,109 @@ class DataGroup(object):
                                zip(new_min_coords, new_max_coords))[::-1]
         return output_corners  # in standard python order
 
+    def _create_output(self, dtype, cval, memmap=False):
+        """
+        Create an output array filled with cval, in memory or as a
+        memory-mapped temporary file (which is deleted when the array is)
+        """
+        if not memmap:
+            return np.full(self.output_shape, cval, dtype=dtype)
+        output = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+',
+                           shape=self.output_shape)
+        if cval:
+            output[:] = cval
+        return output
+
+    def _output_bands(self, shape, subsample, memory, nworkers=1):
+        """
+        Split the rows of an output region into bands whose intermediate
+        arrays fit in the available memory (with nworkers bands being
+        transformed at once).
+
+        Parameters
+        ----------
+        shape: tuple
+            shape of the output region
+        subsample: int
+            subsampling of the output region
+        memory: int/None
+            memory available, in bytes
+        nworkers: int
+            number of bands transformed at the same time
+
+        Returns
+        -------
+        list of (start, stop) row ranges
+        """
+        nrows = shape[0]
+        if memory is None or nrows == 0:
+            return [(0, nrows)]
+        bytes_per_row = (self.bytes_per_pixel * subsample ** len(shape) *
+                         int(np.multiply.reduce(shape[1:])))
+        rows_per_band = max(memory // (bytes_per_row * nworkers), 1)
+        if rows_per_band < nrows:
+            self.log.debug("Transforming in bands of {} rows".format(rows_per_band))
+        return [(start, min(start + rows_per_band, nrows))
+                for start in range(0, nrows, rows_per_band)]
+
+    @staticmethod
+    def _band_mapping(mapping, start, stop, output_shape, input_shape, order):
+        """
+        Return the mapping for rows start:stop of a (subsampled) output
+        region, and the section of the input array needed to compute them,
+        with the mapping now referring to that section. Higher-order splines
+        depend on the whole input array, so they always get all of it.
+
+        Parameters
+        ----------
+        mapping: AffineMatrices/GeoMap
+            the mapping for the whole output region
+        start, stop: int
+            rows of the band
+        output_shape: tuple
+            (subsampled) shape of the output region
+        input_shape: tuple
+            shape of the input array
+        order: int
+            order of interpolation
+
+        Returns
+        -------
+        AffineMatrices/CoordinateMap, tuple of slices
+        """
+        if isinstance(mapping, AffineMatrices):
+            offset = mapping.offset + mapping.matrix[:, 0] * start
+            band_shape = (stop - start,) + tuple(output_shape[1:])
+            corners = np.array(at.get_corners(band_shape)).T
+            coords = np.dot(mapping.matrix, corners) + offset[:, np.newaxis]
+        else:
+            coords = [coord[start:stop] for coord in mapping.coords]
+
+        if order > 1:
+            section = tuple(slice(0, length) for length in input_shape)
+        else:
+            # One extra pixel each side for linear interpolation
+            section = []
+            for coord, length in zip(coords, input_shape):
+                low = min(max(int(np.floor(np.min(coord))) - 1, 0), length - 1)
+                high = min(max(int(np.floor(np.max(coord))) + 2, low + 1), length)
+                section.append(slice(low, high))
+            section = tuple(section)
+
+        origin = [s.start for s in section]
+        if isinstance(mapping, AffineMatrices):
+            return AffineMatrices(mapping.matrix, offset - origin), section
+        return CoordinateMap([coord - low for coord, low in zip(coords, origin)]), section
+
+    @staticmethod
+    def _single_pass_bitmask(arr, order, subsample):
+        """
+        Whether a bitmask can be transformed in a single pass, by the
+        compiled routines in cytransform, rather than bit-by-bit.
+        """
+        return (arr.ndim == 2 and arr.dtype.itemsize <= 2 and
+                order in (0, 1) and subsample == 1)
+
     def _add_to_output(self, key):
         """
         Adds output_arrays[key] to the final image and deletes it from the
@@ -1108,6 +1524,13 @@ class DataGroup(object):
             else:
                 self.output_dict[attr[0]][slice_] = ((output_region & (65535 ^ cval)) |
                                                 (output_region & (arr * attr[1]))).astype(dtype)
+        elif np.issubdtype(self.output_dict[attr].dtype, np.unsignedinteger):
+            # A bitmask transformed in a single pass. As above, the no_data
+            # bit combines and-like, while the rest do it or-like
+            cval = self.no_data.get(attr, 0)
+            output_region = self.output_dict[attr][slice_]
+            self.output_dict[attr][slice_] = (((output_region | arr) & (65535 ^ cval)) |
+                                              (output_region & arr & cval))
         else:
             self.output_dict[attr][slice_] += arr
         del self.output_arrays[key]
@@ -1115,19 +1538,20 @@ class DataGroup(object):
     def _apply_geometric_transform(self, input_array, mapping, output_key,
                                    output_shape, cval=0., dtype=np.float32,
                                    threshold=None, subsample=1, order=1,
-                                   jfactor=1):
+                                   jfactor=1, bitmask=False, bit=None,
+                                   num_threads=0):
         """
-        None-returning function to apply geometric transform, so it can be used
-        by multiprocessing
+        None-returning function to apply geometric transform, so it can be run
+        in a worker thread
 
         Parameters
         ----------
         input_array: ndarray
             array to be transformed
-        mapping: callable
+        mapping: AffineMatrices/GeoMap/CoordinateMap
             provides transformation from output -> input coordinates
         output_key;
-            key in dict/DictProxy to use when storing this output array
+            key in the output_arrays dict to use when storing this output array
         output_shape: tuple
             shape of this output array
         cval: number
@@ -1143,15 +1567,43 @@ class DataGroup(object):
             order of spline interpolation
         jfactor: float/array
             Jacobian of transformation (basically the increase in pixel area)
+        bitmask: bool
+            if True, input_array is a 2D bitmask to be transformed in a single
+            pass (only for order <= 1 and no subsampling). threshold is then
+            the fraction of a pixel that needs to be flagged for each bit
+        bit: int/None
+            if set, transform only this bit of input_array (a bitmask)
+        num_threads: int
+            number of threads used to transform a bitmask in a single pass
+            (0 means one per CPU)
         """
+        if bitmask:
+            mask = input_array.astype(np.uint16, copy=False)
+            if isinstance(mapping, AffineMatrices):
+                out_array = cytransform.bitmask_affine_transform(
+                    np.ascontiguousarray(mask), mapping.matrix, mapping.offset,
+                    output_shape, order=order, threshold=threshold, cval=cval,
+                    num_threads=num_threads)
+            else:
+                out_array = cytransform.bitmask_map_coordinates(
+                    np.ascontiguousarray(mask), np.asarray(mapping.coords),
+                    order=order, threshold=threshold, cval=cval,
+                    num_threads=num_threads)
+            self.output_arrays[output_key] = out_array.astype(dtype, copy=False)
+            return
+
+        # Interpolate a single bit as float, or the output is rounded
+        if bit is not None:
+            input_array = (input_array & bit).astype(np.float32)
+
         trans_output_shape = tuple(length * subsample for length in output_shape)
-        if isinstance(mapping, GeoMap):
-            out_array = ndimage.map_coordinates(input_array, mapping.coords,
-                                                cval=cval, order=order)
-        else:
+        if isinstance(mapping, AffineMatrices):
             out_array = ndimage.affine_transform(input_array, mapping.matrix,
                                                  mapping.offset, trans_output_shape,
                                                  cval=cval, order=order)
+        else:
+            out_array = ndimage.map_coordinates(input_array, mapping.coords,
+                                                cval=cval, order=order)
 
         # We average to undo the subsampling. This retains the "threshold" and
         # conserves flux according to the Jacobian of input/output arrays.
@@ -1263,7 +1715,8 @@ class AstroDataGroup(DataGroup):
             raise ValueError("Cannot locate EXTVER {}".format(extver))
 
     def transform(self, attributes=None, order=1, subsample=1, threshold=0.01,
-                  conserve=False, parallel=False, process_objcat=False):
+                  conserve=False, parallel=False, process_objcat=False,
+                  memory=None, memmap=False):
         if attributes is None:
             attributes = [attr for attr in self.array_attributes
                           if all(getattr(ad, attr, None) is not None for ad in self._arrays)]
@@ -1280,7 +1733,8 @@ class AstroDataGroup(DataGroup):
                           "{}".format(', '.join(attributes)))
         super(AstroDataGroup, self).transform(attributes=attributes, order=order,
                                               subsample=subsample, threshold=threshold,
-                                              conserve=conserve, parallel=parallel)
+                                              conserve=conserve, parallel=parallel,
+                                              memory=memory, memmap=memmap)
 
         adout.append(self.output_dict['data'], header=ref_ext.hdr.copy())
         for key, value in self.output_dict.items():
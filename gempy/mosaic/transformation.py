@@ -8,6 +8,9 @@ __version__ = '2.0.0'
 import numpy as np
 import scipy.ndimage as nd
 
+from gempy.library import cytransform
+from gempy.library.transform import mapping_cache
+
 # ------------------------------------------------------------------------------
 DQMap = {'bad_pixel' : 1,
          'non_linear': 2,
@@ -291,6 +294,14 @@ class Transformation(object):
                        the center of rotation.
 
         """
+        # The same geometry is used for every frame, so the coordinates
+        # are cached rather than recomputed each time
+        key = ('mosaic', self.params['rotation'], self.params['shift'],
+               self.params['magnification'], tuple(imagesize))
+        self.xy_coords = mapping_cache.get(key, self._xy_coords, imagesize)
+
+    def _xy_coords(self, imagesize):
+        """Compute the input coordinates of every output pixel"""
         # Set rotation origin as the center of the image
         ycen, xcen = np.asarray(imagesize) / 2.
         xsc, ysc = self.params['magnification']
@@ -316,7 +327,7 @@ class Transformation(object):
         x_out = -xcc*cosine_x + ycc*sine_x + xcen - xshift
         y_out = -ycc*cosine_y - xcc*sine_y + ycen - yshift
 
-        self.xy_coords = np.array([y_out, x_out])
+        return np.array([y_out, x_out])
 
 
     def map_coordinates(self, image, order=None, mode=None, cval=None):
@@ -543,6 +554,17 @@ class Transformation(object):
         type: <ndarray>
 
         """
+        # Linear and nearest-neighbour interpolation can do all the bits in
+        # a single pass, as long as we're padding with a constant
+        if (self.order <= 1 and self.mode == 'constant' and mask.ndim == 2
+                and not self.notransform):
+            if not hasattr(self, 'offset'):
+                self.affine_init(mask.shape)
+            return cytransform.bitmask_affine_transform(
+                np.ascontiguousarray(mask, dtype=np.uint16), self.matrix,
+                self.offset, mask.shape, order=self.order, threshold=0.01,
+                cval=DQMap['no_data'])
+
         trans_mask = np.zeros(mask.shape, dtype=np.uint16)
         for j in range(0, 16):
             bit = 2**j
@@ -0,0 +1,181 @@
+#
+#                                                                        DRAGONS
+#
+#                                                                  cacheindex.py
+# ------------------------------------------------------------------------------
+"""
+An index of the files in the calibration cache, recording the size,
+modification time and MD5 checksum of each, so that a cached calibration
+only needs to be read to check its checksum if it has changed. The index
+is an SQLite database, in the cache root directory if one is set, or
+else in the .reducecache directory.
+
+verify_cache() re-reads every file to check it against the index.
+"""
+import hashlib
+import os
+import sqlite3
+
+from contextlib import closing
+from os.path import abspath, isfile, join
+
+from gempy.utils import logutils
+
+from geminidr import cache_file, set_caches
+from recipe_system.config import get_cache_journal_mode
+from .file_getter import CHUNK_SIZE
+# ------------------------------------------------------------------------------
+log = logutils.get_logger(__name__)
+
+INDEX_NAME = "calcache.db"
+
+# Results of verify()
+OK, UPDATED, ADDED, CORRUPTED, MISSING = ("ok", "updated", "added",
+                                          "corrupted", "missing")
+# ------------------------------------------------------------------------------
+def generate_md5_digest(filename, hash_object=False):
+    """
+    Returns the MD5 checksum of a file (as a hex digest, or the hash object
+    if hash_object is True), reading it in chunks.
+    """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5 if hash_object else md5.hexdigest()
+
+
+class CacheIndex(object):
+    """
+    Index of cached files and their checksums. Each operation uses its
+    own connection to the database, so an index can be used from several
+    threads (and processes) at once.
+
+    Parameters
+    ----------
+    path : str
+        name of the database file (created if it doesn't exist)
+    """
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode={}".format(
+                get_cache_journal_mode()))
+            conn.execute("CREATE TABLE IF NOT EXISTS files "
+                         "(path TEXT PRIMARY KEY, size INTEGER, "
+                         "mtime REAL, md5 TEXT)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _lookup(self, filename):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT size, mtime, md5 FROM files WHERE "
+                                "path=?", (abspath(filename),)).fetchone()
+
+    def md5(self, filename):
+        """
+        Returns the MD5 checksum of a file, from the index if the file's
+        size and modification time haven't changed since it was recorded,
+        otherwise by reading the file (and recording the result).
+        """
+        stat = os.stat(filename)
+        entry = self._lookup(filename)
+        if entry and entry[:2] == (stat.st_size, stat.st_mtime):
+            return entry[2]
+        md5 = generate_md5_digest(filename)
+        self.record(filename, md5, stat=stat)
+        return md5
+
+    def record(self, filename, md5, stat=None):
+        """
+        Records the checksum of a file (which must be known to be right)
+        """
+        stat = stat or os.stat(filename)
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)",
+                             (abspath(filename), stat.st_size, stat.st_mtime,
+                              md5))
+
+    def forget(self, filename):
+        """
+        Removes a file from the index
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("DELETE FROM files WHERE path=?",
+                             (abspath(filename),))
+
+    def files(self):
+        """
+        Returns the names of all the files in the index
+        """
+        with closing(self._connect()) as conn:
+            return [row[0] for row in
+                    conn.execute("SELECT path FROM files ORDER BY path")]
+
+    def verify(self, directory=None):
+        """
+        Reads every file in the index (and any others in directory and its
+        subdirectories) to check its checksum, and updates the index.
+        A file whose checksum has changed although its size and modification
+        time haven't is corrupted, and is removed from the index (so that
+        it is checked against the calibration service's checksum, and
+        downloaded again, the next time it's needed).
+
+        Parameters
+        ----------
+        directory : str, optional
+            directory whose files should be in the index
+
+        Returns
+        -------
+        list of (str, str) : the files and what was found. The result is
+        one of OK, UPDATED (size or time changed), ADDED (not in index),
+        CORRUPTED, or MISSING (in index, but not on disk)
+        """
+        filenames = self.files()
+        if directory is not None:
+            for dirpath, dirnames, files in os.walk(directory):
+                filenames.extend(abspath(join(dirpath, f)) for f in files
+                                 if not f.endswith('.part'))
+        results = []
+        for filename in sorted(set(filenames)):
+            entry = self._lookup(filename)
+            if not isfile(filename):
+                self.forget(filename)
+                results.append((filename, MISSING))
+                continue
+            stat = os.stat(filename)
+            md5 = generate_md5_digest(filename)
+            if entry is None:
+                result = ADDED
+            elif entry[:2] != (stat.st_size, stat.st_mtime):
+                result = UPDATED
+            elif entry[2] != md5:
+                result = CORRUPTED
+            else:
+                result = OK
+            if result == CORRUPTED:
+                log.warning("Cached file {} is corrupted".format(filename))
+                self.forget(filename)
+            else:
+                self.record(filename, md5, stat=stat)
+            results.append((filename, result))
+        return results
+
+
+def get_cache_index():
+    """
+    Returns the CacheIndex for the calibration cache in use
+    """
+    return CacheIndex(cache_file(INDEX_NAME))
+
+
+def verify_cache():
+    """
+    Checks all the files in the calibration cache against the index (see
+    CacheIndex.verify) and returns the results.
+    """
+    return get_cache_index().verify(set_caches()["calibrations"])
@@ -10,11 +10,14 @@ from builtins import zip
 from builtins import str
 from builtins import object
 
+import fcntl
 import hashlib
 import requests
 
-from os import mkdir
-from os.path import basename, exists
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from os import fstat, mkdir, remove, rename, stat
+from os.path import basename, exists, isdir
 from os.path import join, split
 
 from urllib.parse import urlparse
@@ -23,26 +26,142 @@ from gempy.utils import logutils
 
 from geminidr  import set_caches
 from recipe_system.cal_service import cal_search_factory, handle_returns_factory
-from .file_getter import get_file_iterator, GetterError
+from recipe_system.cal_service import is_local
+from .cacheindex import generate_md5_digest, get_cache_index
+from .file_getter import open_file_stream, GetterError, TransferInterrupted
 # ------------------------------------------------------------------------------
 log = logutils.get_logger(__name__)
 # ------------------------------------------------------------------------------
 # Currently delivers transport_request.calibration_search fn.
 calibration_search = cal_search_factory()
+
+# Default maximum number of searches, and of downloads, in progress at once
+MAX_WORKERS = 8
+
+# Descriptors that determine which calibrations are associated with a frame,
+# and so go into a request's signature (those that vary from one frame to the
+# next, like the time, data label, and offsets, are left out). Frames are
+# only grouped within an observation, so observation_id must be one of them.
+ASSOCIATION_DESCRIPTORS = set(['instrument', 'observation_id', 'program_id',
+                               'observation_type', 'observation_class',
+                               'object', 'ut_date', 'detector_name',
+                               'array_name', 'amp_read_area',
+                               'detector_roi_setting', 'detector_x_bin',
+                               'detector_y_bin', 'read_mode',
+                               'read_speed_setting', 'gain_setting',
+                               'well_depth_setting', 'coadds',
+                               'exposure_time', 'filter_name', 'disperser',
+                               'focal_plane_mask', 'central_wavelength',
+                               'camera', 'decker', 'slit', 'lyot_stop',
+                               'pupil_mask', 'gcal_lamp', 'nod_count',
+                               'shuffle_pixels'])
 # ------------------------------------------------------------------------------
-def get_request(url, filename):
-    iterator = get_file_iterator(url)
-    with open(filename, 'wb') as fd:
-        for chunk in iterator:
-            fd.write(chunk)
-    return filename
+def _lock_part(partname):
+    """
+    Opens the partial download partname (creating it if necessary) and
+    locks it, waiting for any other thread or process that is writing it
+    to finish.
 
+    Returns
+    -------
+    file : the open file, locked
+    bool : whether we had to wait for the lock
+    """
+    waited = False
+    while True:
+        fd = open(partname, 'a+b')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            log.stdinfo("Waiting for another download of {}".format(partname))
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            waited = True
+        # Whoever held the lock may have renamed or removed the file,
+        # in which case we've locked the wrong one
+        try:
+            if stat(partname).st_ino == fstat(fd.fileno()).st_ino:
+                return fd, waited
+        except OSError:
+            pass
+        fd.close()
+
+
+def get_request(url, filename, md5=None, retries=2):
+    """
+    Downloads a file. The data are written to filename + ".part", which is
+    renamed once the download is complete (and matches the MD5 checksum,
+    if one is given), so an incomplete or corrupt file never appears under
+    the final name. The checksum is calculated as the data are written.
+
+    The ".part" file is locked while it is written, so if another thread
+    or process is downloading the same file, this waits for it to finish,
+    and uses its download if it succeeded. If the transfer is interrupted
+    part way through, it is resumed from where it stopped (if the server
+    allows), up to `retries` times. A ".part" file left by an earlier call
+    is resumed in the same way. Other errors are raised immediately.
 
-def generate_md5_digest(filename):
-    md5 = hashlib.md5()
-    fdata = open(filename, 'rb').read()
-    md5.update(fdata)
-    return md5.hexdigest()
+    Parameters
+    ----------
+    url : str
+        URL of the file
+    filename : str
+        name to save it as
+    md5 : str, optional
+        expected MD5 checksum (hex digest)
+    retries : int
+        number of times to resume an interrupted transfer
+
+    Returns
+    -------
+    str : filename
+    """
+    partname = filename + '.part'
+    fd, waited = _lock_part(partname)
+    try:
+        if waited and exists(filename) and (
+                md5 is None or generate_md5_digest(filename) == md5):
+            remove(partname)
+            return filename
+        for attempt in range(retries + 1):
+            fd.seek(0, 2)
+            offset = fd.tell()
+            try:
+                start, chunks = open_file_stream(url, offset)
+                if start:
+                    digest = generate_md5_digest(partname, hash_object=True)
+                else:
+                    fd.truncate(0)
+                    digest = hashlib.md5()
+                for chunk in chunks:
+                    fd.write(chunk)
+                    digest.update(chunk)
+                fd.flush()
+            except TransferInterrupted:
+                fd.flush()
+                if attempt == retries:
+                    raise
+                log.warning("Download of {} was interrupted. Resuming.".
+                            format(url))
+            else:
+                break
+
+        if md5 is not None and digest.hexdigest() != md5:
+            remove(partname)
+            err = "MD5 hash of downloaded file does not match expected hash {}"
+            raise IOError(err.format(md5))
+        rename(partname, filename)
+    except Exception:
+        # Don't leave an empty file behind if the download never started
+        try:
+            ours = fstat(fd.fileno())
+            if ours.st_size == 0 and stat(partname).st_ino == ours.st_ino:
+                remove(partname)
+        except OSError:
+            pass
+        raise
+    finally:
+        fd.close()
+    return filename
 
 
 def _check_cache(cname, ctype):
@@ -56,11 +175,73 @@ def _check_cache(cname, ctype):
 def _makecachedir(caltype):
     cache = set_caches()
     cachedir = join(cache["calibrations"], caltype)
-    if not exists(cachedir):
+    try:
         mkdir(cachedir)
+    except OSError:
+        # Another thread or process may have made it first
+        if not isdir(cachedir):
+            raise
     return cachedir
 
 
+def _thread_map(func, items, max_workers):
+    """
+    Calls func(*item) for each item, with up to max_workers calls running
+    at once in threads, and returns the results in the order of the items.
+    If a call raises an exception, that exception is returned as its result.
+    """
+    def call(item):
+        try:
+            return func(*item)
+        except Exception as err:
+            return err
+
+    nworkers = min(max_workers, len(items))
+    if nworkers <= 1:
+        return [call(item) for item in items]
+    pool = ThreadPool(nworkers)
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _fetch_calibration(url, md5, caltype):
+    """
+    Returns the name of the cached copy of a calibration, downloading it
+    into the cache if it isn't there or its MD5 checksum doesn't match.
+    The checksums of cached files are kept in the cache index, so a file
+    is only read again if it has changed since it was checked.
+
+    Raises GetterError if the calibration could not be retrieved, and
+    IOError if the downloaded file does not match the MD5 checksum.
+    """
+    log.info("Found calibration (url): {}".format(url))
+    components = urlparse(url)
+    calname = basename(components.path)
+    cachename, cachedir = _check_cache(calname, caltype)
+    index = get_cache_index()
+    if cachename:
+        cached_md5 = index.md5(cachename)
+        if cached_md5 == md5:
+            log.stdinfo("Cached calibration {} matched.".format(cachename))
+            return cachename
+        log.stdinfo("File {} is cached but".format(calname))
+        log.stdinfo("md5 checksums DO NOT MATCH")
+        log.stdinfo("Making request on calibration service")
+        log.stdinfo("Requesting URL {}".format(url))
+        calname = get_request(url, cachename, md5)
+    else:
+        log.status("Making request for {}".format(url))
+        fname = split(url)[1]
+        calname = get_request(url, join(cachedir, fname), md5)
+        log.status("MD5 hash match. Download OK.")
+    if md5 is not None:
+        index.record(calname, md5)
+    return calname
+
+
 class CalibrationRequest(object):
     """
     Request objects are passed to a calibration_search() function
@@ -87,6 +268,28 @@ class CalibrationRequest(object):
 
         return retd
 
+    def signature(self):
+        """
+        Returns a string identifying what the calibration search depends
+        on: the caltype, tags, and ASSOCIATION_DESCRIPTORS. Requests with
+        the same signature are frames of the same observation, and are
+        matched to the same calibrations.
+
+        Note that the time isn't part of the signature, although the
+        calibration manager prefers calibrations taken close in time to a
+        frame, so the later frames of an observation are given the
+        calibration found for its first frame. A frame without an
+        observation ID isn't grouped with any other.
+        """
+        descriptors = self.descriptors or {}
+        signature = sorted((name, str(value)) for name, value in
+                           descriptors.items()
+                           if name in ASSOCIATION_DESCRIPTORS)
+        if descriptors.get('observation_id') is None:
+            signature.append(('data_label', str(self.datalabel)))
+        canonical = repr((self.caltype, sorted(self.tags), signature))
+        return hashlib.md5(canonical.encode('utf-8')).hexdigest()
+
     def __str__(self):
         tempStr = "filename: {}\nDescriptors: {}\nTypes: {}"
         tempStr = tempStr.format(self.filename, self.descriptors, self.tags)
@@ -119,31 +322,33 @@ def get_cal_requests(inputs, caltype):
     rq_events = []
     for ad in inputs:
         log.stdinfo("Recieved calibration request for {}".format(ad.filename))
-        rq = CalibrationRequest(ad, caltype)
-        # Check that each descriptor works and returns a sensible value.
-        desc_dict = {}
-        for desc_name in ad.descriptors:
-            try:
-                descriptor = getattr(ad, desc_name)
-            except AttributeError:
-                pass
-            else:
-                kwargs = options[desc_name] if desc_name in list(options.keys()) else {}
+        # Descriptors call each other a lot, so memoise them for the sweep
+        with ad.memoized_descriptors():
+            rq = CalibrationRequest(ad, caltype)
+            # Check that each descriptor works and returns a sensible value.
+            desc_dict = {}
+            for desc_name in ad.descriptors:
                 try:
-                    dv = _handle_returns(descriptor(**kwargs))
-                except:
-                    dv = None
-                # Munge list to value if all item(s) are the same
-                if isinstance(dv, list):
-                    dv = dv[0] if all(v == dv[0] for v in dv) else "+".join(
-                        [str(v) for v in dv])
-                desc_dict[desc_name] = dv
+                    descriptor = getattr(ad, desc_name)
+                except AttributeError:
+                    pass
+                else:
+                    kwargs = options[desc_name] if desc_name in list(options.keys()) else {}
+                    try:
+                        dv = _handle_returns(descriptor(**kwargs))
+                    except:
+                        dv = None
+                    # Munge list to value if all item(s) are the same
+                    if isinstance(dv, list):
+                        dv = dv[0] if all(v == dv[0] for v in dv) else "+".join(
+                            [str(v) for v in dv])
+                    desc_dict[desc_name] = dv
         rq.descriptors = desc_dict
         rq_events.append(rq)
     return rq_events
 
 
-def process_cal_requests(cal_requests, howmany=None):
+def process_cal_requests(cal_requests, howmany=None, max_workers=None):
     """
     Conduct a search for calibration files for the passed list of calibration
     requests. This passes the requests to the calibration_search() function,
@@ -158,6 +363,14 @@ def process_cal_requests(cal_requests, howmany=None):
     returned in the dictionary structure. A path of 'None' indicates that no
     calibration match was found.
 
+    Requests with the same signature (see CalibrationRequest.signature),
+    i.e., frames of the same observation, are only searched for once, and
+    the result (the calibration for the first of them) is used for all.
+    The searches are made concurrently, as are the downloads, with up to
+    max_workers of each in progress at once. A calibration matched by
+    several requests is only checked and downloaded once. (The local
+    calibration manager is always searched one request at a time.)
+
     Parameters
     ----------
     cal_requests : list
@@ -167,6 +380,10 @@ def process_cal_requests(cal_requests, howmany=None):
         Maximum number of calibrations to return per request
         (not passed to the server-side request but trims the returned list)
 
+    max_workers : int, optional
+        Maximum number of searches, and of downloads, in progress at once
+        (default MAX_WORKERS; 1 handles the requests one after another)
+
     Returns
     -------
     calibration_records : dict
@@ -183,70 +400,73 @@ def process_cal_requests(cal_requests, howmany=None):
 
     """
     calibration_records = {}
+    max_workers = max_workers or MAX_WORKERS
 
     def _add_cal_record(rq, calfile):
         calibration_records.update({rq.ad: calfile})
         return
 
     cache = set_caches()
+    groups = OrderedDict()
     for rq in cal_requests:
-        calname = None
-        calmd5 = None
-        calurl = None
-        calurl, calmd5 = calibration_search(rq, howmany=(howmany if howmany else 1))
+        groups.setdefault(rq.signature(), []).append(rq)
+    if len(groups) < len(cal_requests):
+        log.stdinfo("{} calibration requests have {} distinct signatures".
+                    format(len(cal_requests), len(groups)))
+    searches = _thread_map(calibration_search,
+                           [(group[0], howmany if howmany else 1)
+                            for group in groups.values()],
+                           1 if is_local() else max_workers)
+
+    # Each calibration only needs to be fetched once, however many
+    # requests it matches
+    found = {}
+    fetches = []
+    for group, search in zip(groups.values(), searches):
+        if isinstance(search, Exception):
+            for rq in group:
+                log.error("Calibration search for {} failed: {}".format(
+                    rq.filename, search))
+            continue
+        calurl, calmd5 = search
         if calurl is None:
             log.error("START CALIBRATION SERVICE REPORT\n")
             log.error(calmd5)
             log.error("END CALIBRATION SERVICE REPORT\n")
             warn = "No {} calibration file found for {}"
-            log.warning(warn.format(rq.caltype, rq.filename))
-            #_add_cal_record(rq, calname)
+            for rq in group:
+                log.warning(warn.format(rq.caltype, rq.filename))
             continue
-
+        for rq in group:
+            found[rq] = [(url, md5, rq.caltype)
+                         for url, md5 in zip(calurl, calmd5)]
+        for fetch in found[group[0]]:
+            if fetch not in fetches:
+                fetches.append(fetch)
+    calfiles = dict(zip(fetches, _thread_map(_fetch_calibration, fetches,
+                                             max_workers)))
+
+    fetch_errors = []
+    for rq in cal_requests:
         calibs = []
-        for url, md5 in zip(calurl, calmd5):
-            log.info("Found calibration (url): {}".format(url))
-            components = urlparse(url)
-            calname = basename(components.path)
-            cachename, cachedir = _check_cache(calname, rq.caltype)
-            if cachename:
-                cached_md5 = generate_md5_digest(cachename)
-                if cached_md5 == md5:
-                    log.stdinfo("Cached calibration {} matched.".format(cachename))
-                    calibs.append(cachename)
-                else:
-                    log.stdinfo("File {} is cached but".format(calname))
-                    log.stdinfo("md5 checksums DO NOT MATCH")
-                    log.stdinfo("Making request on calibration service")
-                    log.stdinfo("Requesting URL {}".format(url))
-                    try:
-                        calname = get_request(url, cachename)
-                        calibs.append(cachename)
-                    except GetterError as err:
-                        for message in err.messages:
-                            log.error(message)
-                continue
-
-            log.status("Making request for {}".format(url))
-            fname = split(url)[1]
-            calname = join(cachedir, fname)
-            try:
-                calname = get_request(url, calname)
-            except GetterError as err:
-                for message in err.messages:
+        for fetch in found.get(rq, []):
+            calfile = calfiles[fetch]
+            if isinstance(calfile, GetterError):
+                for message in calfile.messages:
                     log.error(message)
+            elif isinstance(calfile, Exception):
+                log.error("Could not get calibration {} for {}: {}".format(
+                    fetch[0], rq.filename, calfile))
+                if calfile not in fetch_errors:
+                    fetch_errors.append(calfile)
             else:
-                # hash compare
-                download_mdf5 = generate_md5_digest(calname)
-                if download_mdf5 == md5:
-                    log.status("MD5 hash match. Download OK.")
-                    calibs.append(calname)
-                else:
-                    err = "MD5 hash of downloaded file does not match expected hash {}"
-                    raise IOError(err.format(md5))
+                calibs.append(calfile)
 
         # If howmany=None, append the only file as a string, instead of the list
         if calibs:
             _add_cal_record(rq, calibs if howmany else calibs[0])
 
+    # Only raise an error when all the requests have been dealt with
+    if fetch_errors:
+        raise fetch_errors[0]
     return calibration_records
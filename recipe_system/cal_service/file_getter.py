@@ -1,39 +1,80 @@
 from builtins import str
+import os
 import requests
 from requests.exceptions import HTTPError
 from requests.exceptions import Timeout
 from requests.exceptions import ConnectionError
+from requests.exceptions import RequestException
 
 from gempy.utils import logutils
 
+# Size of the pieces in which files are read and written
+CHUNK_SIZE = 1 << 20
+
 class GetterError(Exception):
     def __init__(self, messages):
         self.messages = messages
 
-def requests_getter(url):
-    r = requests.get(url, timeout=10.0)
+class TransferInterrupted(GetterError):
+    """A transfer that started, but broke before all the data arrived"""
+    pass
+
+def _iter_response(r, url):
     try:
-        r.raise_for_status()
-        for chunk in r.iter_content(chunk_size=128):
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
             yield chunk
+    except RequestException as err:
+        raise TransferInterrupted(["Transfer of {} was interrupted".format(url),
+                                   str(err)])
+    finally:
+        r.close()
+
+def requests_getter(url, offset=0):
+    """
+    Starts a download, from the given byte offset if the server allows it.
+    Returns the offset at which the data start (0 if the server sends the
+    whole file) and an iterator over the data.
+    """
+    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+    try:
+        r = requests.get(url, timeout=10.0, stream=True, headers=headers)
+        if offset and r.status_code == 416:
+            # The offset is beyond the end of the file, so start again
+            r.close()
+            return requests_getter(url)
+        r.raise_for_status()
     except HTTPError as err:
         raise GetterError(["Could not retrieve {}".format(url), str(err)])
     except ConnectionError as err:
         raise GetterError(["Unable to connect to url {}".format(url), str(err)])
     except Timeout as terr:
         raise GetterError(["Request timed out", str(terr)])
+    start = offset if r.status_code == 206 else 0
+    return start, _iter_response(r, url)
 
-def plain_file_getter(url):
+def plain_file_getter(url, offset=0):
+    """
+    Like requests_getter(), for a local file
+    """
     path = url.split('://', 1)[1]
+
+    def read(start):
+        try:
+            with open(path, 'rb') as source:
+                source.seek(start)
+                while True:
+                    data = source.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    yield data
+        except Exception as err:
+            raise GetterError(["Problem accessing to {}".format(url), str(err)])
+
     try:
-        with open(path) as source:
-            while True:
-                data = source.read(128)
-                if not data:
-                    break
-                yield data
-    except Exception as err:
+        start = offset if offset <= os.path.getsize(path) else 0
+    except OSError as err:
         raise GetterError(["Problem accessing to {}".format(url), str(err)])
+    return start, read(start)
 
 schema_mapper = {
     'http': requests_getter,
@@ -42,6 +83,21 @@ schema_mapper = {
     'file': plain_file_getter
     }
 
-def get_file_iterator(url):
+def open_file_stream(url, offset=0):
+    """
+    Starts reading a file from a URL, from the given byte offset if
+    possible.
+
+    Returns
+    -------
+    start : int
+        offset of the first byte that will be returned (either the
+        requested offset, or 0 if the file can only be read from the start)
+    iterator
+        the data, in chunks of up to CHUNK_SIZE bytes
+    """
     getter = schema_mapper[url.split('://', 1)[0]]
-    return getter(url)
+    return getter(url, offset)
+
+def get_file_iterator(url):
+    return open_file_stream(url)[1]
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Tests for the Calibrations store shared by reduce processes
+"""
+import gc
+import os
+import sqlite3
+import weakref
+
+import pytest
+
+from multiprocessing import Process
+
+import geminidr
+
+from geminidr import CALINDEX, Calibrations, cache_file
+from recipe_system.config import get_cache_journal_mode, get_cache_root
+
+
+class FakeAD(object):
+    def __init__(self, label):
+        self.label = label
+
+    def calibration_key(self):
+        return self.label
+
+
+def add_cals(calindfile, first, number):
+    calibs = Calibrations(calindfile)
+    for i in range(first, first + number):
+        calibs[FakeAD('N{}'.format(i)),
+               'processed_bias'] = 'bias{}.fits'.format(i)
+        if i % 10 == 0:
+            calibs.cache_to_disk()
+    # Child processes end without calling the atexit functions
+    calibs.cache_to_disk()
+
+
+@pytest.fixture
+def calindfile(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    return str(tmpdir.join(CALINDEX))
+
+
+def test_calibrations(calindfile, tmpdir):
+    calibs = Calibrations(calindfile)
+    ad1, ad2 = FakeAD('N1'), FakeAD('N2')
+    calibs[ad1, 'processed_bias'] = 'bias.fits'
+    calibs[ad2, 'processed_flat'] = ['flat1.fits', 'flat2.fits']
+    calibs.add_group_cals('processed_bias', {'abcd': 'bias.fits'})
+    assert calibs[ad1, 'processed_bias'] == str(tmpdir.join('bias.fits'))
+
+    # Other processes see the associations once they've been written
+    calibs[ad1, 'processed_dark'] = 'dark.fits'
+    other = Calibrations(calindfile)
+    assert other[ad2, 'processed_flat'] == [str(tmpdir.join('flat1.fits')),
+                                            str(tmpdir.join('flat2.fits'))]
+    assert other.get_group_cal('abcd', 'processed_bias') == str(
+        tmpdir.join('bias.fits'))
+    assert other.get_group_cal('abcd', 'processed_flat') is None
+    assert other[ad1, 'processed_dark'] is None
+    del calibs[ad1, 'processed_bias']
+    calibs.cache_to_disk()
+    assert other[ad1, 'processed_bias'] is None
+    assert other[ad1, 'processed_dark'] == str(tmpdir.join('dark.fits'))
+
+    # User calibrations take precedence
+    user = Calibrations(calindfile, user_cals={('N2', 'processed_flat'):
+                                                   'myflat.fits'})
+    assert user[ad2, 'processed_flat'] == 'myflat.fits'
+
+
+def test_calibrations_concurrent(calindfile):
+    # No process loses the associations made by the others
+    procs = [Process(target=add_cals, args=(calindfile, i * 1000, 250))
+             for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    calibs = Calibrations(calindfile)
+    for i in range(4):
+        for j in range(i * 1000, i * 1000 + 250):
+            assert calibs[FakeAD('N{}'.format(j)), 'processed_bias'].endswith(
+                'bias{}.fits'.format(j))
+
+
+def test_cache_root(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.delenv('_GEM_CACHE_ROOT', raising=False)
+    if get_cache_root() is None:
+        assert cache_file(CALINDEX) == os.path.join('.reducecache', CALINDEX)
+    root = str(tmpdir.join('shared', 'cache'))
+    monkeypatch.setenv('_GEM_CACHE_ROOT', root)
+    assert get_cache_root() == root
+    assert cache_file(CALINDEX) == os.path.join(root, CALINDEX)
+    assert os.path.isdir(root)
+
+
+def journal_mode(filename):
+    conn = sqlite3.connect(filename)
+    try:
+        return conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_journal_mode(tmpdir, monkeypatch):
+    # Write-ahead logging isn't used in a cache root unless asked for,
+    # since it may be on a network filesystem
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.delenv('_GEM_CACHE_JOURNAL_MODE', raising=False)
+    root = str(tmpdir.join('shared'))
+    monkeypatch.setenv('_GEM_CACHE_ROOT', root)
+    assert get_cache_journal_mode() == 'delete'
+    Calibrations(cache_file(CALINDEX))
+    assert journal_mode(os.path.join(root, CALINDEX)) == 'delete'
+
+    monkeypatch.setenv('_GEM_CACHE_JOURNAL_MODE', 'WAL')
+    Calibrations(cache_file('other.db'))
+    assert journal_mode(os.path.join(root, 'other.db')) == 'wal'
+
+    monkeypatch.setenv('_GEM_CACHE_JOURNAL_MODE', 'fast')
+    with pytest.raises(ValueError):
+        get_cache_journal_mode()
+
+    monkeypatch.delenv('_GEM_CACHE_JOURNAL_MODE')
+    monkeypatch.delenv('_GEM_CACHE_ROOT')
+    if get_cache_root() is None:
+        assert get_cache_journal_mode() == 'wal'
+
+
+def test_calibrations_at_exit(calindfile):
+    # New associations are written at exit, without keeping the
+    # Calibrations alive
+    calibs = Calibrations(calindfile)
+    calibs[FakeAD('N1'), 'processed_bias'] = 'bias.fits'
+    geminidr._cache_all_to_disk()
+    assert Calibrations(calindfile)[FakeAD('N1'),
+                                    'processed_bias'].endswith('bias.fits')
+    ref = weakref.ref(calibs)
+    del calibs
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+"""
+Tests for process_cal_requests, with a local HTTP server standing in for
+the calibration manager and the archive.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import astrodata
+import gemini_instruments
+
+from recipe_system.cal_service import (cacheindex, calrequestlib,
+                                      transport_request)
+from recipe_system.cal_service.cacheindex import generate_md5_digest
+from recipe_system.cal_service.file_getter import (GetterError,
+                                                   TransferInterrupted)
+from recipe_system.cal_service.calrequestlib import (CalibrationRequest,
+                                                     get_request,
+                                                     process_cal_requests)
+
+CALFILES = {'bias1.fits': b'first bias' * 1000,
+            'bias2.fits': b'second bias' * 1000,
+            'bad.fits': b'not what was expected',
+            'flat.fits': os.urandom(3000000)}
+
+RESPONSE = """<?xml version="1.0" ?>
+<dataset><calibration><caltype>bias</caltype>
+<url>{url}</url><md5>{md5}</md5></calibration></dataset>"""
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CalServer(object):
+    """Calibration manager and archive, keeping track of the requests"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = self.max_running = 0
+        self.downloads = []
+        self.searches = []
+        self.ranges = []
+        # Files whose next download will be cut off half way through
+        self.interrupt = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _start(self):
+                with server.lock:
+                    server.running += 1
+                    server.max_running = max(server.running,
+                                             server.max_running)
+                time.sleep(0.05)
+                with server.lock:
+                    server.running -= 1
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                self._start()
+                # Requests for files "N...S000<n>" are matched by bias<n%2+1>
+                # and the rest by whatever file they're named after
+                filename = self.path.split('/')[-1][:-5]
+                with server.lock:
+                    server.searches.append(filename)
+                calname = ('bias{}.fits'.format(int(filename[-1]) % 2 + 1)
+                           if filename[-1].isdigit() else filename + '.fits')
+                md5 = hashlib.md5(CALFILES.get(calname, b'')).hexdigest()
+                if calname == 'bad.fits':
+                    md5 = hashlib.md5(b'').hexdigest()
+                body = RESPONSE.format(url=server.url + '/file/' + calname,
+                                       md5=md5).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._start()
+                calname = self.path.split('/')[-1]
+                with server.lock:
+                    server.downloads.append(calname)
+                if calname not in CALFILES:
+                    self.send_error(404)
+                    return
+                data = CALFILES[calname]
+                start = 0
+                if 'Range' in self.headers:
+                    start = int(self.headers['Range'][6:-1])
+                    server.ranges.append(start)
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                        start, len(data) - 1, len(data)))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(data) - start))
+                self.end_headers()
+                if calname in server.interrupt:
+                    server.interrupt.remove(calname)
+                    self.wfile.write(data[start:start + len(data) // 2])
+                    return
+                self.wfile.write(data[start:])
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reset(self):
+        self.max_running = 0
+        self.downloads = []
+        self.searches = []
+        self.ranges = []
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeAD(object):
+    tags = set(['GMOS', 'IMAGE'])
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def data_label(self):
+        return self.filename[:-5]
+
+
+@pytest.fixture
+def calserver(tmpdir, monkeypatch):
+    server = CalServer()
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setenv('no_proxy', '127.0.0.1')
+    monkeypatch.setattr(transport_request, '_CALMGR', server.url + '/calmgr')
+    monkeypatch.setattr(calrequestlib, 'calibration_search',
+                        transport_request.calibration_search)
+    monkeypatch.setattr(calrequestlib, 'is_local', lambda: False)
+    yield server
+    server.shutdown()
+
+
+def make_requests(filenames, distinct=False, **descriptors):
+    """Requests for frames, which all have different signatures if distinct"""
+    requests = []
+    for i, filename in enumerate(filenames):
+        rq = CalibrationRequest(FakeAD(filename), 'processed_bias')
+        rq.descriptors = {'instrument': 'GMOS-N', 'data_label': filename[:-5],
+                          'observation_id': 'GN-2018A-Q-1-1'}
+        if distinct:
+            rq.descriptors['exposure_time'] = i
+        rq.descriptors.update(descriptors)
+        requests.append(rq)
+    return requests
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_process_cal_requests(calserver, tmpdir, max_workers):
+    requests = make_requests(['N20180101S{:04d}.fits'.format(i)
+                              for i in range(12)], distinct=True)
+    records = process_cal_requests(requests, max_workers=max_workers)
+    for rq in requests:
+        assert records[rq.ad].endswith('bias{}.fits'.format(
+            int(rq.filename[-6]) % 2 + 1))
+        assert tmpdir.join(records[rq.ad]).read('rb') == CALFILES[
+            records[rq.ad].split('/')[-1]]
+    # Each calibration is only downloaded once
+    assert sorted(calserver.downloads) == ['bias1.fits', 'bias2.fits']
+    assert calserver.max_running <= max_workers
+    assert calserver.max_running > 1 or max_workers == 1
+
+    # and not at all when it's in the cache
+    calserver.reset()
+    assert process_cal_requests(requests, max_workers=max_workers) == records
+    assert calserver.downloads == []
+
+
+def test_process_cal_requests_errors(calserver, tmpdir):
+    requests = make_requests(['N20180101S0001.fits', 'missing.fits',
+                              'N20180101S0002.fits'], distinct=True)
+    records = process_cal_requests(requests, max_workers=4)
+    # A failed download only affects its own request
+    assert set(records) == {requests[0].ad, requests[2].ad}
+
+    # A download that doesn't match its checksum is an error, but only once
+    # all the requests have been dealt with
+    calserver.reset()
+    tmpdir.join('calibrations').remove()
+    requests = make_requests(['bad.fits', 'N20180101S0003.fits'],
+                             distinct=True)
+    with pytest.raises(IOError):
+        process_cal_requests(requests, max_workers=4)
+    assert sorted(calserver.downloads) == ['bad.fits', 'bias2.fits']
+    # and the bad file isn't put in the cache
+    assert sorted(tmpdir.join('calibrations', 'processed_bias').listdir()) == [
+        tmpdir.join('calibrations', 'processed_bias', 'bias2.fits')]
+
+
+def test_signature():
+    rq1, rq2 = make_requests(['N20180101S0001.fits', 'N20180101S0002.fits'],
+                             ut_datetime='whenever')
+    # Frame-specific descriptors don't matter
+    assert rq1.signature() == rq2.signature()
+    rq2.descriptors['ut_datetime'] = 'later'
+    assert rq1.signature() == rq2.signature()
+    rq2.descriptors['exposure_time'] = 10.
+    assert rq1.signature() != rq2.signature()
+    rq2, = make_requests(['N20180101S0002.fits'])
+    rq2.caltype = 'processed_flat'
+    assert rq1.signature() != rq2.signature()
+    # Frames are only grouped within an observation
+    rq2, = make_requests(['N20180101S0002.fits'],
+                         observation_id='GN-2018A-Q-1-2')
+    assert rq1.signature() != rq2.signature()
+    rq1.descriptors['observation_id'] = rq2.descriptors['observation_id'] = None
+    rq2.descriptors['exposure_time'] = None
+    assert rq1.signature() != rq2.signature()
+
+
+def make_frame(path, obsid, index, offsets, exptime=30.):
+    """The index'th GMOS-N frame of the night, of an observation"""
+    phu = fits.PrimaryHDU()
+    phu.header.update({'INSTRUME': 'GMOS-N', 'TELESCOP': 'Gemini-North',
+                       'OBSID': obsid,
+                       'DATALAB': '{}-{:03d}'.format(obsid, index),
+                       'OBSEPOCH': 2018.0 + index * 1e-5,
+                       'DATE-OBS': '2018-01-01',
+                       'TIME-OBS': '10:{:02d}:00'.format(index),
+                       'OBSTYPE': 'OBJECT', 'OBSCLASS': 'science',
+                       'EXPTIME': exptime, 'FILTER1': 'r_G0303',
+                       'FILTER2': 'open2-8', 'DETTYPE': 'S10892-N',
+                       'XOFFSET': offsets[0], 'YOFFSET': offsets[1],
+                       'POFFSET': offsets[0], 'QOFFSET': offsets[1]})
+    sci = fits.ImageHDU(np.zeros((8, 8), dtype=np.float32), name='SCI')
+    sci.header.update({'CCDSUM': '2 2', 'DETSEC': '[1:16,1:16]',
+                       'DATASEC': '[1:8,1:8]', 'CCDSEC': '[1:16,1:16]'})
+    fits.HDUList([phu, sci]).writeto(path)
+    return astrodata.open(path)
+
+
+def test_signature_frames(tmpdir):
+    # Dithered frames of one observation have the same signature, but
+    # not frames of different observations or settings
+    ads = [make_frame(str(tmpdir.join('N20180101S{:04d}.fits'.format(i))),
+                      obsid, i, offsets, exptime)
+           for i, (obsid, offsets, exptime) in enumerate([
+               ('GN-2018A-Q-1-1', (0., 0.), 30.),
+               ('GN-2018A-Q-1-1', (10., -5.), 30.),
+               ('GN-2018A-Q-1-2', (0., 0.), 30.),
+               ('GN-2018A-Q-1-1', (0., 0.), 60.)])]
+    requests = calrequestlib.get_cal_requests(ads, 'processed_bias')
+    frame_descriptors = ('calibration_key', 'observation_epoch',
+                         'ut_datetime', 'detector_x_offset',
+                         'telescope_x_offset')
+    for name in frame_descriptors:
+        assert (requests[0].descriptors[name] !=
+                requests[1].descriptors[name]), name
+    signatures = [rq.signature() for rq in requests]
+    assert signatures[0] == signatures[1]
+    assert len(set(signatures)) == 3
+
+
+def test_process_cal_requests_grouped(calserver):
+    # Requests with the same signature are only searched for once
+    requests = make_requests(['N20180101S{:04d}.fits'.format(i)
+                              for i in range(12)])
+    records = process_cal_requests(requests, max_workers=4)
+    assert calserver.searches == ['N20180101S0000']
+    assert set(records.values()) == {'calibrations/processed_bias/bias1.fits'}
+    assert len(records) == 12
+
+
+def test_get_request_resume(calserver, tmpdir):
+    url = calserver.url + '/file/flat.fits'
+    md5 = hashlib.md5(CALFILES['flat.fits']).hexdigest()
+    # An interrupted download is resumed from where it stopped
+    calserver.interrupt.add('flat.fits')
+    assert get_request(url, 'flat.fits', md5) == 'flat.fits'
+    assert tmpdir.join('flat.fits').read('rb') == CALFILES['flat.fits']
+    assert len(calserver.ranges) == 1
+    assert 0 < calserver.ranges[0] <= len(CALFILES['flat.fits']) // 2
+    assert tmpdir.listdir() == [tmpdir.join('flat.fits')]
+
+    # as is one left by an earlier failed call
+    calserver.reset()
+    calserver.interrupt.add('flat.fits')
+    with pytest.raises(GetterError):
+        get_request(url, 'flat2.fits', md5, retries=0)
+    assert not tmpdir.join('flat2.fits').exists()
+    get_request(url, 'flat2.fits', md5)
+    assert tmpdir.join('flat2.fits').read('rb') == CALFILES['flat.fits']
+    assert len(calserver.ranges) == 1
+    assert 0 < calserver.ranges[0] <= len(CALFILES['flat.fits']) // 2
+
+    # A file that doesn't match its checksum is removed
+    with pytest.raises(IOError):
+        get_request(url, 'flat3.fits', md5='0' * 32)
+    assert not tmpdir.join('flat3.fits').exists()
+    assert not tmpdir.join('flat3.fits.part').exists()
+
+
+def test_get_request_errors(calserver, tmpdir):
+    # Only transfers that break part way through are retried
+    with pytest.raises(GetterError) as err:
+        get_request(calserver.url + '/file/missing.fits', 'missing.fits')
+    assert not isinstance(err.value, TransferInterrupted)
+    assert calserver.downloads == ['missing.fits']
+    assert tmpdir.listdir() == []
+
+
+def test_get_request_concurrent(calserver, tmpdir):
+    # A file being downloaded by another thread (or process) isn't written
+    # to, or downloaded again
+    url = calserver.url + '/file/flat.fits'
+    md5 = hashlib.md5(CALFILES['flat.fits']).hexdigest()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        get_request(url, 'flat.fits', md5))) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['flat.fits'] * 4
+    assert tmpdir.join('flat.fits').read('rb') == CALFILES['flat.fits']
+    assert calserver.downloads == ['flat.fits']
+    assert tmpdir.listdir() == [tmpdir.join('flat.fits')]
+
+
+def test_get_request_file(tmpdir):
+    source = tmpdir.join('source.fits')
+    source.write(CALFILES['flat.fits'], 'wb')
+    md5 = hashlib.md5(CALFILES['flat.fits']).hexdigest()
+    target = str(tmpdir.join('target.fits'))
+    get_request('file://' + str(source), target, md5)
+    assert tmpdir.join('target.fits').read('rb') == CALFILES['flat.fits']
+
+
+def test_cache_index(calserver, tmpdir, monkeypatch):
+    requests = make_requests(['N20180101S0001.fits', 'N20180101S0002.fits'],
+                             distinct=True)
+    records = process_cal_requests(requests)
+    bias1 = tmpdir.join(records[requests[1].ad])
+
+    # Cached files are not read again unless they have changed
+    hashed = []
+    def md5_digest(filename, hash_object=False):
+        hashed.append(os.path.basename(filename))
+        return generate_md5_digest(filename, hash_object)
+    monkeypatch.setattr(cacheindex, 'generate_md5_digest', md5_digest)
+    calserver.reset()
+    assert process_cal_requests(requests) == records
+    assert hashed == [] and calserver.downloads == []
+
+    os.utime(str(bias1), (1e9, 1e9))
+    assert process_cal_requests(requests) == records
+    assert hashed == ['bias1.fits'] and calserver.downloads == []
+
+    # A file corrupted without changing its size or time is found by
+    # verify_cache(), and downloaded again when next needed
+    stat = os.stat(str(bias1))
+    bias1.write(b'x' * stat.st_size, 'wb')
+    os.utime(str(bias1), (stat.st_atime, stat.st_mtime))
+    tmpdir.join('calibrations', 'processed_bias', 'extra.fits').write('extra')
+    results = dict(cacheindex.verify_cache())
+    assert results[str(bias1)] == cacheindex.CORRUPTED
+    assert set(results.values()) == {cacheindex.OK, cacheindex.CORRUPTED,
+                                     cacheindex.ADDED}
+    assert process_cal_requests(requests) == records
+    assert calserver.downloads == ['bias1.fits']
+    assert bias1.read('rb') == CALFILES['bias1.fits']
+
+    bias1.remove()
+    assert dict(cacheindex.verify_cache())[str(bias1)] == cacheindex.MISSING
+    assert str(bias1) not in cacheindex.get_cache_index().files()
@@ -32,6 +32,9 @@ __version__ = '2.0'
 DEFAULT_DIRECTORY = '~/.geminidr'
 STANDARD_REDUCTION_CONF = '~/.geminidr/rsys.cfg'
 
+# Config section for the caches that can be shared by reduce processes
+CACHE_SECTION = 'cache'
+
 
 class ConfigObject(object):
     """
@@ -277,3 +280,77 @@ def environment_variable_name(section, option):
 
 
 globalConf = ConfigObject()
+globalConf.update_exports({
+    CACHE_SECTION: ('root', 'journal_mode')
+})
+
+# SQLite journal modes that can be used for the shared caches
+JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist')
+
+
+def _get_cache_option(option):
+    # The option from the [cache] section, or None if it isn't set
+    env = os.environ.get(environment_variable_name(CACHE_SECTION, option))
+    if env:
+        return env
+    try:
+        section = globalConf[CACHE_SECTION]
+    except KeyError:
+        # Read the section from the config file without reloading the others,
+        # which may have been modified since they were loaded
+        conf = ConfigObject()
+        conf.load(STANDARD_REDUCTION_CONF,
+                  defaults={CACHE_SECTION: {'root': None,
+                                            'journal_mode': None}})
+        globalConf.update(CACHE_SECTION, conf[CACHE_SECTION].as_dict())
+        section = globalConf[CACHE_SECTION]
+    return getattr(section, option, None) or None
+
+
+def get_cache_root():
+    """
+    Returns the directory where the caches shared by reduce processes (such
+    as the calibration associations) are kept. This is set by the 'root'
+    option of the [cache] section of the config file::
+
+        [cache]
+        root = /shared/storage/reducecache
+
+    which the _GEM_CACHE_ROOT environment variable overrides.
+
+    Returns
+    -------
+    str/None
+        the cache root, or None if not set, in which case each working
+        directory has its own caches
+    """
+    root = _get_cache_option('root')
+    return None if root is None else os.path.expanduser(root)
+
+
+def get_cache_journal_mode():
+    """
+    Returns the SQLite journal mode of the databases in the shared caches.
+    This is set by the 'journal_mode' option of the [cache] section of the
+    config file (or the _GEM_CACHE_JOURNAL_MODE environment variable).
+
+    Write-ahead logging ("wal") lets processes read a database while
+    another writes to it, but only works if they all run on the same
+    host, so it is the default only when there is no cache root. When
+    there is a root, which may be on a network filesystem, the default is
+    the rollback journal ("delete"); set journal_mode = wal if all the
+    reduce processes run on one host.
+
+    Returns
+    -------
+    str
+        one of JOURNAL_MODES
+    """
+    mode = _get_cache_option('journal_mode')
+    if mode is None:
+        return 'wal' if get_cache_root() is None else 'delete'
+    mode = mode.lower()
+    if mode not in JOURNAL_MODES:
+        raise ValueError("Cache journal_mode must be one of {}, not {!r}"
+                         .format(", ".join(JOURNAL_MODES), mode))
+    return mode
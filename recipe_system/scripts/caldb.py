@@ -16,6 +16,7 @@ from functools import partial
 
 from recipe_system.config import globalConf, STANDARD_REDUCTION_CONF
 from recipe_system.cal_service import load_calconf, update_calconf, get_calconf
+from recipe_system.cal_service.cacheindex import verify_cache, OK, CORRUPTED
 from recipe_system.cal_service.localmanager import LocalManager, LocalManagerError
 from recipe_system.cal_service.localmanager import ERROR_CANT_WIPE, ERROR_CANT_CREATE
 from recipe_system.cal_service.localmanager import ERROR_CANT_READ, ERROR_DIDNT_FIND
@@ -52,6 +53,15 @@ def buildArgumentParser():
     p_remove.add_argument('files', metavar='filenames', nargs='+',
                           help="FITS file names. Paths will be disregarded.")
 
+    p_verify = sub.add_parser('verify', help="Check the MD5 checksums of all "
+                              "the files in the calibration cache of the "
+                              "current directory, and update the cache index. "
+                              "Corrupted files will be downloaded again when "
+                              "they are next needed.")
+    p_verify.add_argument('-v', '--verbose', dest='verbose',
+                          action='store_true',
+                          help="List every file checked.")
+
     for sp in (p_config, p_add, p_init, p_list, p_remove):
         sp.add_argument('-d', '--database', dest='db_path',
                         help="Path to the directory where the database file "
@@ -186,6 +196,17 @@ class Dispatcher(object):
                 log(e.message, sys.stderr, bold=True)
             return -1
 
+    def _action_verify(self, args):
+        results = verify_cache()
+        for filename, result in results:
+            if result == OK:
+                self._log("{:10} {}".format(result, filename))
+            else:
+                print("{:10} {}".format(result, filename))
+        ncorrupt = sum(result == CORRUPTED for _, result in results)
+        print("Checked {} files: {} corrupted".format(len(results), ncorrupt))
+        return -1 if ncorrupt else 0
+
 
 if __name__ == '__main__':
     argp, subp = buildArgumentParser()
@@ -195,6 +216,13 @@ if __name__ == '__main__':
         usage(argp, message=msg)
         sys.exit(-1)
 
+    logstream = sys.stderr if args.verbose else None
+    if args.action == 'verify':
+        # The cache is used whether or not the database is standalone
+        disp = Dispatcher(subp.choices['verify'], None,
+                          log=partial(log, stream=logstream))
+        sys.exit(disp.apply('verify', args))
+
     conf = load_calconf()
 
     # Override some options if the user has specified the path to
@@ -213,7 +241,6 @@ if __name__ == '__main__':
         else:
             act = args.action
             lm = LocalManager(expanduser(conf.database_dir))
-            logstream = sys.stderr if args.verbose else None
             disp = Dispatcher(subp.choices[act], lm,
                               log=partial(log, stream=logstream))
             ret = disp.apply(act, args)
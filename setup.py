@@ -205,13 +205,54 @@ SCRIPTS.extend(GEMPY_SCRIPTS)
 
 EXTENSIONS = []
 
+
+def openmp_flags():
+    """
+    Returns the flag needed to compile and link with OpenMP, as a list,
+    which is empty if the compiler doesn't support OpenMP. In that case,
+    the parallel loops in the Cython code are compiled as serial loops.
+    """
+    import shutil
+    import tempfile
+    from distutils.ccompiler import new_compiler
+    from distutils.errors import CompileError, LinkError
+    from distutils.sysconfig import customize_compiler
+
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmpdir, 'test_openmp.c')
+        with open(source, 'w') as f:
+            f.write("#include <omp.h>\n"
+                    "int main(void) { return omp_get_max_threads() < 1; }\n")
+        objects = compiler.compile([source], output_dir=tmpdir,
+                                   extra_postargs=['-fopenmp'])
+        compiler.link_executable(objects, os.path.join(tmpdir, 'test_openmp'),
+                                 extra_postargs=['-fopenmp'])
+    except (CompileError, LinkError):
+        return []
+    finally:
+        shutil.rmtree(tmpdir)
+    return ['-fopenmp']
+
+
 if use_cython:
     suffix = 'pyx'
 else:
     suffix = 'c'
+OPENMP_FLAGS = openmp_flags()
 cyextensions = [Extension(
                         "gempy.library.cyclip",
                         [os.path.join('gempy', 'library', 'cyclip.'+suffix)],
+                        extra_compile_args=OPENMP_FLAGS,
+                        extra_link_args=OPENMP_FLAGS,
+                        ),
+                Extension(
+                        "gempy.library.cytransform",
+                        [os.path.join('gempy', 'library', 'cytransform.'+suffix)],
+                        extra_compile_args=OPENMP_FLAGS,
+                        extra_link_args=OPENMP_FLAGS,
                         ),
                 ]
 if use_cython: